@@ -1,5 +1,15 @@
 # cython: language_level=3
 import base64
+import binascii
+import hashlib
+from array import array
+cimport cython
+cimport cpython.array
+from libc.stdlib cimport malloc, realloc, free
+from libc.string cimport memcpy
+
+
+_deck_code_translation = bytes.maketrans(b'/=', b'-_')
 
 
 class InvalidDeckException(Exception):
@@ -18,6 +28,112 @@ class DeckDecodingException(Exception):
         self.deck_code = deck_code
 
 
+class DeckBatch:
+    """Columnar storage for many decks.
+
+    Deck ``i`` owns ``hero_ids``/``hero_turns`` between ``hero_offsets[i]`` and ``hero_offsets[i + 1]`` and
+    ``card_ids``/``card_counts`` between ``card_offsets[i]`` and ``card_offsets[i + 1]``. Decks that failed to
+    decode have no heroes or cards and the reason in ``errors[i]``, which is None otherwise.
+    """
+
+    def __init__(self, hero_ids=None, hero_turns=None, hero_offsets=None, card_ids=None, card_counts=None,
+                 card_offsets=None, names=None, errors=None):
+        self.hero_ids = array('i') if hero_ids is None else hero_ids
+        self.hero_turns = array('i') if hero_turns is None else hero_turns
+        self.hero_offsets = array('q', [0]) if hero_offsets is None else hero_offsets
+        self.card_ids = array('i') if card_ids is None else card_ids
+        self.card_counts = array('i') if card_counts is None else card_counts
+        self.card_offsets = array('q', [0]) if card_offsets is None else card_offsets
+        self.names = [] if names is None else names
+        self.errors = [None] * len(self.names) if errors is None else errors
+
+    @staticmethod
+    def from_decks(decks):
+        batch = DeckBatch()
+        for deck in decks:
+            batch.append(deck)
+        return batch
+
+    def append(self, deck: dict):
+        for hero in deck['heroes']:
+            self.hero_ids.append(hero['card_id'])
+            self.hero_turns.append(hero['turn'])
+        for card in deck['cards']:
+            self.card_ids.append(card['card_id'])
+            self.card_counts.append(card['count'])
+
+        self.hero_offsets.append(len(self.hero_ids))
+        self.card_offsets.append(len(self.card_ids))
+        self.names.append(deck.get('name', ''))
+        self.errors.append(None)
+
+    def extend(self, other):
+        for offsets, other_offsets, base in [(self.hero_offsets, other.hero_offsets, len(self.hero_ids)),
+                                             (self.card_offsets, other.card_offsets, len(self.card_ids))]:
+            offsets.extend(offset + base for offset in other_offsets[1:])
+
+        self.hero_ids.extend(other.hero_ids)
+        self.hero_turns.extend(other.hero_turns)
+        self.card_ids.extend(other.card_ids)
+        self.card_counts.extend(other.card_counts)
+        self.names.extend(other.names)
+        self.errors.extend(other.errors)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, item):
+        if self.errors[item] is not None:
+            return None
+
+        heroes = [{'card_id': self.hero_ids[i], 'turn': self.hero_turns[i]}
+                  for i in range(self.hero_offsets[item], self.hero_offsets[item + 1])]
+        cards = [{'card_id': self.card_ids[i], 'count': self.card_counts[i]}
+                 for i in range(self.card_offsets[item], self.card_offsets[item + 1])]
+
+        return {'heroes': heroes, 'cards': cards, 'name': self.names[item]}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+cdef Py_ssize_t _write_card(unsigned char *buffer, Py_ssize_t pos, long long count, long long value):
+    # _add_card_to_buffer with the bit helpers inlined, needs room for 11 bytes
+    buffer[pos] = ((3 if count > 3 else count - 1) << 6) | (value & 0x1F) | (0x20 if value >= 0x20 else 0)
+    pos += 1
+
+    value >>= 5
+    while value > 0:
+        buffer[pos] = (value & 0x7F) | (0x80 if value >= 0x80 else 0)
+        pos += 1
+        value >>= 7
+
+    if count > 3:
+        while count > 0:
+            buffer[pos] = (count & 0x7F) | (0x80 if count >= 0x80 else 0)
+            pos += 1
+            count >>= 7
+
+    return pos
+
+
+cdef void _sort_entries(int *ids, int *values, Py_ssize_t length):
+    # stable insertion sort by card id, decks are small
+    cdef Py_ssize_t i, j
+    cdef int card_id, value
+    for i in range(1, length):
+        card_id = ids[i]
+        value = values[i]
+        j = i - 1
+        while j >= 0 and ids[j] > card_id:
+            ids[j + 1] = ids[j]
+            values[j + 1] = values[j]
+            j -= 1
+        ids[j + 1] = card_id
+        values[j + 1] = value
+
+
 class DeckEncoder:
     version = 2
     prefix = 'ADC'
@@ -70,6 +186,103 @@ class DeckEncoder:
 
         return deck_code
 
+    @staticmethod
+    def encode_many(batch: DeckBatch):
+        cdef const int[:] hero_ids = batch.hero_ids
+        cdef const int[:] hero_turns = batch.hero_turns
+        cdef const long long[:] hero_offsets = batch.hero_offsets
+        cdef const int[:] card_ids = batch.card_ids
+        cdef const int[:] card_counts = batch.card_counts
+        cdef const long long[:] card_offsets = batch.card_offsets
+        cdef unsigned char version = DeckEncoder.version << 4 | DeckEncoder._extract_bits_with_carry(5, 3)
+        cdef Py_ssize_t num_decks = len(batch)
+        cdef Py_ssize_t i, j, num_heroes, num_cards, pos, capacity = 0
+        cdef long long last_card_id
+        cdef int *ids = NULL
+        cdef int *values = NULL
+        cdef unsigned char *buffer = NULL
+        cdef void *new_buffer
+        cdef int turns[4]
+        cdef unsigned int checksum
+        cdef bint valid
+        cdef bytes name
+
+        deck_codes = []
+        try:
+            for i in range(num_decks):
+                num_heroes = hero_offsets[i + 1] - hero_offsets[i]
+                num_cards = card_offsets[i + 1] - card_offsets[i]
+
+                if num_heroes + num_cards > capacity:
+                    capacity = 2 * (num_heroes + num_cards)
+                    new_buffer = realloc(ids, capacity * sizeof(int))
+                    if new_buffer is NULL:
+                        raise MemoryError
+                    ids = <int*> new_buffer
+                    new_buffer = realloc(values, capacity * sizeof(int))
+                    if new_buffer is NULL:
+                        raise MemoryError
+                    values = <int*> new_buffer
+                    new_buffer = realloc(buffer, DeckEncoder.header_size + 11 * capacity + 63)
+                    if new_buffer is NULL:
+                        raise MemoryError
+                    buffer = <unsigned char*> new_buffer
+
+                for j in range(num_heroes):
+                    ids[j] = hero_ids[hero_offsets[i] + j]
+                    values[j] = hero_turns[hero_offsets[i] + j]
+                for j in range(num_cards):
+                    ids[num_heroes + j] = card_ids[card_offsets[i] + j]
+                    values[num_heroes + j] = card_counts[card_offsets[i] + j]
+
+                turns[0] = turns[1] = turns[2] = turns[3] = 0
+                for j in range(num_heroes):
+                    turns[values[j] if 0 < values[j] < 4 else 0] += 1
+                valid = num_heroes == 5 and turns[1] == 3 and turns[2] == 1 and turns[3] == 1
+                for j in range(num_heroes, num_heroes + num_cards):
+                    if values[j] < 1:
+                        valid = False
+                if not valid:
+                    raise InvalidDeckException(batch[i])
+
+                _sort_entries(ids, values, num_heroes)
+                _sort_entries(ids + num_heroes, values + num_heroes, num_cards)
+
+                name = bytes(batch.names[i], 'utf-8')[:63]
+
+                buffer[0] = version
+                buffer[1] = 0
+                buffer[2] = len(name)
+                pos = DeckEncoder.header_size
+
+                last_card_id = 0
+                for j in range(num_heroes):
+                    pos = _write_card(buffer, pos, values[j], ids[j] - last_card_id)
+                    last_card_id = ids[j]
+
+                last_card_id = 0
+                for j in range(num_heroes, num_heroes + num_cards):
+                    pos = _write_card(buffer, pos, values[j], ids[j] - last_card_id)
+                    last_card_id = ids[j]
+
+                checksum = 0
+                for j in range(DeckEncoder.header_size, pos):
+                    checksum += buffer[j]
+                buffer[1] = checksum & 0x0FF
+
+                for j in range(len(name)):
+                    buffer[pos + j] = name[j]
+                pos += len(name)
+
+                deck_code = binascii.b2a_base64(buffer[:pos], newline=False).translate(_deck_code_translation)
+                deck_codes.append(DeckEncoder.prefix + deck_code.decode('utf-8'))
+        finally:
+            free(ids)
+            free(values)
+            free(buffer)
+
+        return deck_codes
+
     @staticmethod
     def _compute_checksum(bytes_buffer: bytes):
         checksum = 0
@@ -138,113 +351,477 @@ class DeckEncoder:
         for card in cards:
             if 'count' not in card or 'card_id' not in card:
                 return False
+            # a count below one can not be encoded, encode_many rejects it too
+            if card['count'] < 1:
+                return False
 
         return True
 
 
-class DeckDecoder:
-    version = 2
-    prefix = 'ADC'
-
-    @staticmethod
-    def decode(deck_code: str):
-        deck_code_prefix = deck_code[:len(DeckDecoder.prefix)]
-        if deck_code_prefix != DeckDecoder.prefix:
-            msg = f'Invalid deck code prefix: Got ({deck_code_prefix}) Expected ({DeckDecoder.prefix})'
-            raise DeckDecodingException(deck_code, msg)
-
-        deck_code_no_prefix = deck_code[len(DeckDecoder.prefix):].replace('-', '/').replace('_', '=')
-        deck_code_bytes = base64.decodebytes(bytes(deck_code_no_prefix, 'utf-8'))
-
-        current_byte = 0
-        total_bytes = len(deck_code_bytes)
-
-        version_and_heroes = deck_code_bytes[current_byte]
-        current_byte += 1
-        version = version_and_heroes >> 4
-
-        if version != DeckDecoder.version and version != 1:
-            msg = f'Deck code version ({version}) and decoder version ({DeckDecoder.version}) mismatch'
-            raise DeckDecodingException(deck_code, msg)
+cdef enum:
+    DECODE_OK = 0
+    DECODE_TRUNCATED = 1
+    DECODE_OUT_OF_RANGE = 2
+    DECODE_VERSION = 3
+    DECODE_CHECKSUM = 4
+    DECODE_BASE64 = 5
+    DECODE_FAILED = 6
+
+
+cdef struct DecodedDeck:
+    int status
+    int version
+    int checksum
+    int computed_checksum
+    Py_ssize_t num_heroes
+    Py_ssize_t num_entries
+    Py_ssize_t name_start
+    Py_ssize_t name_end
+
+
+cdef signed char _base64_values[256]
+
+
+cdef void _init_base64_values():
+    cdef int i
+    cdef bytes alphabet = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+    for i in range(256):
+        _base64_values[i] = -1
+    for i in range(64):
+        _base64_values[alphabet[i]] = i
+    # deck codes use - in place of /
+    _base64_values[ord('-')] = 63
+
+
+_init_base64_values()
+
+
+cdef Py_ssize_t _base64_decode(const unsigned char *src, Py_ssize_t length, unsigned char *dst) noexcept nogil:
+    # Only handles canonical base64 with the deck code alphabet and = or _ padding at the end, returns -1 for
+    # anything else so the caller can fall back to base64.decodebytes and its handling of odd input.
+    cdef Py_ssize_t padding = 0
+    cdef Py_ssize_t i
+    cdef Py_ssize_t out = 0
+    cdef int a, b, c, d
+    cdef bint last
+
+    if length % 4:
+        return -1
+
+    while padding < 2 and padding < length and (src[length - 1 - padding] == c'_' or src[length - 1 - padding] == c'='):
+        padding += 1
+
+    for i in range(0, length, 4):
+        last = i + 4 == length
+        a = _base64_values[src[i]]
+        b = _base64_values[src[i + 1]]
+        c = 0 if last and padding == 2 else _base64_values[src[i + 2]]
+        d = 0 if last and padding else _base64_values[src[i + 3]]
+        if a < 0 or b < 0 or c < 0 or d < 0:
+            return -1
+
+        dst[out] = <unsigned char> ((a << 2) | (b >> 4))
+        out += 1
+        if not (last and padding == 2):
+            dst[out] = <unsigned char> (((b & 0x0F) << 4) | (c >> 2))
+            out += 1
+        if not (last and padding):
+            dst[out] = <unsigned char> (((c & 0x03) << 6) | d)
+            out += 1
+
+    return out
+
+
+cdef int _read_varint(const unsigned char *data, Py_ssize_t *pos, Py_ssize_t end, unsigned char base_value,
+                      int base_bits, long long *out) noexcept nogil:
+    cdef long long value = 0
+    cdef int shift = 0
+    cdef unsigned char chunk
+
+    if base_bits:
+        value = base_value & ((1 << base_bits) - 1)
+        if not base_value & (1 << base_bits):
+            out[0] = value
+            return DECODE_OK
+        shift = base_bits
+
+    while True:
+        if pos[0] >= end or shift > 28:
+            return DECODE_TRUNCATED
+        chunk = data[pos[0]]
+        pos[0] += 1
+        value |= (<long long> (chunk & 0x7F)) << shift
+        if not chunk & 0x80:
+            break
+        shift += 7
+
+    out[0] = value
+    return DECODE_OK
+
+
+cdef int _decode_entries(const unsigned char *data, Py_ssize_t pos, Py_ssize_t end, unsigned char version_and_heroes,
+                         int *ids, int *values, Py_ssize_t *num_heroes_out,
+                         Py_ssize_t *num_entries_out) noexcept nogil:
+    # ids/values need room for end - pos entries, every entry takes at least one byte
+    cdef long long num_heroes
+    cdef long long card_id = 0
+    cdef long long value
+    cdef long long count
+    cdef Py_ssize_t entry = 0
+    cdef unsigned char header
+    cdef int status
+
+    status = _read_varint(data, &pos, end, version_and_heroes, 3, &num_heroes)
+    if status != DECODE_OK:
+        return status
+
+    while entry < num_heroes or pos < end:
+        if entry == num_heroes:
+            card_id = 0
+
+        if pos >= end:
+            return DECODE_TRUNCATED
+
+        header = data[pos]
+        pos += 1
+
+        status = _read_varint(data, &pos, end, header, 5, &value)
+        if status != DECODE_OK:
+            return status
+        card_id += value
+
+        count = (header >> 6) + 1
+        if count == 4:
+            status = _read_varint(data, &pos, end, 0, 0, &count)
+            if status != DECODE_OK:
+                return status
+
+        if card_id > 0x7FFFFFFF or count > 0x7FFFFFFF:
+            return DECODE_OUT_OF_RANGE
+
+        ids[entry] = <int> card_id
+        values[entry] = <int> count
+        entry += 1
+
+    num_heroes_out[0] = <Py_ssize_t> num_heroes
+    num_entries_out[0] = entry
+    return DECODE_OK
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _parse_deck(const unsigned char[:] data, int decoder_version, int *ids, int *values,
+                     DecodedDeck *deck) noexcept nogil:
+    # Parses the base64 decoded bytes of a deck code into ids/values (room for len(data) entries) and deck, heroes
+    # come first in ids/values followed by the cards.
+    cdef Py_ssize_t total = data.shape[0]
+    cdef Py_ssize_t pos
+    cdef Py_ssize_t end
+    cdef Py_ssize_t string_length = 0
+    cdef Py_ssize_t i
+    cdef unsigned int computed_checksum = 0
+
+    if total < 2:
+        return DECODE_TRUNCATED
+
+    deck.version = data[0] >> 4
+    if deck.version != decoder_version and deck.version != 1:
+        return DECODE_VERSION
+
+    deck.checksum = data[1]
+    pos = 2
+
+    if deck.version > 1:
+        if total < 3:
+            return DECODE_TRUNCATED
+        string_length = data[2]
+        pos = 3
+    end = total - string_length
+    if end < pos:
+        return DECODE_TRUNCATED
+
+    for i in range(pos, end):
+        computed_checksum += data[i]
+    deck.computed_checksum = computed_checksum & 0x0FF
+    if deck.checksum != deck.computed_checksum:
+        return DECODE_CHECKSUM
+
+    deck.name_start = end
+    deck.name_end = total
+    return _decode_entries(&data[0], pos, end, data[0], ids, values, &deck.num_heroes, &deck.num_entries)
+
+
+cdef Py_ssize_t _fingerprint_payload(const unsigned char *data, Py_ssize_t pos, Py_ssize_t end,
+                                     Py_ssize_t num_heroes, unsigned char *out) noexcept nogil:
+    # Writes the bytes DeckDecoder.fingerprint hashes to out (room for end + 1 bytes) and returns their length.
+    # data[pos:end] must already have been validated by _parse_deck.
+    cdef Py_ssize_t length = 1
+    cdef Py_ssize_t entry
+    cdef unsigned char header
+
+    out[0] = data[0] & 0x0F
+    if data[0] & 0x08:
+        while True:
+            out[length] = data[pos]
+            length += 1
+            pos += 1
+            if not data[pos - 1] & 0x80:
+                break
+
+    for entry in range(num_heroes):
+        header = data[pos]
+        pos += 1
+        out[length] = header & 0x3F
+        length += 1
+
+        if header & 0x20:
+            while True:
+                out[length] = data[pos]
+                length += 1
+                pos += 1
+                if not data[pos - 1] & 0x80:
+                    break
 
-        checksum = deck_code_bytes[current_byte]
-        current_byte += 1
+        if header >> 6 == 3:
+            while data[pos] & 0x80:
+                pos += 1
+            pos += 1
 
-        string_length = 0
-        if version > 1:
-            string_length = deck_code_bytes[current_byte]
-            current_byte += 1
-        total_card_bytes = total_bytes - string_length
+    memcpy(&out[length], &data[pos], end - pos)
+    return length + end - pos
 
-        computed_checksum = DeckEncoder._compute_checksum(deck_code_bytes[current_byte:total_card_bytes]) & 0x0FF
-        if checksum != computed_checksum:
-            msg = f'Checksum in deck code ({checksum}) does not match computed checksum ({computed_checksum})'
-            raise DeckDecodingException(deck_code, msg)
 
-        num_heroes, current_byte = DeckDecoder._read_int(version_and_heroes, 3, deck_code_bytes, current_byte,
-                                                         total_card_bytes)
+cdef _decode_error(deck_code, DecodedDeck *deck):
+    if deck.status == DECODE_VERSION:
+        msg = f'Deck code version ({deck.version}) and decoder version ({DeckDecoder.version}) mismatch'
+    elif deck.status == DECODE_CHECKSUM:
+        msg = (f'Checksum in deck code ({deck.checksum}) does not match computed checksum '
+               f'({deck.computed_checksum})')
+    elif deck.status == DECODE_OUT_OF_RANGE:
+        msg = 'Card value out of range'
+    else:
+        msg = 'Deck code is truncated'
+    return DeckDecodingException(deck_code, msg)
 
-        heroes = []
-        last_card_id = 0
-        for i in range(num_heroes):
-            card_id, turn, current_byte = DeckDecoder._read_serialized_card(deck_code_bytes, current_byte,
-                                                                            total_card_bytes, last_card_id)
-            last_card_id = card_id
-            heroes.append({'card_id': card_id, 'turn': turn})
 
-        cards = []
-        last_card_id = 0
-        while current_byte < total_card_bytes:
-            card_id, count, current_byte = DeckDecoder._read_serialized_card(deck_code_bytes, current_byte,
-                                                                             total_card_bytes, last_card_id)
-            last_card_id = card_id
-            cards.append({'card_id': card_id, 'count': count})
+class DeckDecoder:
+    version = 2
+    prefix = 'ADC'
 
-        name = ''
-        if current_byte <= total_bytes:
-            name = deck_code_bytes[-string_length:].decode('utf-8')
+    @staticmethod
+    def decode(deck_code: str):
+        data = DeckDecoder._read_code_bytes(deck_code)
+        cdef const unsigned char[:] view = data
+        cdef int decoder_version = DeckDecoder.version
+        cdef DecodedDeck deck
+        cdef int *ids = <int*> malloc((len(data) + 1) * sizeof(int))
+        cdef int *values = <int*> malloc((len(data) + 1) * sizeof(int))
+
+        try:
+            if ids is NULL or values is NULL:
+                raise MemoryError
+
+            with nogil:
+                deck.status = _parse_deck(view, decoder_version, ids, values, &deck)
+            if deck.status != DECODE_OK:
+                raise _decode_error(deck_code, &deck)
+
+            heroes = [{'card_id': ids[i], 'turn': values[i]} for i in range(deck.num_heroes)]
+            cards = [{'card_id': ids[i], 'count': values[i]} for i in range(deck.num_heroes, deck.num_entries)]
+            name = data[deck.name_start:deck.name_end].decode('utf-8')
+        finally:
+            free(ids)
+            free(values)
 
         return {'heroes': heroes, 'cards': cards, 'name': name}
 
     @staticmethod
-    def _read_serialized_card(data, start, end, last_card_id):
-        header = data[start]
-        start += 1
-        extended_count = (header >> 6) == 0x03
+    def fingerprint(deck_code):
+        """Hash of the heroes and cards of a deck code, ignoring its name and hero turns.
+
+        The card section of the decoded bytes is hashed as is (after the checksum check) with the turn bits of the
+        hero entries masked out, so codes from the standard encoder (which sorts heroes and cards by id) for the same
+        heroes and card counts get the same 16 byte digest.
+        """
+        data = DeckDecoder._read_code_bytes(deck_code)
+        cdef const unsigned char[:] view = data
+        cdef int decoder_version = DeckDecoder.version
+        cdef DecodedDeck deck
+        cdef Py_ssize_t length = 0
+        cdef int *ids = <int*> malloc((len(data) + 1) * sizeof(int))
+        cdef int *values = <int*> malloc((len(data) + 1) * sizeof(int))
+        cdef unsigned char *payload = <unsigned char*> malloc(len(data) + 1)
+
+        try:
+            if ids is NULL or values is NULL or payload is NULL:
+                raise MemoryError
+
+            with nogil:
+                deck.status = _parse_deck(view, decoder_version, ids, values, &deck)
+                if deck.status == DECODE_OK:
+                    length = _fingerprint_payload(&view[0], 3 if deck.version > 1 else 2, deck.name_start,
+                                                  deck.num_heroes, payload)
+            if deck.status != DECODE_OK:
+                raise _decode_error(deck_code, &deck)
+
+            return hashlib.blake2b(payload[:length], digest_size=16).digest()
+        finally:
+            free(ids)
+            free(values)
+            free(payload)
 
-        card_delta, start = DeckDecoder._read_int(header, 5, data, start, end)
-        card_id = last_card_id + card_delta
-
-        if extended_count:
-            count, start = DeckDecoder._read_int(0, 0, data, start, end)
-        else:
-            count = (header >> 6) + 1
+    @staticmethod
+    def fingerprint_many(deck_codes):
+        """fingerprint for every deck code, None for codes that fail to decode."""
+        fingerprints = []
+        for deck_code in deck_codes:
+            try:
+                fingerprints.append(DeckDecoder.fingerprint(deck_code))
+            except Exception:
+                fingerprints.append(None)
 
-        return card_id, count, start
+        return fingerprints
 
     @staticmethod
-    def _read_int(base_value, base_bits, data, start, end):
-        out = 0
-        delta_shift = 0
-        out, cont = DeckDecoder._read_bits_chunk(base_value, base_bits, delta_shift, out)
-        if base_bits == 0 or cont:
-            delta_shift += base_bits
+    def decode_many(deck_codes):
+        """Decode every deck code into a DeckBatch.
+
+        The base64 and varint decoding runs without the GIL so batches can be decoded concurrently from threads.
+        """
+        deck_codes = list(deck_codes)
+        batch = DeckBatch()
+        cdef cpython.array.array hero_ids = batch.hero_ids
+        cdef cpython.array.array hero_turns = batch.hero_turns
+        cdef cpython.array.array card_ids = batch.card_ids
+        cdef cpython.array.array card_counts = batch.card_counts
+        cdef Py_ssize_t num_codes = len(deck_codes)
+        cdef Py_ssize_t i, start, length, total = 0
+        cdef int decoder_version = DeckDecoder.version
+        cdef DecodedDeck *decks = <DecodedDeck*> malloc((num_codes + 1) * sizeof(DecodedDeck))
+        cdef Py_ssize_t *offsets = <Py_ssize_t*> malloc((num_codes + 1) * sizeof(Py_ssize_t))
+        cdef Py_ssize_t *lengths = <Py_ssize_t*> malloc((num_codes + 1) * sizeof(Py_ssize_t))
+        cdef int *ids = NULL
+        cdef int *values = NULL
+        cdef const unsigned char[:] encoded_view
+        cdef unsigned char[:] decoded_view
+        cdef const unsigned char *encoded_ptr
+        cdef unsigned char *decoded_ptr
+
+        try:
+            if decks is NULL or offsets is NULL or lengths is NULL:
+                raise MemoryError
+
+            # strip the prefixes and lay all codes out in one buffer, decoded bytes never outgrow their code
+            errors = [None] * num_codes
+            encoded_codes = []
+            offsets[0] = 0
+            for i in range(num_codes):
+                deck_code = deck_codes[i]
+                decks[i].status = DECODE_OK
+                try:
+                    deck_code_prefix = deck_code[:len(DeckDecoder.prefix)]
+                    if deck_code_prefix != DeckDecoder.prefix:
+                        msg = f'Invalid deck code prefix: Got ({deck_code_prefix}) Expected ({DeckDecoder.prefix})'
+                        raise DeckDecodingException(deck_code, msg)
+                    encoded = bytes(deck_code[len(DeckDecoder.prefix):], 'utf-8')
+                except Exception as e:
+                    errors[i] = e
+                    decks[i].status = DECODE_FAILED
+                    encoded = b''
+                encoded_codes.append(encoded)
+                total += len(encoded)
+                offsets[i + 1] = total
+
+            encoded_all = b''.join(encoded_codes)
+            del encoded_codes
+            decoded_all = bytearray(total + 1)
+            encoded_view = encoded_all
+            decoded_view = decoded_all
+            encoded_ptr = &encoded_view[0] if total else NULL
+            decoded_ptr = &decoded_view[0]
+
+            ids = <int*> malloc((total + 1) * sizeof(int))
+            values = <int*> malloc((total + 1) * sizeof(int))
+            if ids is NULL or values is NULL:
+                raise MemoryError
+
+            with nogil:
+                for i in range(num_codes):
+                    if decks[i].status != DECODE_OK:
+                        continue
+                    start = offsets[i]
+                    lengths[i] = _base64_decode(encoded_ptr + start, offsets[i + 1] - start, decoded_ptr + start)
+                    if lengths[i] < 0:
+                        decks[i].status = DECODE_BASE64
+                        continue
+                    decks[i].status = _parse_deck(decoded_view[start:start + lengths[i]], decoder_version,
+                                                  ids + start, values + start, &decks[i])
+
+            for i in range(num_codes):
+                name = ''
+                error = errors[i]
+                start = offsets[i]
+                if error is None:
+                    try:
+                        if decks[i].status == DECODE_BASE64:
+                            deck_code_no_prefix = deck_codes[i][len(DeckDecoder.prefix):]
+                            deck_code_no_prefix = deck_code_no_prefix.replace('-', '/').replace('_', '=')
+                            data = base64.decodebytes(bytes(deck_code_no_prefix, 'utf-8'))
+                            lengths[i] = len(data)
+                            if lengths[i]:
+                                memcpy(decoded_ptr + start, <const unsigned char*> data, lengths[i])
+                            decks[i].status = _parse_deck(decoded_view[start:start + lengths[i]], decoder_version,
+                                                          ids + start, values + start, &decks[i])
+
+                        if decks[i].status != DECODE_OK:
+                            raise _decode_error(deck_codes[i], &decks[i])
+
+                        name = decoded_all[start + decks[i].name_start:start + decks[i].name_end].decode('utf-8')
+                    except Exception as e:
+                        error = e
+
+                if error is None:
+                    cpython.array.extend_buffer(hero_ids, <char*> (ids + start), decks[i].num_heroes)
+                    cpython.array.extend_buffer(hero_turns, <char*> (values + start), decks[i].num_heroes)
+                    cpython.array.extend_buffer(card_ids, <char*> (ids + start + decks[i].num_heroes),
+                                                decks[i].num_entries - decks[i].num_heroes)
+                    cpython.array.extend_buffer(card_counts, <char*> (values + start + decks[i].num_heroes),
+                                                decks[i].num_entries - decks[i].num_heroes)
+                else:
+                    error = f'{type(error).__name__}: {error}'
+
+                batch.hero_offsets.append(len(hero_ids))
+                batch.card_offsets.append(len(card_ids))
+                batch.names.append(name)
+                batch.errors.append(error)
+        finally:
+            free(decks)
+            free(offsets)
+            free(lengths)
+            free(ids)
+            free(values)
+
+        return batch
 
-            while True:
-                next_byte = data[start]
-                start += 1
-                out, cont = DeckDecoder._read_bits_chunk(next_byte, 7, delta_shift, out)
-                if not cont:
-                    break
+    @staticmethod
+    def _read_code_bytes(deck_code):
+        deck_code_prefix = deck_code[:len(DeckDecoder.prefix)]
+        if deck_code_prefix != DeckDecoder.prefix:
+            msg = f'Invalid deck code prefix: Got ({deck_code_prefix}) Expected ({DeckDecoder.prefix})'
+            raise DeckDecodingException(deck_code, msg)
 
-                delta_shift += 7
+        encoded = bytes(deck_code[len(DeckDecoder.prefix):], 'utf-8')
+        decoded = bytearray(len(encoded))
+        cdef const unsigned char *encoded_ptr = encoded
+        cdef unsigned char *decoded_ptr = decoded
+        cdef Py_ssize_t length = len(encoded)
 
-        return out, start
+        with nogil:
+            length = _base64_decode(encoded_ptr, length, decoded_ptr)
 
-    @staticmethod
-    def _read_bits_chunk(chunk, num_bits, current_shift, out):
-        continue_bit = 1 << num_bits
-        new_bites = chunk & (continue_bit - 1)
-        out |= new_bites << current_shift
+        if length < 0:
+            deck_code_no_prefix = deck_code[len(DeckDecoder.prefix):].replace('-', '/').replace('_', '=')
+            return base64.decodebytes(bytes(deck_code_no_prefix, 'utf-8'))
 
-        return out, (chunk & continue_bit) != 0
+        del decoded[length:]
+        return decoded
@@ -1,4 +1,11 @@
 import base64
+import binascii
+import hashlib
+from array import array
+from operator import itemgetter
+
+
+_deck_code_translation = bytes.maketrans(b'/=', b'-_')
 
 
 class InvalidDeckException(Exception):
@@ -17,6 +24,76 @@ class DeckDecodingException(Exception):
         self.deck_code = deck_code
 
 
+class DeckBatch:
+    """Columnar storage for many decks.
+
+    Deck ``i`` owns ``hero_ids``/``hero_turns`` between ``hero_offsets[i]`` and ``hero_offsets[i + 1]`` and
+    ``card_ids``/``card_counts`` between ``card_offsets[i]`` and ``card_offsets[i + 1]``. Decks that failed to
+    decode have no heroes or cards and the reason in ``errors[i]``, which is None otherwise.
+    """
+
+    def __init__(self, hero_ids=None, hero_turns=None, hero_offsets=None, card_ids=None, card_counts=None,
+                 card_offsets=None, names=None, errors=None):
+        self.hero_ids = array('i') if hero_ids is None else hero_ids
+        self.hero_turns = array('i') if hero_turns is None else hero_turns
+        self.hero_offsets = array('q', [0]) if hero_offsets is None else hero_offsets
+        self.card_ids = array('i') if card_ids is None else card_ids
+        self.card_counts = array('i') if card_counts is None else card_counts
+        self.card_offsets = array('q', [0]) if card_offsets is None else card_offsets
+        self.names = [] if names is None else names
+        self.errors = [None] * len(self.names) if errors is None else errors
+
+    @staticmethod
+    def from_decks(decks):
+        batch = DeckBatch()
+        for deck in decks:
+            batch.append(deck)
+        return batch
+
+    def append(self, deck: dict):
+        for hero in deck['heroes']:
+            self.hero_ids.append(hero['card_id'])
+            self.hero_turns.append(hero['turn'])
+        for card in deck['cards']:
+            self.card_ids.append(card['card_id'])
+            self.card_counts.append(card['count'])
+
+        self.hero_offsets.append(len(self.hero_ids))
+        self.card_offsets.append(len(self.card_ids))
+        self.names.append(deck.get('name', ''))
+        self.errors.append(None)
+
+    def extend(self, other):
+        for offsets, other_offsets, base in [(self.hero_offsets, other.hero_offsets, len(self.hero_ids)),
+                                             (self.card_offsets, other.card_offsets, len(self.card_ids))]:
+            offsets.extend(offset + base for offset in other_offsets[1:])
+
+        self.hero_ids.extend(other.hero_ids)
+        self.hero_turns.extend(other.hero_turns)
+        self.card_ids.extend(other.card_ids)
+        self.card_counts.extend(other.card_counts)
+        self.names.extend(other.names)
+        self.errors.extend(other.errors)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, item):
+        if self.errors[item] is not None:
+            return None
+
+        heroes = [{'card_id': self.hero_ids[i], 'turn': self.hero_turns[i]}
+                  for i in range(self.hero_offsets[item], self.hero_offsets[item + 1])]
+        cards = [{'card_id': self.card_ids[i], 'count': self.card_counts[i]}
+                 for i in range(self.card_offsets[item], self.card_offsets[item + 1])]
+
+        return {'heroes': heroes, 'cards': cards, 'name': self.names[item]}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
 class DeckEncoder:
     version = 2
     prefix = 'ADC'
@@ -69,6 +146,69 @@ class DeckEncoder:
 
         return deck_code
 
+    @staticmethod
+    def encode_many(batch: DeckBatch):
+        hero_ids, hero_turns, hero_offsets = batch.hero_ids, batch.hero_turns, batch.hero_offsets
+        card_ids, card_counts, card_offsets = batch.card_ids, batch.card_counts, batch.card_offsets
+        version = DeckEncoder.version << 4 | DeckEncoder._extract_bits_with_carry(5, 3)
+        by_card_id = itemgetter(0)
+
+        deck_codes = []
+        buffer = bytearray()
+        for i in range(len(batch)):
+            heroes = sorted(zip(hero_ids[hero_offsets[i]:hero_offsets[i + 1]],
+                                hero_turns[hero_offsets[i]:hero_offsets[i + 1]]), key=by_card_id)
+            cards = sorted(zip(card_ids[card_offsets[i]:card_offsets[i + 1]],
+                               card_counts[card_offsets[i]:card_offsets[i + 1]]), key=by_card_id)
+
+            turns = [0, 0, 0, 0]
+            for _, turn in heroes:
+                turns[turn if 0 < turn < 4 else 0] += 1
+            if len(heroes) != 5 or turns[1] != 3 or turns[2] != 1 or turns[3] != 1 \
+                    or any(count < 1 for _, count in cards):
+                raise InvalidDeckException(batch[i])
+
+            name = bytes(batch.names[i], 'utf-8')[:63]
+
+            del buffer[:]
+            buffer += bytes((version, 0, len(name)))
+
+            last_card_id = 0
+            for card_id, turn in heroes:
+                DeckEncoder._write_card(buffer, turn, card_id - last_card_id)
+                last_card_id = card_id
+
+            last_card_id = 0
+            for card_id, count in cards:
+                DeckEncoder._write_card(buffer, count, card_id - last_card_id)
+                last_card_id = card_id
+
+            buffer[1] = sum(memoryview(buffer)[DeckEncoder.header_size:]) & 0x0FF
+            buffer += name
+
+            deck_code = binascii.b2a_base64(buffer, newline=False).translate(_deck_code_translation)
+            deck_codes.append(DeckEncoder.prefix + deck_code.decode('utf-8'))
+
+        return deck_codes
+
+    @staticmethod
+    def _write_card(buffer: bytearray, count: int, value: int):
+        # _add_card_to_buffer with the bit helpers inlined
+        if count > 3:
+            buffer.append(0xC0 | (value & 0x1F) | (0x20 if value >= 0x20 else 0))
+        else:
+            buffer.append((count - 1) << 6 | (value & 0x1F) | (0x20 if value >= 0x20 else 0))
+
+        value >>= 5
+        while value > 0:
+            buffer.append((value & 0x7F) | (0x80 if value >= 0x80 else 0))
+            value >>= 7
+
+        if count > 3:
+            while count > 0:
+                buffer.append((count & 0x7F) | (0x80 if count >= 0x80 else 0))
+                count >>= 7
+
     @staticmethod
     def _compute_checksum(bytes_buffer: bytes):
         checksum = 0
@@ -137,6 +277,9 @@ class DeckEncoder:
         for card in cards:
             if 'count' not in card or 'card_id' not in card:
                 return False
+            # a count below one can not be encoded, encode_many rejects it too
+            if card['count'] < 1:
+                return False
 
         return True
 
@@ -147,6 +290,166 @@ class DeckDecoder:
 
     @staticmethod
     def decode(deck_code: str):
+        hero_ids, hero_turns, card_ids, card_counts = [], [], [], []
+        name = DeckDecoder._decode_into(deck_code, hero_ids, hero_turns, card_ids, card_counts)
+
+        return {'heroes': [{'card_id': card_id, 'turn': turn} for card_id, turn in zip(hero_ids, hero_turns)],
+                'cards': [{'card_id': card_id, 'count': count} for card_id, count in zip(card_ids, card_counts)],
+                'name': name}
+
+    @staticmethod
+    def decode_many(deck_codes):
+        batch = DeckBatch()
+        hero_ids, hero_turns, card_ids, card_counts = batch.hero_ids, batch.hero_turns, batch.card_ids, batch.card_counts
+
+        for deck_code in deck_codes:
+            num_hero_entries = len(hero_ids)
+            num_card_entries = len(card_ids)
+            try:
+                name = DeckDecoder._decode_into(deck_code, hero_ids, hero_turns, card_ids, card_counts)
+                error = None
+            except Exception as e:
+                del hero_ids[num_hero_entries:], hero_turns[num_hero_entries:]
+                del card_ids[num_card_entries:], card_counts[num_card_entries:]
+                name = ''
+                error = f'{type(e).__name__}: {e}'
+
+            batch.hero_offsets.append(len(hero_ids))
+            batch.card_offsets.append(len(card_ids))
+            batch.names.append(name)
+            batch.errors.append(error)
+
+        return batch
+
+    @staticmethod
+    def fingerprint(deck_code):
+        """Hash of the heroes and cards of a deck code, ignoring its name and hero turns.
+
+        The card section of the decoded bytes is hashed as is (after the checksum check) with the turn bits of the
+        hero entries masked out, so codes from the standard encoder (which sorts heroes and cards by id) for the same
+        heroes and card counts get the same 16 byte digest.
+        """
+        data, version_and_heroes, pos, end = DeckDecoder._read_header(deck_code)
+
+        start = pos
+        num_heroes, pos = DeckDecoder._read_varint(deck_code, data, pos, end, version_and_heroes, 3)
+        payload = bytearray([version_and_heroes & 0x0F])
+        payload += data[start:pos]
+
+        entry = 0
+        card_id = 0
+        cards_start = end
+        while entry < num_heroes or pos < end:
+            if entry == num_heroes:
+                card_id = 0
+                cards_start = pos
+
+            if pos >= end:
+                raise DeckDecodingException(deck_code, 'Deck code is truncated')
+
+            start = pos
+            header = data[pos]
+            pos += 1
+
+            value, pos = DeckDecoder._read_varint(deck_code, data, pos, end, header, 5)
+            card_id += value
+            delta_end = pos
+
+            count = (header >> 6) + 1
+            if count == 4:
+                count, pos = DeckDecoder._read_varint(deck_code, data, pos, end, 0, 0)
+
+            if card_id > 0x7FFFFFFF or count > 0x7FFFFFFF:
+                raise DeckDecodingException(deck_code, 'Card value out of range')
+
+            if entry < num_heroes:
+                payload.append(header & 0x3F)
+                payload += data[start + 1:delta_end]
+            entry += 1
+
+        payload += data[cards_start:end]
+
+        return hashlib.blake2b(payload, digest_size=16).digest()
+
+    @staticmethod
+    def fingerprint_many(deck_codes):
+        """fingerprint for every deck code, None for codes that fail to decode."""
+        fingerprints = []
+        for deck_code in deck_codes:
+            try:
+                fingerprints.append(DeckDecoder.fingerprint(deck_code))
+            except Exception:
+                fingerprints.append(None)
+
+        return fingerprints
+
+    @staticmethod
+    def _decode_into(deck_code, hero_ids, hero_turns, card_ids, card_counts):
+        data, version_and_heroes, pos, end = DeckDecoder._read_header(deck_code)
+
+        num_heroes, pos = DeckDecoder._read_varint(deck_code, data, pos, end, version_and_heroes, 3)
+
+        # every entry is a header byte with the count (or turn) and the low bits of the card_id delta, then varints
+        # for the rest of the delta and extended counts, heroes first then cards
+        entry = 0
+        card_id = 0
+        while entry < num_heroes or pos < end:
+            if entry == num_heroes:
+                card_id = 0
+
+            if pos >= end:
+                raise DeckDecodingException(deck_code, 'Deck code is truncated')
+
+            header = data[pos]
+            pos += 1
+
+            if header & 0x20:
+                value, pos = DeckDecoder._read_varint(deck_code, data, pos, end, header, 5)
+            else:
+                value = header & 0x1F
+            card_id += value
+
+            count = (header >> 6) + 1
+            if count == 4:
+                count, pos = DeckDecoder._read_varint(deck_code, data, pos, end, 0, 0)
+
+            if card_id > 0x7FFFFFFF or count > 0x7FFFFFFF:
+                raise DeckDecodingException(deck_code, 'Card value out of range')
+
+            if entry < num_heroes:
+                hero_ids.append(card_id)
+                hero_turns.append(count)
+            else:
+                card_ids.append(card_id)
+                card_counts.append(count)
+            entry += 1
+
+        return data[end:].decode('utf-8')
+
+    @staticmethod
+    def _read_varint(deck_code, data, pos, end, base_value, base_bits):
+        value = 0
+        shift = 0
+        if base_bits:
+            value = base_value & ((1 << base_bits) - 1)
+            if not base_value & (1 << base_bits):
+                return value, pos
+            shift = base_bits
+
+        while True:
+            if pos >= end or shift > 28:
+                raise DeckDecodingException(deck_code, 'Deck code is truncated')
+            chunk = data[pos]
+            pos += 1
+            value |= (chunk & 0x7F) << shift
+            if not chunk & 0x80:
+                break
+            shift += 7
+
+        return value, pos
+
+    @staticmethod
+    def _read_header(deck_code):
         deck_code_prefix = deck_code[:len(DeckDecoder.prefix)]
         if deck_code_prefix != DeckDecoder.prefix:
             msg = f'Invalid deck code prefix: Got ({deck_code_prefix}) Expected ({DeckDecoder.prefix})'
@@ -157,6 +460,8 @@ class DeckDecoder:
 
         current_byte = 0
         total_bytes = len(deck_code_bytes)
+        if total_bytes < 2:
+            raise DeckDecodingException(deck_code, 'Deck code is truncated')
 
         version_and_heroes = deck_code_bytes[current_byte]
         current_byte += 1
@@ -171,85 +476,17 @@ class DeckDecoder:
 
         string_length = 0
         if version > 1:
+            if total_bytes < 3:
+                raise DeckDecodingException(deck_code, 'Deck code is truncated')
             string_length = deck_code_bytes[current_byte]
             current_byte += 1
         total_card_bytes = total_bytes - string_length
+        if total_card_bytes < current_byte:
+            raise DeckDecodingException(deck_code, 'Deck code is truncated')
 
-        computed_checksum = DeckEncoder._compute_checksum(deck_code_bytes[current_byte:total_card_bytes]) & 0x0FF
+        computed_checksum = sum(deck_code_bytes[current_byte:total_card_bytes]) & 0x0FF
         if checksum != computed_checksum:
             msg = f'Checksum in deck code ({checksum}) does not match computed checksum ({computed_checksum})'
             raise DeckDecodingException(deck_code, msg)
 
-        num_heroes, current_byte = DeckDecoder._read_int(version_and_heroes, 3, deck_code_bytes, current_byte,
-                                                         total_card_bytes)
-
-        heroes = []
-        last_card_id = 0
-        for i in range(num_heroes):
-            card_id, turn, current_byte = DeckDecoder._read_serialized_card(deck_code_bytes, current_byte,
-                                                                            total_card_bytes, last_card_id)
-            last_card_id = card_id
-            heroes.append({'card_id': card_id, 'turn': turn})
-
-        cards = []
-        last_card_id = 0
-        while current_byte < total_card_bytes:
-            card_id, count, current_byte = DeckDecoder._read_serialized_card(deck_code_bytes, current_byte,
-                                                                             total_card_bytes, last_card_id)
-            last_card_id = card_id
-            cards.append({'card_id': card_id, 'count': count})
-
-        name = ''
-        if current_byte <= total_bytes:
-            name = deck_code_bytes[-string_length:].decode('utf-8')
-
-        return {'heroes': heroes, 'cards': cards, 'name': name}
-
-    @staticmethod
-    def _read_serialized_card(data, start, end, last_card_id):
-        if start > end:
-            raise Exception()
-
-        header = data[start]
-        start += 1
-        extended_count = (header >> 6) == 0x03
-
-        card_delta, start = DeckDecoder._read_int(header, 5, data, start, end)
-        card_id = last_card_id + card_delta
-
-        if extended_count:
-            count, start = DeckDecoder._read_int(0, 0, data, start, end)
-        else:
-            count = (header >> 6) + 1
-
-        return card_id, count, start
-
-    @staticmethod
-    def _read_int(base_value, base_bits, data, start, end):
-        out = 0
-        delta_shift = 0
-        out, cont = DeckDecoder._read_bits_chunk(base_value, base_bits, delta_shift, out)
-        if base_bits == 0 or cont:
-            delta_shift += base_bits
-
-            while True:
-                if start > end:
-                    raise Exception()
-
-                next_byte = data[start]
-                start += 1
-                out, cont = DeckDecoder._read_bits_chunk(next_byte, 7, delta_shift, out)
-                if not cont:
-                    break
-
-                delta_shift += 7
-
-        return out, start
-
-    @staticmethod
-    def _read_bits_chunk(chunk, num_bits, current_shift, out):
-        continue_bit = 1 << num_bits
-        new_bites = chunk & (continue_bit - 1)
-        out |= new_bites << current_shift
-
-        return out, (chunk & continue_bit) != 0
+        return deck_code_bytes, version_and_heroes, current_byte, total_card_bytes
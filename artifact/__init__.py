@@ -0,0 +1,27 @@
+"""Artifact card API wrapper and deck code encoder/decoder.
+
+``adc`` and ``cards`` are the compiled extensions when they have been built and the pure Python modules otherwise.
+Each is only imported the first time it is used, so a worker that only decodes deck codes never loads the card
+modules, and nothing touches the network or the card set cache (see cards.set_cache_dir) until a set is loaded.
+"""
+import importlib
+
+_implementations = {'adc': ('artifact.adc', 'adc_py'), 'cards': ('artifact.cards', 'cards_py')}
+
+
+def __getattr__(name):
+    if name not in _implementations:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    compiled, pure = _implementations[name]
+    try:
+        module = importlib.import_module(compiled)
+    except ImportError:
+        module = importlib.import_module(pure)
+    globals()[name] = module
+
+    return module
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_implementations))
@@ -0,0 +1,273 @@
+"""Mutable deck for local search over decks, keeping its deck code up to date as cards are added and removed.
+
+    builder = DeckBuilder.from_deck_code(deck_code, card_set.cards)
+    builder.swap(old_card_id, new_card_id)
+    builder.code()       # the same code DeckEncoder.encode gives for builder.to_code_deck_dict()
+    builder.is_legal()   # the same as DeckValidator.is_valid without looking at every card
+
+Heroes and cards are kept sorted by card_id together with their encoded entries (card ids are stored as the
+difference to the previous one, so a change re-encodes at most two entries) and the byte sum the checksum is taken
+from. code() then only joins the entries and base64 encodes them. With a card pool the main deck size, item count,
+cards over max_copies and unknown cards are kept up to date as well, counting the signature cards of the heroes as
+DeckValidator does.
+"""
+import binascii
+import bisect
+import functools
+import sys
+
+from artifact import adc
+
+_deck_code_translation = bytes.maketrans(b'/=', b'-_')
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def encode_entry(count, value):
+    """The bytes DeckEncoder writes for a card (or hero) with count copies (or turn) value after the previous card_id."""
+    entry = bytearray()
+    if count > 3:
+        entry.append(0xC0 | (value & 0x1F) | (0x20 if value >= 0x20 else 0))
+    else:
+        entry.append((count - 1) << 6 | (value & 0x1F) | (0x20 if value >= 0x20 else 0))
+
+    value >>= 5
+    while value > 0:
+        entry.append((value & 0x7F) | (0x80 if value >= 0x80 else 0))
+        value >>= 7
+
+    if count > 3:
+        while count > 0:
+            entry.append((count & 0x7F) | (0x80 if count >= 0x80 else 0))
+            count >>= 7
+
+    return bytes(entry)
+
+
+class Entries:
+    """card_ids in ascending order with their values (copies or turns), encoded entries and the sum of their bytes."""
+    __slots__ = ['card_ids', 'values', 'encoded', 'byte_sum', 'lookup']
+
+    def __init__(self):
+        self.card_ids = []
+        self.values = []
+        self.encoded = []
+        self.byte_sum = 0
+        # card_id -> value, for reads without a search
+        self.lookup = {}
+
+    def get(self, card_id):
+        return self.lookup.get(card_id, 0)
+
+    def set(self, card_id, value):
+        """Set the value of card_id, 0 removes it."""
+        card_ids = self.card_ids
+        present = card_id in self.lookup
+        k = bisect.bisect_left(card_ids, card_id)
+        if not value:
+            if present:
+                del self.lookup[card_id]
+                del card_ids[k], self.values[k]
+                self.byte_sum -= sum(self.encoded.pop(k))
+                # the next entry now follows the one before
+                self._encode(k)
+        elif present:
+            self.lookup[card_id] = value
+            self.values[k] = value
+            self._encode(k)
+        else:
+            self.lookup[card_id] = value
+            card_ids.insert(k, card_id)
+            self.values.insert(k, value)
+            self.encoded.insert(k, b'')
+            self._encode(k)
+            self._encode(k + 1)
+
+    def _encode(self, k):
+        if k >= len(self.card_ids):
+            return
+        entry = encode_entry(self.values[k], self.card_ids[k] - (self.card_ids[k - 1] if k else 0))
+        self.byte_sum += sum(entry) - sum(self.encoded[k])
+        self.encoded[k] = entry
+
+    def items(self):
+        return zip(self.card_ids, self.values)
+
+    def __len__(self):
+        return len(self.card_ids)
+
+
+class DeckBuilder:
+    def __init__(self, card_pool=None, name=''):
+        """An empty deck, card_pool (a CardList) is only needed for the legality checks."""
+        self.heroes = Entries()
+        self.cards = Entries()
+        self.name = name
+        self._code = None
+
+        self.card_pool = card_pool
+        self.validator = None
+        if card_pool is not None:
+            # the classes that go with the card pool implementation
+            self.validator = sys.modules[type(card_pool).__module__].DeckValidator(card_pool)
+        # copies of the signature cards brought by the heroes
+        self._signature_copies = {}
+        self.main_deck_size = 0
+        self.item_count = 0
+        self._unknown_cards = 0
+        self._over_max_copies = 0
+
+    @staticmethod
+    def from_code_deck_dict(d, card_pool=None):
+        builder = DeckBuilder(card_pool, d.get('name', ''))
+        for hero in d['heroes']:
+            builder.set_hero(hero['card_id'], hero['turn'])
+        for card in d['cards']:
+            builder.add(card['card_id'], card['count'])
+
+        return builder
+
+    @staticmethod
+    def from_deck_code(deck_code, card_pool=None):
+        return DeckBuilder.from_code_deck_dict(adc.DeckDecoder.decode(deck_code), card_pool)
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
+        self._name_bytes = bytes(name, 'utf-8')[:63]
+        self._code = None
+
+    def count(self, card_id):
+        """Copies of card_id in the deck, leaving out the signature cards of the heroes."""
+        return self.cards.get(card_id)
+
+    def turn(self, card_id):
+        """The turn of hero card_id, 0 if it is not in the deck."""
+        return self.heroes.get(card_id)
+
+    def set_count(self, card_id, count):
+        if count < 0:
+            raise ValueError(f'Card {card_id} can not have {count} copies')
+        before = self.cards.get(card_id)
+        if count == before:
+            return
+
+        if self.validator is not None:
+            self._track(card_id, count - before)
+        self.cards.set(card_id, count)
+        self._code = None
+
+    def add(self, card_id, count=1):
+        self.set_count(card_id, self.cards.get(card_id) + count)
+
+    def remove(self, card_id, count=1):
+        have = self.cards.get(card_id)
+        if have < count:
+            raise ValueError(f'Can not remove {count} copies of card {card_id}, the deck has {have}')
+        self.set_count(card_id, have - count)
+
+    def swap(self, old_card_id, new_card_id, count=1):
+        """Replace count copies of old_card_id with new_card_id."""
+        self.remove(old_card_id, count)
+        self.add(new_card_id, count)
+
+    def set_hero(self, card_id, turn):
+        """Add hero card_id played on turn, or move it to turn."""
+        if turn < 1:
+            raise ValueError(f'Hero {card_id} can not be played on turn {turn}')
+        if not self.heroes.get(card_id):
+            self._track_signature(card_id, 1)
+        self.heroes.set(card_id, turn)
+        self._code = None
+
+    def remove_hero(self, card_id):
+        if not self.heroes.get(card_id):
+            raise ValueError(f'Hero {card_id} is not in the deck')
+        self._track_signature(card_id, -1)
+        self.heroes.set(card_id, 0)
+        self._code = None
+
+    def swap_hero(self, old_card_id, new_card_id):
+        """Replace hero old_card_id with new_card_id on the same turn."""
+        turn = self.heroes.get(old_card_id)
+        self.remove_hero(old_card_id)
+        self.set_hero(new_card_id, turn)
+
+    def _track_signature(self, hero_id, sign):
+        if self.validator is None or hero_id not in self.validator.signatures:
+            return
+        signature_id, copies = self.validator.signatures[hero_id]
+        self._track(signature_id, sign * copies)
+        self._signature_copies[signature_id] = self._signature_copies.get(signature_id, 0) + sign * copies
+
+    def _track(self, card_id, change):
+        """Update the legality counters for change copies of card_id, before the change is made."""
+        before = self.cards.get(card_id) + self._signature_copies.get(card_id, 0)
+        after = before + change
+        max_copies = self.validator.max_copies
+        if card_id in self.validator.item_ids:
+            self.item_count += change
+        elif self.card_pool.get_idx_by_id(card_id) == -1:
+            self._unknown_cards += (after > 0) - (before > 0)
+            return
+        else:
+            self.main_deck_size += change
+        self._over_max_copies += (after > max_copies) - (before > max_copies)
+
+    def _heroes_encodable(self):
+        return len(self.heroes) == 5 and sorted(self.heroes.values) == [1, 1, 1, 2, 3]
+
+    def code(self):
+        """The deck code, byte for byte what DeckEncoder.encode gives. Raises InvalidDeckException like encode unless
+        there are 5 heroes on turns 1, 1, 1, 2 and 3."""
+        if self._code is None:
+            if not self._heroes_encodable():
+                raise adc.InvalidDeckException(self.to_code_deck_dict())
+
+            version = adc.DeckEncoder.version << 4 | len(self.heroes)
+            checksum = (self.heroes.byte_sum + self.cards.byte_sum) & 0xFF
+            buffer = b''.join([bytes((version, checksum, len(self._name_bytes)))] + self.heroes.encoded +
+                              self.cards.encoded + [self._name_bytes])
+            deck_code = binascii.b2a_base64(buffer, newline=False).translate(_deck_code_translation)
+            self._code = adc.DeckEncoder.prefix + deck_code.decode('utf-8')
+
+        return self._code
+
+    def to_code_deck_dict(self):
+        return {'heroes': [{'card_id': card_id, 'turn': turn} for card_id, turn in self.heroes.items()],
+                'cards': [{'card_id': card_id, 'count': count} for card_id, count in self.cards.items()],
+                'name': self.name}
+
+    def counted_deck(self):
+        """The deck as a CountedDeck, with the signature cards of the heroes. Requires a card pool."""
+        cards = dict(self.cards.items())
+        for card_id, copies in self._signature_copies.items():
+            if copies:
+                cards[card_id] = cards.get(card_id, 0) + copies
+
+        return sys.modules[type(self.card_pool).__module__].CountedDeck(list(self.heroes.items()), cards, self.name)
+
+    def is_legal(self):
+        """Whether DeckValidator would find no problems, from the kept counters and the 5 heroes. Requires a card
+        pool."""
+        validator = self.validator
+        if self._unknown_cards or self._over_max_copies or self.main_deck_size < validator.min_main_deck or \
+                self.item_count < validator.min_items or tuple(sorted(self.heroes.values)) != validator.hero_turns:
+            return False
+
+        for hero_id in self.heroes.card_ids:
+            if hero_id not in validator.hero_ids:
+                return False
+            if hero_id in validator.signatures:
+                signature_id, copies = validator.signatures[hero_id]
+                if self.cards.get(signature_id) + self._signature_copies[signature_id] != copies:
+                    return False
+
+        return True
+
+    def problems(self):
+        """The DeckProblems DeckValidator finds, an empty list for a legal deck. Requires a card pool."""
+        return self.validator.validate(self.counted_deck())
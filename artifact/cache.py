@@ -0,0 +1,131 @@
+"""Bounded LRU cache in front of DeckDecoder.decode and Deck.from_code_deck_dict.
+
+Popular deck codes repeat a lot, so DeckCache keeps the decoded heroes and cards of the most recently used codes. Entries
+are keyed on the card payload of a code, its decoded bytes without the trailing name, so codes that only differ in
+their name share one entry and the name is read from the code on every lookup. Cached values are stored as tuples and
+every lookup returns a new dict or Deck, callers can not change what other callers get.
+"""
+import binascii
+import collections
+import sys
+import threading
+
+from artifact import adc
+
+_from_deck_code = str.maketrans('-_', '/=')
+
+
+def payload_key(deck_code):
+    """Split deck_code into its card payload and name bytes.
+
+    Returns None for codes it can not split, which are decoded without the cache (version 1 codes have no name).
+    """
+    if not deck_code.startswith(adc.DeckDecoder.prefix):
+        return None
+
+    try:
+        data = binascii.a2b_base64(deck_code[len(adc.DeckDecoder.prefix):].translate(_from_deck_code))
+    except (binascii.Error, ValueError):
+        return None
+
+    if len(data) < 3 or data[0] >> 4 < 2:
+        return None
+    # the name length byte is left out of the key along with the name
+    name_start = len(data) - data[2]
+    if name_start < 3:
+        return None
+
+    return data[:2] + data[3:name_start], data[name_start:]
+
+
+class _Entry:
+    __slots__ = ['heroes', 'cards', 'deck']
+
+    def __init__(self, heroes, cards):
+        self.heroes = heroes
+        self.cards = cards
+        # (heroes, main_deck, items) tuples of Cards once hydrated
+        self.deck = None
+
+
+class DeckCache:
+    """LRU cache of decoded (and optionally hydrated) decks holding at most maxsize payloads.
+
+    decode returns the same dict as decoder.decode, hydrate the same Deck as Deck.from_code_deck_dict against
+    card_pool, which hydrate requires. Codes that fail to decode raise as usual and are not cached. hits, misses and
+    evictions count lookups since the cache was created.
+    """
+
+    def __init__(self, maxsize=4096, card_pool=None, decoder=None):
+        self.maxsize = maxsize
+        self.card_pool = card_pool
+        self.decoder = adc.DeckDecoder if decoder is None else decoder
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, deck_code):
+        split = payload_key(deck_code)
+        if split is not None:
+            key, name = split
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry, name.decode('utf-8')
+
+        with self._lock:
+            self.misses += 1
+
+        deck = self.decoder.decode(deck_code)
+        entry = _Entry(tuple((hero['card_id'], hero['turn']) for hero in deck['heroes']),
+                       tuple((card['card_id'], card['count']) for card in deck['cards']))
+
+        with self._lock:
+            if split is not None and self.maxsize > 0:
+                self._entries[split[0]] = entry
+                if len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+
+        return entry, deck['name']
+
+    def decode(self, deck_code):
+        entry, name = self._lookup(deck_code)
+
+        return {'heroes': [{'card_id': card_id, 'turn': turn} for card_id, turn in entry.heroes],
+                'cards': [{'card_id': card_id, 'count': count} for card_id, count in entry.cards],
+                'name': name}
+
+    def hydrate(self, deck_code):
+        if self.card_pool is None:
+            raise ValueError('DeckCache.hydrate needs a card_pool')
+
+        entry, name = self._lookup(deck_code)
+        Deck = sys.modules[type(self.card_pool).__module__].Deck
+
+        if entry.deck is None:
+            deck = Deck.from_code_deck_dict({'heroes': [{'card_id': card_id, 'turn': turn}
+                                                        for card_id, turn in entry.heroes],
+                                             'cards': [{'card_id': card_id, 'count': count}
+                                                       for card_id, count in entry.cards]}, self.card_pool)
+            entry.deck = tuple(deck.heroes), tuple(deck.main_deck), tuple(deck.items)
+
+        heroes, main_deck, items = entry.deck
+        return Deck(list(heroes), list(main_deck), list(items), name)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
+
+    def clear(self):
+        """Drop every entry, for example after the card pool was refreshed. The counters are kept."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
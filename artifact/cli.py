@@ -0,0 +1,205 @@
+"""Command line tools, run with ``python -m artifact <command>``.
+
+decode
+    Decode newline delimited deck codes from a file or stdin and write one JSON Lines or CSV record per code.
+    Codes are decoded in chunks with DeckDecoder.decode_many so the input is never held in memory, codes that
+    fail to decode become records with an error instead of stopping the run.
+
+dedupe
+    Fingerprint newline delimited deck codes (see DeckDecoder.fingerprint) and write one record per distinct deck
+    with its fingerprint, how many codes had it and the first such code, most common first. Codes that fail to
+    decode are counted but not written.
+"""
+import argparse
+import csv
+import itertools
+import json
+import mmap
+import sys
+import time
+
+from artifact import adc
+
+csv_columns = ['line', 'code', 'name', 'heroes', 'cards', 'error']
+dedupe_csv_columns = ['fingerprint', 'count', 'line', 'code']
+
+
+class Stats:
+    def __init__(self):
+        self.lines = 0
+        self.decks = 0
+        self.errors = 0
+        self.bytes = 0
+        self.start = time.perf_counter()
+
+    def report(self, stream):
+        elapsed = time.perf_counter() - self.start
+        rate = self.lines / elapsed if elapsed else 0
+        throughput = self.bytes / elapsed / 2 ** 20 if elapsed else 0
+        print(f'{self.lines} codes | {self.decks} decoded | {self.errors} errors | {elapsed:.3f}s | '
+              f'{rate:,.0f} codes/s | {throughput:.2f} MiB/s', file=stream)
+
+
+def read_lines(path, stats):
+    """Yield every line of path (or stdin for '-') as bytes, memory mapping regular files."""
+    if path == '-':
+        for line in sys.stdin.buffer:
+            stats.bytes += len(line)
+            yield line
+        return
+
+    with open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped and have nothing to read anyway
+            return
+
+        with mapped:
+            for line in iter(mapped.readline, b''):
+                stats.bytes += len(line)
+                yield line
+
+
+def read_deck_codes(lines):
+    """Yield (line number, deck code) for every non blank line."""
+    for line_number, line in enumerate(lines, 1):
+        code = line.strip()
+        if code:
+            yield line_number, code.decode('utf-8', 'replace')
+
+
+def positive_int(value):
+    """argparse type for --chunk-size, argparse reports anything but a positive integer as a usage error."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value!r} is not a positive integer')
+    return number
+
+
+def chunked(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def decode_records(numbered_codes, chunk_size, stats):
+    """Yield a record dict for every (line number, deck code), decoding chunk_size codes at a time."""
+    for chunk in chunked(numbered_codes, chunk_size):
+        batch = adc.DeckDecoder.decode_many([code for _, code in chunk])
+        for i, (line_number, code) in enumerate(chunk):
+            stats.lines += 1
+            record = {'line': line_number, 'code': code}
+            if batch.errors[i] is None:
+                stats.decks += 1
+                record.update(batch[i])
+            else:
+                stats.errors += 1
+                record['error'] = batch.errors[i]
+            yield record
+
+
+def dedupe_records(numbered_codes, chunk_size, stats):
+    """Return a record dict for every distinct fingerprint in (line number, deck code), most common first."""
+    counts = {}
+    for chunk in chunked(numbered_codes, chunk_size):
+        fingerprints = adc.DeckDecoder.fingerprint_many([code for _, code in chunk])
+        for fingerprint, (line_number, code) in zip(fingerprints, chunk):
+            stats.lines += 1
+            if fingerprint is None:
+                stats.errors += 1
+                continue
+
+            stats.decks += 1
+            record = counts.get(fingerprint)
+            if record is None:
+                counts[fingerprint] = {'fingerprint': fingerprint.hex(), 'count': 1, 'line': line_number,
+                                       'code': code}
+            else:
+                record['count'] += 1
+
+    return sorted(counts.values(), key=lambda record: record['count'], reverse=True)
+
+
+def write_jsonl(records, output):
+    for record in records:
+        output.write(json.dumps(record))
+        output.write('\n')
+
+
+def write_csv(records, output):
+    writer = csv.DictWriter(output, csv_columns)
+    writer.writeheader()
+    for record in records:
+        if 'error' not in record:
+            record['heroes'] = ' '.join(f"{hero['card_id']}:{hero['turn']}" for hero in record['heroes'])
+            record['cards'] = ' '.join(f"{card['card_id']}:{card['count']}" for card in record['cards'])
+        writer.writerow(record)
+
+
+def write_dedupe_csv(records, output):
+    writer = csv.DictWriter(output, dedupe_csv_columns)
+    writer.writeheader()
+    writer.writerows(records)
+
+
+writers = {'jsonl': write_jsonl, 'csv': write_csv}
+dedupe_writers = {'jsonl': write_jsonl, 'csv': write_dedupe_csv}
+
+
+def write_records(records, writer, args):
+    if args.output == '-':
+        writer(records, sys.stdout)
+    else:
+        with open(args.output, 'w', newline='') as output:
+            writer(records, output)
+
+
+def decode(args):
+    stats = Stats()
+    records = decode_records(read_deck_codes(read_lines(args.input, stats)), args.chunk_size, stats)
+    write_records(records, writers[args.format], args)
+
+    if not args.quiet:
+        stats.report(sys.stderr)
+
+
+def dedupe(args):
+    stats = Stats()
+    records = dedupe_records(read_deck_codes(read_lines(args.input, stats)), args.chunk_size, stats)
+    write_records(records, dedupe_writers[args.format], args)
+
+    if not args.quiet:
+        stats.report(sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m artifact')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    decode_parser = commands.add_parser('decode', help='decode newline delimited deck codes')
+    decode_parser.add_argument('input', nargs='?', default='-', help='file of deck codes, - for stdin (default)')
+    decode_parser.add_argument('-o', '--output', default='-', help='output file, - for stdout (default)')
+    decode_parser.add_argument('-f', '--format', choices=sorted(writers), default='jsonl')
+    decode_parser.add_argument('--chunk-size', type=positive_int, default=10000, help='codes decoded per batch')
+    decode_parser.add_argument('-q', '--quiet', action='store_true', help='do not print throughput stats')
+    decode_parser.set_defaults(run=decode)
+
+    dedupe_parser = commands.add_parser('dedupe', help='count distinct decks in newline delimited deck codes')
+    dedupe_parser.add_argument('input', nargs='?', default='-', help='file of deck codes, - for stdin (default)')
+    dedupe_parser.add_argument('-o', '--output', default='-', help='output file, - for stdout (default)')
+    dedupe_parser.add_argument('-f', '--format', choices=sorted(dedupe_writers), default='jsonl')
+    dedupe_parser.add_argument('--chunk-size', type=positive_int, default=10000, help='codes fingerprinted per batch')
+    dedupe_parser.add_argument('-q', '--quiet', action='store_true', help='do not print throughput stats')
+    dedupe_parser.set_defaults(run=dedupe)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+    return 0
@@ -0,0 +1,192 @@
+"""Decoded decks stored as contiguous NumPy arrays, with vectorized card and hero statistics.
+
+A DeckCorpus uses the same layout as DeckBatch: deck ``i`` has the heroes ``hero_ids`` / ``hero_turns`` between
+``hero_offsets[i]`` and ``hero_offsets[i + 1]`` and the cards ``card_ids`` / ``card_counts`` between
+``card_offsets[i]`` and ``card_offsets[i + 1]``. Only decks that decoded are kept and deck names are dropped. A corpus
+is saved as a directory of .npy files which load memory mapped, so a corpus larger than memory can still be
+aggregated.
+
+The aggregations assume the cards of a deck are distinct, as they are in codes written by the encoder.
+
+Requires numpy (``pip install artifact[corpus]``).
+"""
+import collections
+import itertools
+import os
+
+import numpy as np
+
+from artifact import adc
+
+columns = ['hero_ids', 'hero_turns', 'hero_offsets', 'card_ids', 'card_counts', 'card_offsets']
+colours = ['black', 'blue', 'green', 'red']
+
+CardFrequency = collections.namedtuple('CardFrequency', ['card_ids', 'decks', 'copies'])
+
+# ids below this are counted with bincount, larger ones with unique
+_bincount_limit = 1 << 24
+
+
+def _unique(values):
+    """np.unique(values, return_inverse=True) for a non negative integer array, with a lookup table for small ids."""
+    if not len(values) or values.max() >= _bincount_limit:
+        unique, inverse = np.unique(values, return_inverse=True)
+        return unique, inverse.reshape(-1)
+
+    unique = np.flatnonzero(np.bincount(values))
+    lookup = np.zeros(unique[-1] + 1, dtype=np.int64)
+    lookup[unique] = np.arange(len(unique))
+    return unique.astype(values.dtype), lookup[values]
+
+
+def _frequency(values, weights=None):
+    """Return (unique values, summed weights, or occurrences without weights) of a non negative integer array."""
+    if len(values) and values.max() < _bincount_limit:
+        occurrences = np.bincount(values)
+        unique = np.flatnonzero(occurrences)
+        counts = occurrences if weights is None else np.bincount(values, weights=weights)
+        return unique.astype(values.dtype), counts[unique].astype(np.int64)
+
+    unique, inverse = _unique(values)
+    return unique, np.bincount(inverse, weights=weights, minlength=len(unique)).astype(np.int64)
+
+
+class DeckCorpus:
+    def __init__(self, hero_ids, hero_turns, hero_offsets, card_ids, card_counts, card_offsets):
+        self.hero_ids = hero_ids
+        self.hero_turns = hero_turns
+        self.hero_offsets = hero_offsets
+        self.card_ids = card_ids
+        self.card_counts = card_counts
+        self.card_offsets = card_offsets
+
+    @staticmethod
+    def from_batch(batch):
+        """Build a corpus from a DeckBatch, leaving out the codes that failed to decode."""
+        hero_offsets = np.frombuffer(batch.hero_offsets, dtype=np.int64)
+        card_offsets = np.frombuffer(batch.card_offsets, dtype=np.int64)
+        if any(error is not None for error in batch.errors):
+            # failed decks have no entries, dropping their end offset removes them
+            keep = np.array([True] + [error is None for error in batch.errors])
+            hero_offsets = hero_offsets[keep]
+            card_offsets = card_offsets[keep]
+
+        return DeckCorpus(np.frombuffer(batch.hero_ids, dtype=np.int32),
+                          np.frombuffer(batch.hero_turns, dtype=np.int32), hero_offsets,
+                          np.frombuffer(batch.card_ids, dtype=np.int32),
+                          np.frombuffer(batch.card_counts, dtype=np.int32), card_offsets)
+
+    @staticmethod
+    def from_codes(deck_codes, chunk_size=100000):
+        """Decode deck_codes chunk_size at a time with DeckDecoder.decode_many into one corpus."""
+        iterator = iter(deck_codes)
+        corpora = []
+        while True:
+            chunk = list(itertools.islice(iterator, chunk_size))
+            if not chunk:
+                break
+            corpora.append(DeckCorpus.from_batch(adc.DeckDecoder.decode_many(chunk)))
+
+        return DeckCorpus.concat(corpora)
+
+    @staticmethod
+    def concat(corpora):
+        corpora = list(corpora)
+        if not corpora:
+            return DeckCorpus(*[np.zeros(1 if column.endswith('offsets') else 0,
+                                         dtype=np.int64 if column.endswith('offsets') else np.int32)
+                                for column in columns])
+
+        def offsets(name, entries):
+            shifts = np.cumsum([0] + [len(getattr(corpus, entries)) for corpus in corpora[:-1]])
+            return np.concatenate([getattr(corpora[0], name)[:1]] + [getattr(corpus, name)[1:] + shift
+                                                                    for corpus, shift in zip(corpora, shifts)])
+
+        return DeckCorpus(np.concatenate([corpus.hero_ids for corpus in corpora]),
+                          np.concatenate([corpus.hero_turns for corpus in corpora]),
+                          offsets('hero_offsets', 'hero_ids'),
+                          np.concatenate([corpus.card_ids for corpus in corpora]),
+                          np.concatenate([corpus.card_counts for corpus in corpora]),
+                          offsets('card_offsets', 'card_ids'))
+
+    def save(self, path):
+        """Save the corpus as a directory of .npy files."""
+        os.makedirs(path, exist_ok=True)
+        for column in columns:
+            np.save(os.path.join(path, f'{column}.npy'), getattr(self, column))
+
+    @staticmethod
+    def load(path, mmap_mode='r'):
+        """Load a corpus saved with save, memory mapped unless mmap_mode is None."""
+        return DeckCorpus(*[np.load(os.path.join(path, f'{column}.npy'), mmap_mode=mmap_mode) for column in columns])
+
+    def __len__(self):
+        return len(self.hero_offsets) - 1
+
+    def __getitem__(self, i):
+        """The deck as the dict DeckDecoder.decode returns, with an empty name."""
+        heroes = slice(self.hero_offsets[i], self.hero_offsets[i + 1])
+        cards = slice(self.card_offsets[i], self.card_offsets[i + 1])
+        return {'heroes': [{'card_id': int(card_id), 'turn': int(turn)}
+                           for card_id, turn in zip(self.hero_ids[heroes], self.hero_turns[heroes])],
+                'cards': [{'card_id': int(card_id), 'count': int(count)}
+                          for card_id, count in zip(self.card_ids[cards], self.card_counts[cards])],
+                'name': ''}
+
+    def card_frequency(self):
+        """How many decks play each card and how many copies they play in total, most played first.
+
+        decks / len(corpus) is the pick rate of a card and copies / decks its average number of copies.
+        """
+        card_ids, decks = _frequency(self.card_ids)
+        _, copies = _frequency(self.card_ids, self.card_counts)
+        order = np.argsort(-decks, kind='stable')
+
+        return CardFrequency(card_ids[order], decks[order], copies[order])
+
+    def hero_pair_counts(self):
+        """Return (pairs, counts), every pair of heroes (smaller id first) played together and in how many decks."""
+        hero_ids, hero_idx = _unique(self.hero_ids)
+        num_heroes = len(hero_ids)
+        deck_sizes = np.diff(self.hero_offsets)
+
+        keys = []
+        # decks are grouped by hero count so every group is a rectangular array of hero indexes
+        for size in np.unique(deck_sizes):
+            if size < 2:
+                continue
+            starts = self.hero_offsets[:-1][deck_sizes == size]
+            rows = np.sort(hero_idx[starts[:, None] + np.arange(size)], axis=1).astype(np.int64)
+            for a, b in itertools.combinations(range(size), 2):
+                keys.append(rows[:, a] * num_heroes + rows[:, b])
+
+        if not keys:
+            return np.zeros((0, 2), dtype=hero_ids.dtype), np.zeros(0, dtype=np.int64)
+
+        keys, counts = _frequency(np.concatenate(keys))
+        order = np.argsort(-counts, kind='stable')
+        keys, counts = keys[order], counts[order]
+
+        return np.stack([hero_ids[keys // num_heroes], hero_ids[keys % num_heroes]], axis=1), counts
+
+    def colour_distribution(self, card_pool):
+        """Count decks by the colours of their heroes, as a dict of sorted colour tuples to deck counts.
+
+        Hero colours are looked up in card_pool, heroes missing from it or without a colour are ignored.
+        """
+        hero_ids, hero_idx = _unique(self.hero_ids)
+        hero_bits = np.zeros(len(hero_ids), dtype=np.int64)
+        for i, hero_id in enumerate(hero_ids):
+            card = card_pool.get_card_by_id(int(hero_id))
+            if card is not None and card.colour in colours:
+                hero_bits[i] = 1 << colours.index(card.colour)
+
+        deck_bits = np.zeros(len(self), dtype=np.int64)
+        has_heroes = np.diff(self.hero_offsets) > 0
+        if len(self.hero_ids):
+            deck_bits[has_heroes] = np.bitwise_or.reduceat(hero_bits[hero_idx],
+                                                           self.hero_offsets[:-1][has_heroes])
+
+        masks, counts = _frequency(deck_bits)
+        return {tuple(colour for bit, colour in enumerate(colours) if mask & (1 << bit)): int(count)
+                for mask, count in zip(masks, counts)}
@@ -0,0 +1,107 @@
+"""Seeded generator of random valid decks, for load testing and fuzzing the encoder and decoder.
+
+Decks are sampled from a card pool: five distinct heroes with the turns 1, 1, 1, 2 and 3 in random order, the
+signature cards of the heroes, and distinct main deck cards and items with one to max_copies copies each until the
+main deck and item counts drawn for the deck are reached. The same seed and card pool always give the same decks.
+
+    generator = DeckGenerator(card_set.cards, seed=1)
+    deck_codes = generator.deck_codes(100000)
+"""
+import random
+import sys
+
+from artifact import adc
+
+main_deck_types = ['Spell', 'Creep', 'Improvement']
+
+
+class DeckGenerator:
+    def __init__(self, card_pool, seed=None, main_deck_size=(40, 50), item_count=(9, 18), max_copies=3):
+        """Sample decks from card_pool with main_deck_size and item_count drawn uniformly from the given inclusive
+        ranges (counting signature cards in the main deck)."""
+        self.card_pool = card_pool
+        self.random = random.Random(seed)
+        self.main_deck_size = main_deck_size
+        self.item_count = item_count
+        self.max_copies = max_copies
+        # the Deck classes that go with the card pool implementation
+        self._cards_module = sys.modules[type(card_pool).__module__]
+
+        self.signatures = card_pool.signatures()
+        signature_ids = {card_id for card_id, _ in self.signatures.values()}
+        self.hero_ids = []
+        self.main_deck_ids = []
+        self.item_ids = []
+        seen = set()
+        for card in card_pool:
+            if card.card_id in seen or card.card_id in signature_ids:
+                continue
+            seen.add(card.card_id)
+            if card.card_type == 'Hero':
+                self.hero_ids.append(card.card_id)
+            elif card.card_type == 'Item':
+                self.item_ids.append(card.card_id)
+            elif card.card_type in main_deck_types:
+                self.main_deck_ids.append(card.card_id)
+
+        # the fewest signature copies five heroes can bring, so every deck can be filled
+        signature_copies = sum(sorted(self.signatures.get(hero_id, (0, 0))[1] for hero_id in self.hero_ids)[:5])
+        if len(self.hero_ids) < 5:
+            raise ValueError(f'The card pool has {len(self.hero_ids)} heroes, a deck needs 5')
+        if len(self.main_deck_ids) * max_copies + signature_copies < main_deck_size[1]:
+            raise ValueError(f'The card pool does not have enough main deck cards for {main_deck_size[1]} cards')
+        if len(self.item_ids) * max_copies < item_count[1]:
+            raise ValueError(f'The card pool does not have enough items for {item_count[1]} items')
+
+    def _sample(self, card_ids, total):
+        """Distinct cards from card_ids with one to max_copies copies each, total copies in all, as (card_id, count)."""
+        rng = self.random
+        cards = []
+        candidates = list(card_ids)
+        while total > 0:
+            # swap remove picks distinct cards in O(1) each
+            j = rng.randrange(len(candidates))
+            card_id = candidates[j]
+            candidates[j] = candidates[-1]
+            candidates.pop()
+            # take more copies when the cards left could not make up the total otherwise
+            copies = min(max(rng.randint(1, self.max_copies), total - len(candidates) * self.max_copies), total)
+            cards.append((card_id, copies))
+            total -= copies
+
+        return cards
+
+    def code_deck_dict(self, name=''):
+        """A random valid deck as the dict DeckEncoder.encode takes, without the signature cards as in deck codes."""
+        rng = self.random
+        hero_ids = rng.sample(self.hero_ids, 5)
+        turns = [1, 1, 1, 2, 3]
+        rng.shuffle(turns)
+
+        signature_copies = sum(self.signatures[hero_id][1] for hero_id in hero_ids if hero_id in self.signatures)
+        main_deck_size = max(rng.randint(*self.main_deck_size) - signature_copies, 0)
+        cards = self._sample(self.main_deck_ids, main_deck_size) + \
+            self._sample(self.item_ids, rng.randint(*self.item_count))
+
+        # in turn order as Deck and CountedDeck.to_deck keep heroes, Deck.to_code_deck_dict gives turns by position
+        return {'heroes': [{'card_id': hero_id, 'turn': turn}
+                           for turn, hero_id in sorted(zip(turns, hero_ids))],
+                'cards': [{'card_id': card_id, 'count': count} for card_id, count in cards],
+                'name': name}
+
+    def code_deck_dicts(self, count, name=''):
+        return [self.code_deck_dict(name) for _ in range(count)]
+
+    def counted_deck(self, name=''):
+        return self._cards_module.CountedDeck.from_code_deck_dict(self.code_deck_dict(name), self.card_pool)
+
+    def deck(self, name=''):
+        """A random valid deck as a Deck of Cards from the card pool."""
+        return self._cards_module.Deck.from_code_deck_dict(self.code_deck_dict(name), self.card_pool)
+
+    def decks(self, count, name=''):
+        return [self.deck(name) for _ in range(count)]
+
+    def deck_codes(self, count, name=''):
+        """count deck codes of random valid decks, encoded together with DeckEncoder.encode_many."""
+        return adc.DeckEncoder.encode_many(adc.DeckBatch.from_decks(self.code_deck_dicts(count, name)))
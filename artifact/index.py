@@ -0,0 +1,201 @@
+"""Inverted index from card id to the decoded decks that play it, for queries like "decks with Axe and at least 2
+Cheating Death but no item costing more than 10 gold".
+
+Decks are numbered in the order they are added (codes that fail to decode use up a number but match nothing). Every
+card id, heroes included, has a posting list of the decks playing it with the number of copies, heroes count as one
+copy. Queries are built from the index and combined with ``&``, ``|`` and ``~``, then evaluated into a sorted array of
+deck numbers with search.
+
+    query = index.card(axe_id) & index.card(cheating_death_id, min_count=2) & ~index.where(card_pool, expensive_item)
+    deck_ids = index.search(query)
+
+Postings are NumPy arrays, added decks are grouped per card with a sort and queries are evaluated as boolean masks
+over all decks. An index is saved as a directory of .npy files which load memory mapped.
+
+Requires numpy (``pip install artifact[corpus]``).
+"""
+import itertools
+import os
+
+import numpy as np
+
+from artifact import adc
+
+columns = ['card_ids', 'offsets', 'deck_ids', 'counts', 'decoded']
+
+
+class Query:
+    """A set of decks, evaluate it against an index with DeckIndex.search."""
+
+    def __init__(self, mask):
+        # mask(index) returns a boolean array with an entry per deck
+        self._mask = mask
+
+    def mask(self, index):
+        return self._mask(index)
+
+    def __and__(self, other):
+        return Query(lambda index: self.mask(index) & other.mask(index))
+
+    def __or__(self, other):
+        return Query(lambda index: self.mask(index) | other.mask(index))
+
+    def __invert__(self):
+        return Query(lambda index: ~self.mask(index) & index.decoded())
+
+
+class DeckIndex:
+    def __init__(self):
+        self.num_decks = 0
+        # card id -> list of (deck ids, counts) chunks, merged into one when queried
+        self._postings = {}
+        self._decoded = []
+        self._pending = adc.DeckBatch()
+
+    def add(self, deck):
+        """Add a decoded deck dict (as DeckDecoder.decode returns) and return its deck number."""
+        self._pending.append(deck)
+        if len(self._pending) >= 10000:
+            self._flush()
+
+        return self.num_decks + len(self._pending) - 1
+
+    def add_batch(self, batch):
+        """Add every deck of a DeckBatch and return the range of their deck numbers."""
+        self._flush()
+        first = self.num_decks
+        num_decks = len(batch)
+
+        hero_offsets = np.frombuffer(batch.hero_offsets, dtype=np.int64)
+        card_offsets = np.frombuffer(batch.card_offsets, dtype=np.int64)
+        card_ids = np.concatenate([np.frombuffer(batch.hero_ids, dtype=np.int32),
+                                   np.frombuffer(batch.card_ids, dtype=np.int32)])
+        counts = np.concatenate([np.ones(len(batch.hero_ids), dtype=np.int32),
+                                 np.frombuffer(batch.card_counts, dtype=np.int32)])
+        deck_ids = first + np.concatenate([np.repeat(np.arange(num_decks, dtype=np.int32), np.diff(hero_offsets)),
+                                           np.repeat(np.arange(num_decks, dtype=np.int32), np.diff(card_offsets))])
+
+        # a stable sort keeps every card's decks in increasing order
+        order = np.argsort(card_ids, kind='stable')
+        card_ids, deck_ids, counts = card_ids[order], deck_ids[order], counts[order]
+        starts = np.flatnonzero(np.r_[True, card_ids[1:] != card_ids[:-1]]) if len(card_ids) else []
+        ends = itertools.chain(starts[1:], [len(card_ids)])
+        for start, end in zip(starts, ends):
+            self._postings.setdefault(int(card_ids[start]), []).append((deck_ids[start:end], counts[start:end]))
+
+        self._decoded.append(np.array([error is None for error in batch.errors], dtype=bool))
+        self.num_decks += num_decks
+
+        return range(first, self.num_decks)
+
+    def add_codes(self, deck_codes, chunk_size=100000):
+        """Decode and add deck codes chunk_size at a time, returns the range of their deck numbers."""
+        self._flush()
+        first = self.num_decks
+        iterator = iter(deck_codes)
+        while True:
+            chunk = list(itertools.islice(iterator, chunk_size))
+            if not chunk:
+                break
+            self.add_batch(adc.DeckDecoder.decode_many(chunk))
+
+        return range(first, self.num_decks)
+
+    def _flush(self):
+        if len(self._pending):
+            pending, self._pending = self._pending, adc.DeckBatch()
+            self.add_batch(pending)
+
+    def postings(self, card_id):
+        """Return (deck ids, counts) of the decks playing card_id."""
+        self._flush()
+        chunks = self._postings.get(card_id)
+        if not chunks:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+
+        if len(chunks) > 1:
+            chunks[:] = [(np.concatenate([deck_ids for deck_ids, _ in chunks]),
+                          np.concatenate([counts for _, counts in chunks]))]
+        return chunks[0]
+
+    def decoded(self):
+        """Boolean mask of the decks that decoded."""
+        self._flush()
+        if len(self._decoded) != 1:
+            self._decoded = [np.concatenate(self._decoded) if self._decoded else np.zeros(0, dtype=bool)]
+        return self._decoded[0]
+
+    def card(self, card_id, min_count=1, max_count=None):
+        """Decks playing between min_count and max_count (no limit if None) copies of card_id."""
+        def mask(index):
+            deck_ids, counts = index.postings(card_id)
+            selected = counts >= min_count
+            if max_count is not None:
+                selected &= counts <= max_count
+            result = np.zeros(index.num_decks, dtype=bool)
+            result[deck_ids[selected]] = True
+            return result
+
+        return Query(mask)
+
+    def any_of(self, cards, min_count=1):
+        """Decks playing at least min_count copies of any of cards, a CardList or an iterable of Cards or card ids."""
+        card_ids = {card if isinstance(card, int) else card.card_id for card in cards}
+
+        def mask(index):
+            result = np.zeros(index.num_decks, dtype=bool)
+            for card_id in card_ids:
+                deck_ids, counts = index.postings(card_id)
+                result[deck_ids[counts >= min_count]] = True
+            return result
+
+        return Query(mask)
+
+    def where(self, card_pool, predicate, min_count=1):
+        """Decks playing at least min_count copies of any card in card_pool for which predicate(card) is true."""
+        return self.any_of([card for card in card_pool if predicate(card)], min_count)
+
+    def all(self):
+        return Query(lambda index: index.decoded().copy())
+
+    def search(self, query):
+        """Sorted array of the deck numbers matching query."""
+        self._flush()
+        return np.flatnonzero(query.mask(self))
+
+    def count(self, query):
+        self._flush()
+        return int(np.count_nonzero(query.mask(self)))
+
+    def save(self, path):
+        """Save the index as a directory of .npy files."""
+        self._flush()
+        card_ids = sorted(self._postings)
+        postings = [self.postings(card_id) for card_id in card_ids]
+        offsets = np.cumsum([0] + [len(deck_ids) for deck_ids, _ in postings], dtype=np.int64)
+
+        arrays = {'card_ids': np.array(card_ids, dtype=np.int32), 'offsets': offsets,
+                  'deck_ids': np.concatenate([deck_ids for deck_ids, _ in postings] + [np.zeros(0, np.int32)]),
+                  'counts': np.concatenate([counts for _, counts in postings] + [np.zeros(0, np.int32)]),
+                  'decoded': self.decoded()}
+        os.makedirs(path, exist_ok=True)
+        for column in columns:
+            np.save(os.path.join(path, f'{column}.npy'), arrays[column])
+
+    @staticmethod
+    def load(path, mmap_mode='r'):
+        """Load an index saved with save, memory mapped unless mmap_mode is None. More decks can be added to it."""
+        arrays = {column: np.load(os.path.join(path, f'{column}.npy'), mmap_mode=mmap_mode) for column in columns}
+
+        index = DeckIndex()
+        index.num_decks = len(arrays['decoded'])
+        index._decoded = [arrays['decoded']]
+        offsets = arrays['offsets']
+        for i, card_id in enumerate(arrays['card_ids'].tolist()):
+            start, end = offsets[i], offsets[i + 1]
+            index._postings[card_id] = [(arrays['deck_ids'][start:end], arrays['counts'][start:end])]
+
+        return index
+
+    def __len__(self):
+        return self.num_decks + len(self._pending)
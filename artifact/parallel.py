@@ -0,0 +1,216 @@
+"""Decode and hydrate deck codes across a process pool, or decode them across threads.
+
+The card pool is handed to every worker once through the pool initializer (inherited for free with the fork start
+method, pickled once per worker otherwise). Workers decode a chunk of codes with DeckDecoder.decode_many and resolve
+every card to its index in the card pool, so only flat index arrays travel back to the parent. HydratedDecks turns
+those back into Deck objects on access, which gives the same decks as Deck.from_code_deck_dict. decoder defaults to
+artifact.adc.DeckDecoder, any module's DeckDecoder can be passed instead.
+"""
+import collections
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import sys
+from array import array
+
+from artifact import adc
+
+# per worker state set up by _init_worker
+_decoder = None
+_card_pool = None
+_signature_cards = None
+_item_cards = None
+
+
+class HydratedDecks:
+    """Decks hydrated against card_pool, stored as indexes into it.
+
+    Deck ``i`` has the heroes ``hero_idx[hero_offsets[i]:hero_offsets[i + 1]]``, main deck entries ``main_idx`` /
+    ``main_counts`` between ``main_offsets[i]`` and ``main_offsets[i + 1]`` (signature cards first) and items
+    ``item_idx`` / ``item_counts`` between ``item_offsets[i]`` and ``item_offsets[i + 1]``. Codes that failed to
+    decode or hydrate have no cards and the reason in ``errors[i]``.
+    """
+
+    def __init__(self, card_pool, hero_idx=None, hero_offsets=None, main_idx=None, main_counts=None,
+                 main_offsets=None, item_idx=None, item_counts=None, item_offsets=None, names=None, errors=None):
+        self.card_pool = card_pool
+        self.hero_idx = array('i') if hero_idx is None else hero_idx
+        self.hero_offsets = array('q', [0]) if hero_offsets is None else hero_offsets
+        self.main_idx = array('i') if main_idx is None else main_idx
+        self.main_counts = array('i') if main_counts is None else main_counts
+        self.main_offsets = array('q', [0]) if main_offsets is None else main_offsets
+        self.item_idx = array('i') if item_idx is None else item_idx
+        self.item_counts = array('i') if item_counts is None else item_counts
+        self.item_offsets = array('q', [0]) if item_offsets is None else item_offsets
+        self.names = [] if names is None else names
+        self.errors = [None] * len(self.names) if errors is None else errors
+
+        # the Deck class that goes with the card pool implementation
+        self._deck_type = sys.modules[type(card_pool).__module__].Deck
+
+    def extend(self, other):
+        for idx, offsets, other_offsets in [(self.hero_idx, self.hero_offsets, other.hero_offsets),
+                                            (self.main_idx, self.main_offsets, other.main_offsets),
+                                            (self.item_idx, self.item_offsets, other.item_offsets)]:
+            base = len(idx)
+            offsets.extend(offset + base for offset in other_offsets[1:])
+
+        self.hero_idx.extend(other.hero_idx)
+        self.main_idx.extend(other.main_idx)
+        self.main_counts.extend(other.main_counts)
+        self.item_idx.extend(other.item_idx)
+        self.item_counts.extend(other.item_counts)
+        self.names.extend(other.names)
+        self.errors.extend(other.errors)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, item):
+        if self.errors[item] is not None:
+            return None
+
+        card_pool = self.card_pool
+        heroes = [card_pool[self.hero_idx[i]] for i in range(self.hero_offsets[item], self.hero_offsets[item + 1])]
+        main_deck = []
+        for i in range(self.main_offsets[item], self.main_offsets[item + 1]):
+            main_deck += [card_pool[self.main_idx[i]]] * self.main_counts[i]
+        items = []
+        for i in range(self.item_offsets[item], self.item_offsets[item + 1]):
+            items += [card_pool[self.item_idx[i]]] * self.item_counts[i]
+
+        return self._deck_type(heroes, main_deck, items, self.names[item])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def _init_worker(card_pool, decoder):
+    global _decoder, _card_pool, _signature_cards, _item_cards
+
+    _decoder = decoder
+    _card_pool = card_pool
+    _signature_cards = {}
+    _item_cards = set()
+    for i in range(len(card_pool)):
+        card = card_pool[i]
+        if card.card_type == 'Item':
+            _item_cards.add(i)
+        for ref in card.references or []:
+            if ref['ref_type'] == 'includes':
+                _signature_cards[i] = (card_pool.get_idx_by_id(ref['card_id']), ref['count'])
+                break
+
+
+def _decode_and_hydrate_chunk(deck_codes):
+    batch = _decoder.decode_many(deck_codes)
+    hydrated = {name: array('i') for name in ['hero_idx', 'main_idx', 'main_counts', 'item_idx', 'item_counts']}
+    offsets = {name: array('q', [0]) for name in ['hero_offsets', 'main_offsets', 'item_offsets']}
+    hero_idx, main_idx, main_counts = hydrated['hero_idx'], hydrated['main_idx'], hydrated['main_counts']
+    item_idx, item_counts = hydrated['item_idx'], hydrated['item_counts']
+    errors = list(batch.errors)
+    get_idx_by_id = _card_pool.get_idx_by_id
+
+    for i in range(len(batch)):
+        sizes = len(hero_idx), len(main_idx), len(item_idx)
+        try:
+            if errors[i] is not None:
+                continue
+
+            for j in range(batch.hero_offsets[i], batch.hero_offsets[i + 1]):
+                idx = get_idx_by_id(batch.hero_ids[j])
+                if idx == -1:
+                    raise KeyError(f'Unknown card id {batch.hero_ids[j]}')
+                hero_idx.append(idx)
+
+                signature_idx, count = _signature_cards.get(idx, (-1, 0))
+                if count:
+                    if signature_idx == -1:
+                        raise KeyError(f'Unknown signature card for hero {batch.hero_ids[j]}')
+                    main_idx.append(signature_idx)
+                    main_counts.append(count)
+
+            for j in range(batch.card_offsets[i], batch.card_offsets[i + 1]):
+                idx = get_idx_by_id(batch.card_ids[j])
+                if idx == -1:
+                    raise KeyError(f'Unknown card id {batch.card_ids[j]}')
+                if idx in _item_cards:
+                    item_idx.append(idx)
+                    item_counts.append(batch.card_counts[j])
+                else:
+                    main_idx.append(idx)
+                    main_counts.append(batch.card_counts[j])
+        except KeyError as e:
+            for values, size in [(hero_idx, sizes[0]), (main_idx, sizes[1]), (main_counts, sizes[1]),
+                                 (item_idx, sizes[2]), (item_counts, sizes[2])]:
+                del values[size:]
+            errors[i] = f'{type(e).__name__}: {e.args[0]}'
+        finally:
+            offsets['hero_offsets'].append(len(hero_idx))
+            offsets['main_offsets'].append(len(main_idx))
+            offsets['item_offsets'].append(len(item_idx))
+
+    return dict(hydrated, **offsets, names=batch.names, errors=errors)
+
+
+def _ordered_map(executor, fn, iterable, prefetch):
+    """Like executor.map but only keeps prefetch tasks in flight so long inputs are not submitted all at once."""
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= prefetch:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def _chunked(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_decode_and_hydrate(deck_codes, card_pool, workers=None, chunk_size=2000, mp_context=None, decoder=None):
+    """Yield a HydratedDecks for every chunk_size deck codes, in input order.
+
+    mp_context defaults to fork where it is available so the card pool is shared with the workers without pickling.
+    """
+    workers = workers or os.cpu_count()
+    decoder = adc.DeckDecoder if decoder is None else decoder
+    if mp_context is None and 'fork' in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context('fork')
+
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context, _init_worker, (card_pool, decoder)) as executor:
+        for result in _ordered_map(executor, _decode_and_hydrate_chunk, _chunked(deck_codes, chunk_size),
+                                   2 * workers):
+            yield HydratedDecks(card_pool, **result)
+
+
+def decode_and_hydrate(deck_codes, card_pool, workers=None, chunk_size=2000, mp_context=None, decoder=None):
+    """Decode and hydrate deck_codes across workers processes and return one HydratedDecks in input order."""
+    decks = HydratedDecks(card_pool)
+    for chunk in iter_decode_and_hydrate(deck_codes, card_pool, workers, chunk_size, mp_context, decoder):
+        decks.extend(chunk)
+    return decks
+
+
+def threaded_decode_many(deck_codes, workers=None, chunk_size=2000, decoder=None):
+    """DeckDecoder.decode_many over chunks of deck_codes in a thread pool, returns one DeckBatch in input order.
+
+    Only runs in parallel with the compiled adc extension, the pure Python decoder holds the GIL throughout.
+    """
+    workers = workers or os.cpu_count()
+    decoder = adc.DeckDecoder if decoder is None else decoder
+    # the DeckBatch class that goes with the decoder implementation
+    batch = sys.modules[decoder.__module__].DeckBatch()
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        for chunk in _ordered_map(executor, decoder.decode_many, _chunked(deck_codes, chunk_size),
+                                  2 * workers):
+            batch.extend(chunk)
+    return batch
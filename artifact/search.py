@@ -0,0 +1,206 @@
+"""Full text search over the names and card text of a CardList, built once and cached by CardList.search_index().
+
+    card_set.search('axe')                 # exact name
+    card_set.search('cheat dea')           # every word can be a prefix
+    card_set.search('bristelback')         # names within an edit or two
+    card_set.search('deal damage')         # card text too, unless text=False
+
+Names (in every language the card has) and card text with the markup stripped are split into lower case words. A
+query word scores for every card with the word, or a word it is a prefix of, in its name or text, name matches count
+more than text and exact words more than prefixes. Query words that match no name word also match name words within
+edit distance 1 (2 for words of 8 letters or more, swapping two letters counts as one edit), found through an index of
+the name words with letters deleted. Cards matching more query words rank first, then by score, a query equal to a
+whole name ranks that card first.
+"""
+import bisect
+import collections
+import heapq
+import re
+
+SearchResult = collections.namedtuple('SearchResult', ['card', 'score'])
+
+tags = re.compile(r'<[^<]+?>')
+words = re.compile(r'\w+')
+
+name_score = 3
+name_prefix_score = 2
+fuzzy_score = 1.5
+text_score = 1
+text_prefix_score = 0.5
+whole_name_score = 10
+# every matched query word outranks any match scores, so cards matching more words come first
+word_match_score = 100
+
+
+def tokenize(text):
+    return words.findall(tags.sub(' ', text).replace("'", '').lower()) if text else []
+
+
+def max_edits(word):
+    return 2 if len(word) >= 8 else 1 if len(word) >= 4 else 0
+
+
+def deletes(word, edits):
+    """word with every combination of up to edits letters deleted, word included."""
+    variants = {word}
+    frontier = {word}
+    for _ in range(edits):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        variants |= frontier
+
+    return variants
+
+
+def edit_distance(a, b, limit):
+    """Edit distance of a and b counting swapped neighbouring letters as one edit, or limit + 1 once it is known to be
+    more than limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    before_previous = None
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y))
+            if i > 1 and j > 1 and x == b[j - 2] and a[i - 2] == y:
+                distance = min(distance, before_previous[j - 2] + 1)
+            current.append(distance)
+        if min(current) > limit:
+            return limit + 1
+        before_previous, previous = previous, current
+
+    return previous[-1]
+
+
+class CardSearch:
+    def __init__(self, card_list):
+        """Index the cards of card_list, a card_id appearing more than once is indexed at its first position as in
+        CardList.get_card_by_id."""
+        self.card_list = card_list
+        # word -> ascending positions in card_list of the cards with the word
+        self.name_postings = {}
+        self.text_postings = {}
+        self.whole_names = {}
+        self.fuzzy_index = {}
+
+        seen = set()
+        for i in range(len(card_list)):
+            card = card_list[i]
+            if card.card_id in seen or card_list.is_removed(i):
+                continue
+            seen.add(card.card_id)
+
+            # the compiled Card calls its name card_name
+            names = {card.card_name if hasattr(card, 'card_name') else card.name}
+            names.update((card.card_names or {}).values())
+            for name in names:
+                self.whole_names.setdefault(' '.join(tokenize(name)), i)
+                for word in tokenize(name):
+                    self._add_posting(self.name_postings, word, i)
+            for word in tokenize(card.card_text):
+                self._add_posting(self.text_postings, word, i)
+
+        for word in self.name_postings:
+            for variant in deletes(word, max_edits(word)):
+                self.fuzzy_index.setdefault(variant, []).append(word)
+        self.name_words = sorted(self.name_postings)
+        self.text_words = sorted(self.text_postings)
+
+    @staticmethod
+    def _add_posting(postings, word, i):
+        positions = postings.setdefault(word, [])
+        if not positions or positions[-1] != i:
+            positions.append(i)
+
+    @staticmethod
+    def _prefixed(sorted_words, prefix):
+        start = bisect.bisect_left(sorted_words, prefix)
+        end = bisect.bisect_left(sorted_words, prefix + '\uffff', start)
+        return sorted_words[start:end]
+
+    def _fuzzy(self, word):
+        """Name words within max_edits(word) of word, as (name word, distance)."""
+        edits = max_edits(word)
+        if not edits:
+            return []
+
+        candidates = set()
+        for variant in deletes(word, edits):
+            candidates.update(self.fuzzy_index.get(variant, ()))
+
+        matches = []
+        for candidate in candidates:
+            distance = edit_distance(word, candidate, edits)
+            if 0 < distance <= edits:
+                matches.append((candidate, distance))
+
+        return matches
+
+    def _score_word(self, word, fuzzy, text):
+        """{position: score} of the cards word matches."""
+        scores = {}
+
+        def add(postings, score):
+            for i in postings:
+                if scores.get(i, 0) < score:
+                    scores[i] = score
+
+        # single letters are only matched as whole words, as a prefix they match most of the index
+        name_words = self._prefixed(self.name_words, word) if len(word) > 1 else [word]
+        for name_word in name_words:
+            postings = self.name_postings.get(name_word)
+            if postings:
+                add(postings, name_score if name_word == word else name_prefix_score)
+        if fuzzy and word not in self.name_postings:
+            for name_word, distance in self._fuzzy(word):
+                add(self.name_postings[name_word], fuzzy_score / distance)
+        if text:
+            text_scores = {}
+            text_words = self._prefixed(self.text_words, word) if len(word) > 1 else [word]
+            for text_word in text_words:
+                postings = self.text_postings.get(text_word)
+                if not postings:
+                    continue
+                score = text_score if text_word == word else text_prefix_score
+                if not text_scores:
+                    text_scores = dict.fromkeys(postings, score)
+                    continue
+                for i in postings:
+                    if text_scores.get(i, 0) < score:
+                        text_scores[i] = score
+            # name and text matches add up
+            for i, score in text_scores.items():
+                scores[i] = scores.get(i, 0) + score
+
+        return scores
+
+    def search(self, query, limit=10, fuzzy=True, text=True):
+        """The best limit matches of query as SearchResults, best first, scored word_match_score for each query word
+        a card matches plus the scores of the matches. fuzzy=False turns off matching names within a few edits,
+        text=False matching card text."""
+        query_words = tokenize(query)
+        if not query_words:
+            return []
+
+        scores = {}
+        for word in query_words:
+            word_scores = self._score_word(word, fuzzy, text)
+            if not scores:
+                scores = {i: score + word_match_score for i, score in word_scores.items()}
+                continue
+            for i, score in word_scores.items():
+                scores[i] = scores.get(i, 0) + score + word_match_score
+
+        whole_name = self.whole_names.get(' '.join(query_words))
+        if whole_name is not None:
+            scores[whole_name] += whole_name_score
+
+        # ties keep the order of the first query word's matches, which is card_list order
+        ranked = heapq.nlargest(limit, scores, key=scores.__getitem__)
+        return [SearchResult(self.card_list[i], scores[i]) for i in ranked]
+
+    def find(self, query):
+        """The best match for query, or None."""
+        results = self.search(query, limit=1)
+        return results[0].card if results else None
@@ -0,0 +1,227 @@
+"""Opt-in instrumentation of the deck code and card set hot paths.
+
+enable() wraps the entry points below with timing wrappers that count calls, failures by reason and a latency
+histogram per stage, disable() puts the original functions back. Nothing is wrapped until enable() is called, so
+disabled instrumentation costs nothing on the pure Python or the compiled path.
+
+    from artifact import stats
+    stats.enable()
+    ...
+    print(stats.snapshot()['stages']['decode'])
+
+Stages:
+
+decode, decode_many, encode, encode_many, fingerprint
+    DeckDecoder / DeckEncoder. decode failures and the errors of decode_many batches are counted by reason: prefix,
+    base64, version, checksum, truncated, out_of_range or the exception type.
+decode.bytes
+    Reading a deck code into bytes inside decode: the prefix check and base64 decoding, plus the checksum check in
+    the pure Python module. The rest of decode is reading the varints.
+card_set.load, card_set.fetch, card_set.unpack, card_set.snapshot
+    CardSet.load_card_set and the steps it takes: fetching (and JSON parsing) the set, building the cards from JSON
+    or from a snapshot. Fetches served from the cache without a request are counted in card_set.fetch.cache_hit.
+deck.hydrate, card_list.lookup
+    Deck.from_code_deck_dict and the CardList.get_card_by_id lookups it makes. Methods of extension types can not be
+    wrapped, lookups are not counted with the compiled cards module.
+
+watch(name, cache) adds the hits, misses and evictions of an artifact.cache.DeckCache to snapshot().
+"""
+import collections
+import threading
+import time
+import weakref
+
+import artifact
+
+# (stage, module name on the artifact package, class, attribute)
+entry_points = [
+    ('decode', 'adc', 'DeckDecoder', 'decode'),
+    ('decode.bytes', 'adc', 'DeckDecoder', '_read_header'),
+    ('decode.bytes', 'adc', 'DeckDecoder', '_read_code_bytes'),
+    ('decode_many', 'adc', 'DeckDecoder', 'decode_many'),
+    ('fingerprint', 'adc', 'DeckDecoder', 'fingerprint'),
+    ('encode', 'adc', 'DeckEncoder', 'encode'),
+    ('encode_many', 'adc', 'DeckEncoder', 'encode_many'),
+    ('card_set.load', 'cards', 'CardSet', 'load_card_set'),
+    ('card_set.fetch', 'cards', 'CardSetFetcher', 'fetch'),
+    ('card_set.unpack', 'cards', 'CardSet', 'unpack_dict'),
+    ('card_set.snapshot', 'cards', 'CardSetSnapshot', 'card_set'),
+    ('deck.hydrate', 'cards', 'Deck', 'from_code_deck_dict'),
+    ('card_list.lookup', 'cards', 'CardList', 'get_card_by_id'),
+]
+
+failure_reasons = [('prefix', 'prefix'), ('Incorrect padding', 'base64'), ('base64', 'base64'),
+                   ('version', 'version'), ('Checksum', 'checksum'), ('truncated', 'truncated'),
+                   ('out of range', 'out_of_range')]
+
+
+def failure_reason(error):
+    """The reason of a decode failure, from the exception or a DeckBatch error string."""
+    text = error if isinstance(error, str) else f'{type(error).__name__}: {error}'
+    for needle, reason in failure_reasons:
+        if needle in text:
+            return reason
+
+    return text.split(':', 1)[0]
+
+
+class StageStats:
+    """Calls, failures and a histogram of latencies with power of two nanosecond buckets."""
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = collections.Counter()
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.buckets = collections.Counter()
+
+    def record(self, elapsed_ns, reason=None):
+        self.calls += 1
+        self.total += elapsed_ns
+        if self.min is None or elapsed_ns < self.min:
+            self.min = elapsed_ns
+        if elapsed_ns > self.max:
+            self.max = elapsed_ns
+        # bucket i holds latencies below 2 ** i ns
+        self.buckets[elapsed_ns.bit_length()] += 1
+        if reason is not None:
+            self.failures[reason] += 1
+
+    def percentile(self, q):
+        """Upper bound (seconds) of the bucket holding the q-th percentile."""
+        rank = q / 100 * self.calls
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(2 ** bucket, self.max) / 1e9
+
+        return self.max / 1e9
+
+    def as_dict(self):
+        return {'calls': self.calls, 'failures': sum(self.failures.values()), 'failure_reasons': dict(self.failures),
+                'total': self.total / 1e9, 'mean': self.total / self.calls / 1e9 if self.calls else None,
+                'min': self.min / 1e9 if self.min is not None else None, 'max': self.max / 1e9,
+                'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99),
+                'histogram': [[2 ** bucket / 1e9, self.buckets[bucket]] for bucket in sorted(self.buckets)]}
+
+
+_lock = threading.Lock()
+_stages = collections.defaultdict(StageStats)
+_counters = collections.Counter()
+_caches = {}
+# (class, attribute, original class __dict__ entry) of every wrapped entry point
+_wrapped = []
+
+
+def _record(stage, elapsed_ns, reason=None):
+    with _lock:
+        _stages[stage].record(elapsed_ns, reason)
+
+
+def _count(counter, n=1):
+    with _lock:
+        _counters[counter] += n
+
+
+def _timed(stage, function):
+    def timed(*args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            _record(stage, time.perf_counter_ns() - start, failure_reason(e))
+            raise
+        _record(stage, time.perf_counter_ns() - start)
+        return result
+
+    return timed
+
+
+def _timed_decode_many(stage, function):
+    def decode_many(deck_codes):
+        start = time.perf_counter_ns()
+        batch = function(deck_codes)
+        _record(stage, time.perf_counter_ns() - start)
+        reasons = collections.Counter(failure_reason(error) for error in batch.errors if error is not None)
+        with _lock:
+            _stages[stage].failures.update(reasons)
+        _count('decode_many.decks', len(batch))
+        return batch
+
+    return decode_many
+
+
+def _timed_fetch(stage, function):
+    timed = _timed(stage, function)
+
+    def fetch(self, set_code, force=False):
+        _count('card_set.fetch.cache_hit' if not force and not self.is_expired(set_code) else 'card_set.fetch.request')
+        return timed(self, set_code, force)
+
+    return fetch
+
+
+wrappers = {'decode_many': _timed_decode_many, 'card_set.fetch': _timed_fetch}
+
+
+def enable(adc=None, cards=None):
+    """Start instrumenting adc and cards, the modules artifact.adc and artifact.cards resolve to by default."""
+    modules = {'adc': adc or artifact.adc, 'cards': cards or artifact.cards}
+    with _lock:
+        wrapped = {(cls, attribute) for cls, attribute, _ in _wrapped}
+        for stage, module, class_name, attribute in entry_points:
+            cls = getattr(modules[module], class_name, None)
+            if cls is None or attribute not in cls.__dict__ or (cls, attribute) in wrapped:
+                continue
+
+            original = cls.__dict__[attribute]
+            is_static = isinstance(original, staticmethod)
+            function = original.__func__ if is_static else original
+            wrapper = wrappers.get(stage, _timed)(stage, function)
+            try:
+                setattr(cls, attribute, staticmethod(wrapper) if is_static else wrapper)
+            except TypeError:
+                # extension types
+                continue
+            _wrapped.append((cls, attribute, original))
+
+
+def disable():
+    """Put the original functions back, the stats collected so far are kept."""
+    with _lock:
+        while _wrapped:
+            cls, attribute, original = _wrapped.pop()
+            setattr(cls, attribute, original)
+
+
+def is_enabled():
+    return bool(_wrapped)
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+
+def watch(name, cache):
+    """Report cache.stats() (a DeckCache) under name in snapshot() while the cache is alive."""
+    with _lock:
+        _caches[name] = weakref.ref(cache)
+
+
+def snapshot():
+    """The stats collected so far as a dict of plain values (times in seconds)."""
+    with _lock:
+        caches = {}
+        for name, ref in list(_caches.items()):
+            cache = ref()
+            if cache is None:
+                del _caches[name]
+                continue
+            caches[name] = cache.stats()
+
+        return {'enabled': bool(_wrapped), 'stages': {stage: stats.as_dict() for stage, stats in _stages.items()},
+                'counters': dict(_counters), 'caches': caches}
@@ -0,0 +1,101 @@
+"""Columnar attribute table over a CardList, for filtering cards with vectorized masks instead of reading the
+attributes of every Card.
+
+    table = card_set.cards.table()
+    green_creeps = table.select((table.card_type == 'Creep') & (table.colour == 'green') & (table.mana_cost <= 3))
+
+card_id, mana_cost, gold_cost, attack, armor and hit_points are NumPy int32 arrays with 0 for a missing value, as in
+the compiled cards module. card_type, colour and sub_type are Categorical columns, integer codes into a list of
+categories, comparing one to a string compares codes. Masks are boolean arrays with an entry per card and select
+returns the matching cards as a CardList view sharing the cards of the table's list. Cards removed from the list keep
+their row but are never selected.
+
+Requires numpy (``pip install artifact[corpus]``).
+"""
+import numpy as np
+
+numeric_columns = ['card_id', 'mana_cost', 'gold_cost', 'attack', 'armor', 'hit_points']
+categorical_columns = ['card_type', 'colour', 'sub_type']
+
+
+class Categorical:
+    """Strings stored as int32 codes into categories, missing values (None) have the code -1."""
+
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = categories
+        self._lookup = {category: code for code, category in enumerate(categories)}
+
+    @staticmethod
+    def from_values(values):
+        lookup = {}
+        codes = [-1 if value is None else lookup.setdefault(value, len(lookup)) for value in values]
+        return Categorical(np.array(codes, dtype=np.int32), list(lookup))
+
+    def code(self, value):
+        """The code of value, -1 for None and -2 (which matches nothing) for a value that is not a category."""
+        return -1 if value is None else self._lookup.get(value, -2)
+
+    def __eq__(self, value):
+        return self.codes == self.code(value)
+
+    def __ne__(self, value):
+        return self.codes != self.code(value)
+
+    __hash__ = None
+
+    def isin(self, values):
+        return np.isin(self.codes, [self.code(value) for value in values])
+
+    def __getitem__(self, i):
+        code = self.codes[i]
+        return None if code < 0 else self.categories[code]
+
+    def __len__(self):
+        return len(self.codes)
+
+
+class CardTable:
+    def __init__(self, card_list, columns):
+        self.card_list = card_list
+        for name in numeric_columns + categorical_columns:
+            setattr(self, name, columns[name])
+        # rows of the cards that were not removed from card_list
+        self.live = np.array([not card_list.is_removed(i) for i in range(len(card_list))], dtype=bool)
+
+    @staticmethod
+    def from_card_list(card_list):
+        """Read the attributes of every card of card_list once, CardList.table caches the result."""
+        cards = [card_list[i] for i in range(len(card_list))]
+        columns = {name: np.array([getattr(card, name) or 0 for card in cards], dtype=np.int32)
+                   for name in numeric_columns}
+        columns.update({name: Categorical.from_values([getattr(card, name) for card in cards])
+                        for name in categorical_columns})
+
+        return CardTable(card_list, columns)
+
+    def where(self, **values):
+        """Mask of the cards whose columns equal values, a list or tuple value matches any of its items.
+
+            table.where(card_type='Creep', colour=['green', 'black'])
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for name, value in values.items():
+            column = getattr(self, name)
+            if isinstance(value, (list, tuple)):
+                mask &= column.isin(value) if isinstance(column, Categorical) else np.isin(column, value)
+            else:
+                mask &= column == value
+
+        return mask
+
+    def select(self, mask):
+        """The cards where mask is true as a CardList view, in table order."""
+        return self.card_list.take(np.flatnonzero(mask & self.live).tolist())
+
+    def filter(self, **values):
+        """Shorthand for select(where(**values))."""
+        return self.select(self.where(**values))
+
+    def __len__(self):
+        return len(self.card_id)
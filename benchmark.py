@@ -1,77 +1,349 @@
+"""Offline benchmark of the pure Python, plain Cython and optimized Cython implementations.
+
+Every stage (set load, index build, encode, decode, hydrate and the batch paths) is timed on its own against
+synthetic card sets and seeded decks, so runs are reproducible without the card API. --imports also times importing
+the modules in a fresh interpreter. Each stage is run warmup times
+and then timed repeat times, results are summarised as percentiles of the per run times.
+
+    python benchmark.py                                   # print a table
+    python benchmark.py -o results.json                   # also write the results as JSON
+    python benchmark.py --baseline results.json --threshold 0.2  # exit 1 when a stage is 20% slower than before
+
+The optimized implementation is the built artifact.adc / artifact.cards extensions, the plain Cython one is
+adc_c.pyx / cards_c.pyx which are never built by setup.py. With --pyximport missing extensions are compiled on the fly
+with pyximport, otherwise implementations that can not be imported are skipped.
+"""
+import argparse
+import functools
+import importlib
+import json
+import operator
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
 import time
-import datetime
 
-import adc_py
-import cards_py
+colours = ['black', 'blue', 'green', 'red']
+import_statements = ['import artifact', 'from artifact import adc', 'from artifact import cards', 'import adc_py',
+                     'import cards_py']
+stages = ['set_load', 'snapshot_load', 'index_build', 'encode', 'decode', 'encode_many', 'decode_many', 'hydrate',
+          'validate_many']
+implementations = {
+    'python': [('cards_py', 'adc_py')],
+    'cython': [('cards_c', 'adc_c')],
+    'optimized': [('artifact.cards', 'artifact.adc'), ('cards', 'adc')],
+}
 
-import pyximport; pyximport.install()
 
-import adc_c
-import cards_c
+def synthetic_card_set(set_id, first_card_id, heroes=44, creeps=60, spells=80, improvements=20, items=50, seed=0):
+    """A card set document shaped like the card API's, heroes reference a signature spell with 3 copies."""
+    rng = random.Random(seed)
+    card_list = []
+    card_id = first_card_id
 
-from artifact import adc
-from artifact import cards
+    def card(card_type, colour=None, **fields):
+        nonlocal card_id
+        card_id += 1
+        name = f'{card_type} {set_id}-{card_id}'
+        d = {'card_id': card_id, 'base_card_id': card_id, 'card_type': card_type,
+             'card_name': {'english': name, 'german': name + ' (de)', 'french': name + ' (fr)'},
+             'card_text': {'english': f'<span>{name}</span> ' + 'does something useful. ' * rng.randint(1, 6)},
+             'mini_image': {'default': f'https://example.com/{card_id}_mini.png'},
+             'large_image': {'default': f'https://example.com/{card_id}_large.png'},
+             'ingame_image': {'default': f'https://example.com/{card_id}_ingame.png'},
+             'illustrator': f'Illustrator {rng.randint(1, 30)}', 'references': []}
+        if colour:
+            d['is_' + colour] = True
+        d.update(fields)
+        card_list.append(d)
+        return d
 
-import random
+    for _ in range(heroes):
+        colour = rng.choice(colours)
+        hero = card('Hero', colour, attack=rng.randint(2, 8), armor=rng.randint(0, 2), hit_points=rng.randint(8, 14))
+        signature = card('Spell', colour, mana_cost=rng.randint(1, 8))
+        hero['references'] = [{'card_id': signature['card_id'], 'ref_type': 'includes', 'count': 3}]
+    for _ in range(creeps):
+        card('Creep', rng.choice(colours), mana_cost=rng.randint(1, 9), attack=rng.randint(0, 8),
+             hit_points=rng.randint(1, 12))
+    for _ in range(spells):
+        card('Spell', rng.choice(colours), mana_cost=rng.randint(1, 9))
+    for _ in range(improvements):
+        card('Improvement', rng.choice(colours), mana_cost=rng.randint(1, 9))
+    for _ in range(items):
+        card('Item', gold_cost=rng.randint(3, 25), sub_type=rng.choice(['Weapon', 'Armor', 'Accessory', 'Consumable']))
 
+    return {'card_set': {'version': 1, 'set_info': {'set_id': set_id, 'pack_item_def': 0,
+                                                    'name': {'english': f'Synthetic {set_id}'}},
+                         'card_list': card_list}}
 
-def run(name, cardlib, adclib):
-    start = time.time()
 
-    all_cards = cardlib.CardSet.load_card_set('00').cards + cardlib.CardSet.load_card_set('01').cards
+def import_implementation(name, use_pyximport):
+    """Return (cards module, adc module) for an implementation, or None if it can not be imported."""
+    for cards_name, adc_name in implementations[name]:
+        try:
+            return importlib.import_module(cards_name), importlib.import_module(adc_name)
+        except ImportError:
+            continue
+
+    if use_pyximport and name != 'python':
+        import pyximport
+        pyximport.install(language_level=3)
+        cards_name, adc_name = implementations[name][-1]
+        return importlib.import_module(cards_name), importlib.import_module(adc_name)
+
+    return None
+
+
+def percentile(sorted_times, q):
+    """Nearest rank percentile of a sorted list."""
+    return sorted_times[min(len(sorted_times) - 1, max(0, round(q / 100 * len(sorted_times) + 0.5) - 1))]
+
+
+def time_stage(run, items, warmup, repeat):
+    """Call run() warmup times untimed and repeat times timed, items is the number of operations in one call."""
+    for _ in range(warmup):
+        run()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    return summarise(times, items)
+
+
+def summarise(times, items):
+    times = sorted(times)
+    median = statistics.median(times)
+    return {'items': items, 'repeat': len(times), 'min': times[0], 'median': median, 'mean': statistics.fmean(times),
+            'p90': percentile(times, 90), 'p99': percentile(times, 99), 'max': times[-1],
+            'items_per_second': items / median if median else None}
+
+
+def time_imports(statements, repeat):
+    """Time each import statement in a fresh interpreter repeat times, interpreter startup is not counted."""
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for statement in statements:
+            code = f'import time\nstart = time.perf_counter()\n{statement}\nprint(time.perf_counter() - start)'
+            times = [float(subprocess.run([sys.executable, '-c', code], cwd=tmp, env=env, check=True,
+                                          capture_output=True, text=True).stdout) for _ in range(repeat)]
+            results[statement] = summarise(times, 1)
+
+    return results
+
+
+def benchmark(cardlib, adclib, card_set_data, code_deck_dicts, selected, warmup, repeat, tmp):
+    """Time every stage in selected for one implementation, return {stage: summary}."""
+    results = {}
+    card_sets = [cardlib.CardSet.unpack_dict(data, f'{i:02}') for i, data in enumerate(card_set_data)]
+    pool = functools.reduce(operator.add, [card_set.cards for card_set in card_sets])
+    deck_codes = [adclib.DeckEncoder.encode(d) for d in code_deck_dicts]
+    decoded = [adclib.DeckDecoder.decode(deck_code) for deck_code in deck_codes]
+    batch = adclib.DeckDecoder.decode_many(deck_codes)
+    validator = cardlib.DeckValidator(pool)
+
+    snapshot_paths = []
+    for i, data in enumerate(card_set_data):
+        snapshot_paths.append(os.path.join(tmp, f'{cardlib.__name__}-{i:02}.snapshot'))
+        cardlib.CardSetSnapshot.write(data, snapshot_paths[-1])
+
+    def index_build():
+        merged = functools.reduce(operator.add, [card_set.cards for card_set in card_sets])
+        # views build their indexes on first use
+        merged.get_idx_by_id(0)
+
+    def hydrate():
+        for d in decoded:
+            cardlib.Deck.from_code_deck_dict(d, pool)
+
+    # the two ways load_card_set reads a cached set, up to the first lookup as the compiled snapshot builds its
+    # indexes on first use
+    cached_json = [json.dumps(data) for data in card_set_data]
 
-    hero_cards = [card for card in all_cards if card.card_type == 'Hero']
-    sig_cards = []
-    for hero_card in hero_cards:
-        for ref in hero_card.references:
-            if ref['ref_type'] == 'includes':
-                ref_card = None
-                for card in all_cards:
-                    if card.card_id == ref['card_id']:
-                        ref_card = card
-                sig_cards.append(ref_card)
+    def set_load():
+        for i, text in enumerate(cached_json):
+            cardlib.CardSet.unpack_dict(json.loads(text), f'{i:02}').cards.get_idx_by_id(0)
 
-    item_cards = [card for card in all_cards if card.card_type == 'Item']
+    def snapshot_load():
+        for i, path in enumerate(snapshot_paths):
+            cardlib.CardSetSnapshot(path).card_set(f'{i:02}').cards.get_idx_by_id(0)
 
-    playable_cards = []
-    for card in all_cards:
-        if card not in sig_cards and card.card_type in ['Spell', 'Creep', 'Improvement']:
-            playable_cards.append(card)
+    runs = {
+        'set_load': (set_load, len(card_set_data)),
+        'snapshot_load': (snapshot_load, len(snapshot_paths)),
+        'index_build': (index_build, 1),
+        'encode': (lambda: [adclib.DeckEncoder.encode(d) for d in code_deck_dicts], len(code_deck_dicts)),
+        'decode': (lambda: [adclib.DeckDecoder.decode(deck_code) for deck_code in deck_codes], len(deck_codes)),
+        'encode_many': (lambda: adclib.DeckEncoder.encode_many(batch), len(batch)),
+        'decode_many': (lambda: adclib.DeckDecoder.decode_many(deck_codes), len(deck_codes)),
+        'hydrate': (hydrate, len(decoded)),
+        'validate_many': (lambda: validator.validate_many(batch), len(batch)),
+    }
 
-    load_time = time.time() - start
+    for stage in selected:
+        run, items = runs[stage]
+        results[stage] = time_stage(run, items, warmup, repeat)
 
-    def deck_generator(count=100):
-        for i in range(count):
-            heroes = [random.choice(hero_cards) for i in range(5)]
+    return results
 
-            items = [random.choice(item_cards) for i in range(random.randint(9, 18))]
 
-            main_deck = [random.choice(playable_cards) for i in range(random.randint(25, 50))]
+def compare(results, baseline, threshold):
+    """Return a line for every stage whose median time per item is more than threshold (a fraction) slower than in
+    baseline."""
+    regressions = []
+    for name, stage_results in results['results'].items():
+        for stage, summary in stage_results.items():
+            before = baseline.get('results', {}).get(name, {}).get(stage)
+            if before is None:
+                continue
+            now_per_item = summary['median'] / summary['items']
+            before_per_item = before['median'] / before['items']
+            ratio = now_per_item / before_per_item if before_per_item else 1
+            if ratio > 1 + threshold:
+                regressions.append(f'{name} {stage}: {before_per_item * 1e6:.2f}us -> {now_per_item * 1e6:.2f}us '
+                                   f'per item ({ratio - 1:+.0%})')
 
-            yield cardlib.Deck(heroes, main_deck, items, str(i))
+    return regressions
 
+
+def print_table(results, stream=sys.stdout):
+    print(f'{"implementation":<12} {"stage":<26} {"median ms":>10} {"p90 ms":>10} {"p99 ms":>10} {"items/s":>14}',
+          file=stream)
+    for name, stage_results in results['results'].items():
+        for stage, summary in stage_results.items():
+            rate = summary['items_per_second']
+            print(f'{name:<12} {stage:<26} {summary["median"] * 1e3:>10.3f} {summary["p90"] * 1e3:>10.3f} '
+                  f'{summary["p99"] * 1e3:>10.3f} {rate or 0:>14,.0f}', file=stream)
+
+
+def run_merge_memory(cardlib, card_lists, merges=10000):
+    """Merge every set merges times keeping the results, then drop them and merge as many times again.
+
+    The growth of the peak RSS (KiB on Linux) while results are held is their cost, any growth after they are
+    dropped is leaked.
+    """
+    def max_rss():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start_rss = max_rss()
     start = time.time()
-    runs = 1000
-    gen_start = time.time()
-    total_gen_time = 0
-    for deck in deck_generator(runs):
-        gen_end = time.time()
-        total_gen_time += gen_end - gen_start
-
-        deck_code_dict = deck.to_code_deck_dict()
-        deck_code_encode = adclib.DeckEncoder.encode(deck_code_dict)
-        deck_code_decode = adclib.DeckDecoder.decode(deck_code_encode)
-        new_deck = cardlib.Deck.from_code_deck_dict(deck_code_decode, all_cards)
-
-        gen_start = time.time()
-
-    end = time.time()
-    total_time = end - start
-    encode_decode_time = total_time - total_gen_time
-    print(f'{name} for {runs} runs:', datetime.timedelta(seconds=total_time))
-    print(f'gen_time: {total_gen_time: .3f}s | ed_time: {encode_decode_time: .3f}s | load_time: {load_time: .3f}s')
-
-
-run('Pure Python', cards_py, adc_py)
-run('Cython', cards_c, adc_c)
-run('"Optimized" Cython', cards, adc)
+    merged = [functools.reduce(operator.add, card_lists) for _ in range(merges)]
+    merge_time = time.time() - start
+    slices = [card_list[::2] for card_list in merged]
+    held_rss = max_rss()
+
+    del merged, slices
+    for _ in range(merges):
+        cardlib.CardList.concat(card_lists)[1:]
+    leaked_rss = max_rss() - held_rss
+
+    print(f'merge: {merges / merge_time:,.0f} merges/s | {(held_rss - start_rss) * 1024 / merges:,.0f} bytes held '
+          f'per merge | {leaked_rss:,} KiB grown after dropping them')
+
+
+def run_parallel(cardlib, adclib, all_cards, deck_codes):
+    from artifact import parallel
+
+    start = time.perf_counter()
+    for deck_code in deck_codes:
+        cardlib.Deck.from_code_deck_dict(adclib.DeckDecoder.decode(deck_code), all_cards)
+    serial_rate = len(deck_codes) / (time.perf_counter() - start)
+    print(f'serial decode + hydrate: {serial_rate:,.0f} decks/s')
+
+    for workers in range(1, os.cpu_count() + 1):
+        start = time.perf_counter()
+        parallel.decode_and_hydrate(deck_codes, all_cards, workers=workers, decoder=adclib.DeckDecoder)
+        rate = len(deck_codes) / (time.perf_counter() - start)
+        print(f'{workers} workers: {rate:,.0f} decks/s | {rate / serial_rate:.2f}x')
+
+    start = time.perf_counter()
+    adclib.DeckDecoder.decode_many(deck_codes)
+    serial_rate = len(deck_codes) / (time.perf_counter() - start)
+    print(f'serial decode_many: {serial_rate:,.0f} decks/s')
+
+    for workers in range(1, os.cpu_count() + 1):
+        start = time.perf_counter()
+        parallel.threaded_decode_many(deck_codes, workers=workers, decoder=adclib.DeckDecoder)
+        rate = len(deck_codes) / (time.perf_counter() - start)
+        print(f'{workers} threads: {rate:,.0f} decks/s | {rate / serial_rate:.2f}x')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-i', '--implementations', nargs='+', choices=list(implementations),
+                        default=list(implementations))
+    parser.add_argument('-s', '--stages', nargs='+', choices=stages, default=stages)
+    parser.add_argument('--decks', type=int, default=2000, help='decks per encode/decode/hydrate run')
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=9)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fail when a median is more than this fraction slower than the baseline (default 0.1)')
+    parser.add_argument('--pyximport', action='store_true', help='compile missing extensions with pyximport')
+    parser.add_argument('--imports', action='store_true', help='also time importing the modules in a fresh interpreter')
+    parser.add_argument('--memory', action='store_true', help='also run the card list merge memory benchmark')
+    parser.add_argument('--parallel', action='store_true', help='also run the process and thread scaling benchmark')
+    args = parser.parse_args(argv)
+
+    import cards_py
+    from artifact.generate import DeckGenerator
+
+    card_set_data = [synthetic_card_set(0, 1000, seed=args.seed), synthetic_card_set(1, 5000, seed=args.seed + 1)]
+    generator_pool = functools.reduce(operator.add, [cards_py.CardSet.unpack_dict(data, f'{i:02}').cards
+                                                     for i, data in enumerate(card_set_data)])
+    code_deck_dicts = DeckGenerator(generator_pool, seed=args.seed).code_deck_dicts(args.decks, name='Benchmark')
+
+    results = {'meta': {'python': sys.version.split()[0], 'platform': platform.platform(), 'decks': args.decks,
+                        'warmup': args.warmup, 'repeat': args.repeat, 'seed': args.seed},
+               'results': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.implementations:
+            modules = import_implementation(name, args.pyximport)
+            if modules is None:
+                print(f'skipping {name}, it is not built (see --pyximport)', file=sys.stderr)
+                continue
+            cardlib, adclib = modules
+            results['results'][name] = benchmark(cardlib, adclib, card_set_data, code_deck_dicts, args.stages,
+                                                 args.warmup, args.repeat, tmp)
+
+            if args.memory:
+                run_merge_memory(cardlib, [cardlib.CardSet.unpack_dict(data, f'{i:02}').cards
+                                           for i, data in enumerate(card_set_data)])
+            if args.parallel:
+                pool = functools.reduce(operator.add, [cardlib.CardSet.unpack_dict(data, f'{i:02}').cards
+                                                       for i, data in enumerate(card_set_data)])
+                run_parallel(cardlib, adclib, pool, [adclib.DeckEncoder.encode(d) for d in code_deck_dicts] * 100)
+
+    if args.imports:
+        results['results']['imports'] = time_imports(import_statements, args.repeat)
+
+    print_table(results)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.threshold)
+        for regression in regressions:
+            print(f'regression: {regression}', file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,17 +1,39 @@
 # cython: language_level=3
-import requests
 import re
 import textwrap
 import pathlib
 import json
+import functools
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
 import cython
-from libc.stdlib cimport malloc, free
-from libc.string cimport memcpy, strlen, strncpy, strcmp
+from array import array
+from collections import Counter, namedtuple
+from cpython.ref cimport PyObject, Py_INCREF, Py_XDECREF
+from libc.stdlib cimport malloc, realloc, free
+from libc.string cimport memcmp, memcpy, strlen, strncpy
 
-cdef bint SHARE_STRUCTS = False
+# where card sets are cached, ARTIFACT_CACHE_DIR or .cache in the working directory, created on the first write
+cache = pathlib.Path(os.environ.get('ARTIFACT_CACHE_DIR', '.cache'))
+
+
+def set_cache_dir(path):
+    """Cache card sets in path from now on."""
+    global cache
+    cache = pathlib.Path(path)
+
+def write_atomic(path, content):
+    """Write bytes to path through a temporary file and a rename, so readers never see a partial file."""
+    pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
 
-cache = pathlib.Path('.cache')
-cache.mkdir(exist_ok=True)
 
 def format_columns(col_width, columns):
     s = ''
@@ -57,16 +79,23 @@ cdef struct CardStruct:
     int base_card_id
     int num_references
     CardRefStruct *references
+    # the strings point into a CardSetSnapshot mapping kept open by the owning CardList, only references is malloc'd
+    bint borrowed
+    # {width: text} of Card.render, a reference owned by the struct and NULL until the card is rendered
+    PyObject *rendered
 
 
 cdef CardStruct* copy_card_struct(CardStruct* card_struct):
-    cdef CardStruct *new_card_struct = <CardStruct*> malloc(cython.sizeof(CardStruct))
     if card_struct is NULL:
         return NULL
+    cdef CardStruct *new_card_struct = <CardStruct*> malloc(cython.sizeof(CardStruct))
     if new_card_struct is NULL:
         raise MemoryError
 
+    # interned strings (card_type, colour, sub_type and reference types) are shared, the rest is copied
     memcpy(new_card_struct, card_struct, cython.sizeof(CardStruct))
+    new_card_struct.borrowed = False
+    new_card_struct.rendered = NULL
 
     new_card_struct.card_name = <char*> malloc(cython.sizeof(char)*(card_struct.card_name_len+1))
     if new_card_struct.card_name is NULL:
@@ -74,24 +103,12 @@ cdef CardStruct* copy_card_struct(CardStruct* card_struct):
     strncpy(new_card_struct.card_name, card_struct.card_name[:card_struct.card_name_len], card_struct.card_name_len)
     new_card_struct.card_name_len = card_struct.card_name_len
 
-    new_card_struct.sub_type = <char*> malloc(cython.sizeof(char)*(card_struct.sub_type_len+1))
-    if new_card_struct.sub_type is NULL:
-        raise MemoryError
-    strncpy(new_card_struct.sub_type, card_struct.sub_type[:card_struct.sub_type_len], card_struct.sub_type_len)
-    new_card_struct.sub_type_len = card_struct.sub_type_len
-
     new_card_struct.card_text = <char*> malloc(cython.sizeof(char)*(card_struct.card_text_len+1))
     if new_card_struct.card_text is NULL:
         raise MemoryError
     strncpy(new_card_struct.card_text, card_struct.card_text[:card_struct.card_text_len], card_struct.card_text_len)
     new_card_struct.card_text_len = card_struct.card_text_len
 
-    new_card_struct.colour = <char*> malloc(cython.sizeof(char)*(card_struct.colour_len+1))
-    if new_card_struct.colour is NULL:
-        raise MemoryError
-    strncpy(new_card_struct.colour, card_struct.colour[:card_struct.colour_len], card_struct.colour_len)
-    new_card_struct.colour_len = card_struct.colour_len
-
     new_card_struct.illustrator = <char*> malloc(cython.sizeof(char)*(card_struct.illustrator_len+1))
     if new_card_struct.illustrator is NULL:
         raise MemoryError
@@ -116,21 +133,15 @@ cdef CardStruct* copy_card_struct(CardStruct* card_struct):
     strncpy(new_card_struct.ingame_image, card_struct.ingame_image[:card_struct.ingame_image_len], card_struct.ingame_image_len)
     new_card_struct.ingame_image_len = card_struct.ingame_image_len
 
-    new_card_struct.card_type = <char*> malloc(cython.sizeof(char)*(card_struct.card_type_len+1))
-    if new_card_struct.card_type is NULL:
-        raise MemoryError
-    strncpy(new_card_struct.card_type, card_struct.card_type[:card_struct.card_type_len], card_struct.card_type_len)
-    new_card_struct.card_type_len = card_struct.card_type_len
+    if card_struct.references is NULL or card_struct.num_references == 0:
+        new_card_struct.references = NULL
+        return new_card_struct
 
     new_card_struct.references = <CardRefStruct*>malloc(card_struct.num_references * cython.sizeof(CardRefStruct))
     if new_card_struct.references is NULL:
         raise MemoryError
     for i in range(card_struct.num_references):
         memcpy(&new_card_struct.references[i], &card_struct.references[i], cython.sizeof(CardRefStruct))
-        new_card_struct.references[i].ref_type = <char*> malloc(cython.sizeof(char)*(card_struct.references[i].ref_type_len+1))
-        if new_card_struct.references[i].ref_type is NULL:
-            raise MemoryError
-        strncpy(new_card_struct.references[i].ref_type, card_struct.references[i].ref_type, card_struct.references[i].ref_type_len)
 
     return new_card_struct
 
@@ -143,6 +154,34 @@ def encode(s):
         raise Exception(f'String contains null byte.\n{s}')
     return encoded_s
 
+# card_type, colour, sub_type and reference types repeat across cards, each distinct value is stored once in here and
+# structs point into these bytes objects, which are never freed
+cdef dict _interned_strings = {}
+
+cdef char* intern_string(bytes value) except NULL:
+    cdef bytes interned = _interned_strings.setdefault(value, value)
+    return interned
+
+# widths Card.render keeps per card before it starts over
+cdef int _rendered_widths = 8
+
+cdef inline void forget_rendered(CardStruct* card_struct):
+    Py_XDECREF(card_struct.rendered)
+    card_struct.rendered = NULL
+
+cdef void free_card_struct_fields(CardStruct* card_struct):
+    forget_rendered(card_struct)
+    free(card_struct.references)
+    if card_struct.borrowed:
+        return
+    free(card_struct.card_name)
+    free(card_struct.card_text)
+    free(card_struct.illustrator)
+    free(card_struct.mini_image)
+    free(card_struct.large_image)
+    free(card_struct.ingame_image)
+
+
 card_keys = ['card_name', 'card_id', 'card_type', 'references', 'mini_image', 'large_image', 'ingame_image',
              'hit_points', 'attack', 'armor', 'retaliate', 'regen', 'mana_cost', 'gold_cost', 'sub_type', 'card_text',
              'colour', 'illustrator', 'base_card_id']
@@ -150,13 +189,18 @@ card_keys = ['card_name', 'card_id', 'card_type', 'references', 'mini_image', 'l
 cdef class Card:
     cdef CardStruct *_data
     cdef bint ptr_owner
+    # keeps the struct alive when it belongs to someone else, usually the CardList the card came from
+    cdef object _base
+    cdef public dict card_names
     display_width = 60
 
     def __cinit__(self):
         self.ptr_owner = False
+        self._base = None
 
     def __dealloc__(self):
         if self._data is not NULL and self.ptr_owner is True:
+            free_card_struct_fields(self._data)
             free(self._data)
 
             self._data = NULL
@@ -169,7 +213,7 @@ cdef class Card:
                 colour = c
                 break
 
-        return Card.new_card(
+        cdef Card card = Card.new_card(
             card_name = encode(d['card_name']['english']),
             card_id = d['card_id'],
             card_type = encode(d['card_type']),
@@ -190,6 +234,19 @@ cdef class Card:
             illustrator = encode(d.get('illustrator', '')),
             base_card_id = d.get('base_card_id', 0)
         )
+        card.card_names = d['card_name']
+
+        return card
+
+    def same_values(self, Card card):
+        """Whether card has the same values as this card."""
+        return self.__reduce__()[1] == card.__reduce__()[1]
+
+    def __reduce__(self):
+        return _unpickle_card, (self.card_name, self.card_id, self.card_type, self.references, self.mini_image,
+                                self.large_image, self.ingame_image, self.hit_points, self.attack, self.armor,
+                                self.mana_cost, self.gold_cost, self.sub_type, self.card_text, self.colour,
+                                self.illustrator, self.base_card_id, self.card_names)
 
     def pack_dict(self):
         return {
@@ -197,10 +254,11 @@ cdef class Card:
         }
 
     @staticmethod
-    cdef Card from_ptr(CardStruct *_data, bint owner=False):
+    cdef Card from_ptr(CardStruct *_data, bint owner=False, base=None):
         cdef Card card = Card.__new__(Card)
         card._data = _data
         card.ptr_owner = owner
+        card._base = base
         return card
 
     cdef CardStruct* get_data(self):
@@ -214,6 +272,8 @@ cdef class Card:
         cdef CardStruct *_data = <CardStruct*> malloc(cython.sizeof(CardStruct))
         if _data is NULL:
             raise MemoryError
+        _data.borrowed = False
+        _data.rendered = NULL
         card_name_len = strlen(card_name)
 
         cdef int i = 0
@@ -224,12 +284,8 @@ cdef class Card:
 
             for i, reference in enumerate(references):
                 encoded_ref_type = encode(reference['ref_type'])
-                encoded_ref_type_length = len(encoded_ref_type)
-                _data.references[i].ref_type = <char*>malloc((encoded_ref_type_length+1)*cython.sizeof(char))
-                if _data.references[i].ref_type is NULL:
-                    raise MemoryError
-                strncpy(_data.references[i].ref_type, encoded_ref_type, encoded_ref_type_length)
-                _data.references[i].ref_type_len = encoded_ref_type_length
+                _data.references[i].ref_type = intern_string(encoded_ref_type)
+                _data.references[i].ref_type_len = len(encoded_ref_type)
                 _data.references[i].card_id = reference['card_id']
                 _data.references[i].count = reference.get('count', 0)
         else:
@@ -242,12 +298,8 @@ cdef class Card:
         strncpy(_data.card_name, card_name, card_name_len)
         _data.card_name_len = card_name_len
 
-        sub_type_len = strlen(sub_type)
-        _data.sub_type = <char*> malloc(cython.sizeof(char)*(sub_type_len+1))
-        if _data.sub_type is NULL:
-            raise MemoryError
-        strncpy(_data.sub_type, sub_type, sub_type_len)
-        _data.sub_type_len = sub_type_len
+        _data.sub_type_len = strlen(sub_type)
+        _data.sub_type = intern_string(sub_type[:_data.sub_type_len])
 
         card_text_len = strlen(card_text)
         _data.card_text = <char*> malloc(cython.sizeof(char)*(card_text_len+1))
@@ -256,12 +308,8 @@ cdef class Card:
         strncpy(_data.card_text, card_text, card_text_len)
         _data.card_text_len = card_text_len
 
-        colour_len = strlen(colour)
-        _data.colour = <char*> malloc(cython.sizeof(char)*(colour_len+1))
-        if _data.colour is NULL:
-            raise MemoryError
-        strncpy(_data.colour, colour, colour_len)
-        _data.colour_len = colour_len
+        _data.colour_len = strlen(colour)
+        _data.colour = intern_string(colour[:_data.colour_len])
 
         illustrator_len = strlen(illustrator)
         _data.illustrator = <char*> malloc(cython.sizeof(char)*(illustrator_len+1))
@@ -291,14 +339,10 @@ cdef class Card:
         strncpy(_data.ingame_image, ingame_image, ingame_image_len)
         _data.ingame_image_len = ingame_image_len
 
-        card_type_len = strlen(card_type)
-        _data.card_type = <char*> malloc(cython.sizeof(char)*(card_type_len+1))
-        if _data.card_type is NULL:
-            raise MemoryError
-        strncpy(_data.card_type, card_type, card_type_len)
-        _data.card_type_len = card_type_len
+        _data.card_type_len = strlen(card_type)
+        _data.card_type = intern_string(card_type[:_data.card_type_len])
 
-        _data.num_references = i
+        _data.num_references = len(references) if references else 0
         _data.card_id = card_id
         _data.hit_points = hit_points
         _data.attack = attack
@@ -307,7 +351,7 @@ cdef class Card:
         _data.gold_cost = gold_cost
         _data.base_card_id = base_card_id
 
-        return Card.from_ptr(_data, owner=not SHARE_STRUCTS)
+        return Card.from_ptr(_data, owner=True)
 
     @property
     def card_name(self):
@@ -399,81 +443,385 @@ cdef class Card:
     def base_card_id(self):
         return self._data.base_card_id if self._data is not NULL else None
 
-    def __str__(self):
-        col_width = int(self.display_width / 2)
-        lines = [f'{self.colour.upper():-^{self.display_width}}']
-
-        lines.append(format_columns(col_width, [('Name', self.card_name), ('Type', self.card_type)]))
-        if self.mana_cost or self.gold_cost:
-            columns = [('Mana', self.data.mana_cost)] if self.mana_cost else [('Gold', self.gold_cost)]
+    def render(self, width=None):
+        """The card as a box of text width (display_width by default) characters wide, memoized per width in the
+        struct, so every Card viewing it shares the rendered text until the struct is freed or replaced."""
+        width = width or self.display_width
+        cdef dict rendered
+        if self._data.rendered is NULL:
+            rendered = {}
+            Py_INCREF(rendered)
+            self._data.rendered = <PyObject*> rendered
+        else:
+            rendered = <dict> self._data.rendered
+        text = rendered.get(width)
+        if text is None:
+            if len(rendered) >= _rendered_widths:
+                rendered.clear()
+            text = rendered[width] = self._render(width)
+
+        return text
+
+    def _render(self, int width):
+        colour = (self.colour or '').upper()
+        lines = [f'{colour:-^{width}}']
+
+        lines.append(format_columns(int(width / 2), [('Name', self.card_name), ('Type', self.card_type)]))
+        if self._data.mana_cost or self._data.gold_cost:
+            columns = [('Mana', self._data.mana_cost)] if self._data.mana_cost else [('Gold', self._data.gold_cost)]
             if self.sub_type:
                 columns += [('Sub Type', self.sub_type)]
-            lines.append(format_columns(int(self.display_width / len(columns)), columns))
+            lines.append(format_columns(int(width / len(columns)), columns))
 
-        if self.card_text:
-            for line in textwrap.wrap(re.sub(r'<[^<]+?>', '', self.card_text), self.display_width - 2):
-                lines.append(f'{line: ^{self.display_width}}')
+        card_text = self.card_text
+        if card_text:
+            for line in textwrap.wrap(re.sub(r'<[^<]+?>', '', card_text), width - 2):
+                lines.append(f'{line: ^{width}}')
 
-        if self.attack is not None and self.hit_points:
-            columns = [('Attack', self.attack)]
-            if self.armor: columns += [('Armor', self.armor)]
-            columns += [('HP', self.hit_points)]
+        if self._data.hit_points:
+            columns = [('Attack', self._data.attack)]
+            if self._data.armor: columns += [('Armor', self._data.armor)]
+            columns += [('HP', self._data.hit_points)]
 
-            lines.append(format_columns(int(self.display_width / len(columns)), columns))
+            lines.append(format_columns(int(width / len(columns)), columns))
 
-        lines.append(f'{self.colour.upper():-^{self.display_width}}')
+        lines.append(f'{colour:-^{width}}')
         return '\n'.join(lines)
 
+    def __str__(self):
+        return self.render()
 
+
+def _unpickle_card(card_name, card_id, card_type, references, mini_image, large_image, ingame_image, hit_points,
+                   attack, armor, mana_cost, gold_cost, sub_type, card_text, colour, illustrator, base_card_id,
+                   card_names):
+    cdef Card card = Card.new_card(encode(card_name), card_id, encode(card_type), references, encode(mini_image),
+                                   encode(large_image), encode(ingame_image), hit_points, attack, armor, 0, 0,
+                                   mana_cost, gold_cost, encode(sub_type), encode(card_text), encode(colour),
+                                   encode(illustrator), base_card_id)
+    card.card_names = card_names
+    return card
+
+
+def _unpickle_card_list(cards, id_index, name_index, removed=()):
+    cdef CardList card_list = _adopt_cards(cards, build_index=False)
+    card_list._removed = set(removed)
+    card_list._id_index = id_index
+    card_list._name_index = name_index
+    return card_list
+
+
+cdef CardList _adopt_cards(cards, bint build_index=True):
+    """Build a CardList that owns its structs from Cards, taking over the structs they own instead of copying them.
+    The Cards keep working as views into the list."""
+    cdef CardStruct** cards_ptr = <CardStruct**> malloc(max(len(cards), 1)*sizeof(CardStruct*))
+    if cards_ptr is NULL:
+        raise MemoryError
+    cdef CardList card_list = CardList.from_ptr(cards_ptr, 0, True)
+    cdef Card card
+
+    for card in cards:
+        cards_ptr[card_list._length] = _adopt_struct(card, card_list)
+        card_list._length += 1
+
+    card_list._card_names = [card.card_names for card in cards]
+    if build_index:
+        card_list._build_index(card_list._card_names)
+
+    return card_list
+
+
+cdef CardStruct* _adopt_struct(Card card, CardList owner) except NULL:
+    """Hand the struct card owns (or a copy of the one it views) over to owner, card becomes a view into owner."""
+    cdef CardStruct* card_struct
+    if card.ptr_owner:
+        card_struct = card._data
+    else:
+        card_struct = copy_card_struct(card._data)
+    card._data = card_struct
+    card.ptr_owner = False
+    card._base = owner
+    return card_struct
+
+
+cdef _replace_card_struct(CardStruct* target, Card card, CardList owner):
+    """Move the contents of card's struct into target, so every Card viewing target sees the new values."""
+    cdef CardStruct* source = card._data if card.ptr_owner else copy_card_struct(card._data)
+    free_card_struct_fields(target)
+    # target takes over the fields of source, including what it rendered
+    memcpy(target, source, sizeof(CardStruct))
+    free(source)
+    card._data = target
+    card.ptr_owner = False
+    card._base = owner
+
+
+def _view_index(CardList base, positions):
+    """The indexes of a view of base holding the cards at positions (base index -> view index)."""
+    base._ensure_index()
+    return ({card_id: positions[i] for card_id, i in base._id_index.items() if i in positions},
+            {name: positions[i] for name, i in base._name_index.items() if i in positions})
+
+
+def _view_names(CardList base, positions):
+    card_names = base._names()
+    return [card_names[i] for i in positions]
+
+
+def _concat_names(card_lists):
+    cdef CardList card_list
+    return [card_names for card_list in card_lists for card_names in card_list._names()]
+
+
+def _concat_index(card_lists):
+    cdef CardList card_list
+    cdef int offset = 0
+    id_index = {}
+    name_index = {}
+    for card_list in card_lists:
+        card_list._ensure_index()
+        for card_id, i in card_list._id_index.items():
+            id_index.setdefault(card_id, i + offset)
+        for name, i in card_list._name_index.items():
+            name_index.setdefault(name, i + offset)
+        offset += card_list._length
+
+    return id_index, name_index
+
+
+# __dealloc__ tells views (which have a _base) from owners, the GC must not clear _base first when a CardList is in a
+# reference cycle such as the one through its cached table or search index
+@cython.no_gc_clear
 cdef class CardList:
+    """Indexed list of cards over an array of struct pointers.
+
+    A list built from Cards owns their structs. +, concat, slicing and take return views, new pointer arrays over the
+    structs of other lists which keep those lists alive (in _base) instead of copying any struct. The indexes of a
+    view are built from its base lists the first time they are used.
+
+    Cards removed by update keep their slot, so positions held elsewhere stay valid. They are left out of the indexes
+    and of iteration, but len and indexing still count them (see is_removed).
+    """
     cdef CardStruct **_cards
     cdef bint ptr_owner
     cdef int _length
+    cdef dict _id_index
+    cdef dict _name_index
+    cdef object _base
+    cdef object _table
+    cdef object _signatures
+    cdef object _search_index
+    # callable returning (id_index, name_index) for views whose indexes have not been built yet
+    cdef object _index_source
+    # export of the snapshot mapping the strings of borrowed structs point into, it can't be closed while held
+    cdef object _backing
+    # Card.card_names of every slot, views and lists loaded from a snapshot get it from _names_source on first use
+    cdef list _card_names
+    cdef object _names_source
+    # positions of the cards update removed
+    cdef set _removed
 
     def __cinit__(self):
         self._length = 0
         self.ptr_owner = False
+        self._base = None
+        self._table = None
+        self._signatures = None
+        self._search_index = None
+        self._index_source = None
+        self._backing = None
+        self._card_names = None
+        self._names_source = None
+        self._removed = set()
 
     def __dealloc__(self):
         if self._cards is not NULL and self.ptr_owner is True:
-            for i in range(self._length):
-                free(self._cards[i])
+            # a list with a base only owns the pointer array, the structs belong to the base lists
+            if self._base is None:
+                for i in range(self._length):
+                    free_card_struct_fields(self._cards[i])
+                    free(self._cards[i])
             free(self._cards)
             self._cards = NULL
 
     @staticmethod
     def new_card_list(cards):
-        cdef CardStruct** cards_ptr = <CardStruct**> malloc(len(cards)*8)
+        """A view over the structs of cards, which are kept alive by the list."""
+        cards = tuple(cards)
+        cdef CardStruct** cards_ptr = <CardStruct**> malloc(max(len(cards), 1)*sizeof(CardStruct*))
         if cards_ptr is NULL:
             raise MemoryError
         cdef Card card
 
         for i, card in enumerate(cards):
-            if SHARE_STRUCTS:
-                cards_ptr[i] = card.get_data()
-            else:
-                cards_ptr[i] = copy_card_struct(card.get_data())
+            cards_ptr[i] = card._data
+
+        cdef CardList card_list = CardList.from_ptr(cards_ptr, len(cards), True)
+        card_list._base = cards
+        card_list._card_names = [card.card_names for card in cards]
+        card_list._build_index(card_list._card_names)
 
-        return CardList.from_ptr(cards_ptr, i, not SHARE_STRUCTS)
+        return card_list
 
     def __add__(x, y):
         if not isinstance(x, CardList) or not isinstance(y, CardList):
             return NotImplemented
 
-        cdef CardList xc = <CardList> x
-        cdef CardList yc = <CardList> y
+        return CardList.concat([x, y])
 
-        _cards = <CardStruct**>malloc(8 * (len(xc) + len(yc)))
-        if _cards is NULL:
-            raise MemoryError
+    cdef _ensure_index(self):
+        if self._index_source is not None:
+            index_source, self._index_source = self._index_source, None
+            self._id_index, self._name_index = index_source()
 
-        for i in range(len(xc)):
-            _cards[i] = copy_card_struct(<CardStruct*>xc._cards[i])
+    def update(self, changed=(), added=(), removed=()):
+        """Apply a card set update in place.
 
-        for j in range(len(yc)):
-            _cards[i+j] = copy_card_struct(<CardStruct*>yc._cards[j])
+        Each changed Card's struct replaces the struct in the list with the same card_id, so Cards held elsewhere (such
+        as in hydrated decks) see the new values. Added Cards are appended. The cards with a removed card_id keep their
+        slot, and Cards and positions held elsewhere stay valid, but they are dropped from the indexes and iteration.
+        """
+        if added and (not self.ptr_owner or self._base is not None):
+            raise TypeError('Cards can only be added to a CardList that owns its cards')
+
+        cdef Card card
+        cdef int i
+        cdef int offset
+        cdef CardStruct** cards_ptr
+        cdef CardStruct* card_struct
+        self._ensure_index()
+        changed_idx = {self._id_index[card.card_id]: card for card in changed}
+        card_names = self._names()
+        for i, card in changed_idx.items():
+            _replace_card_struct(self._cards[i], card, self)
+            card_names[i] = card.card_names
+
+        if removed:
+            removed = set(removed)
+            for i in range(self._length):
+                if self._cards[i].card_id in removed:
+                    self._removed.add(i)
 
-        return CardList.from_ptr(_cards, i+j, True)
+        offset = self._length
+        if added:
+            cards_ptr = <CardStruct**> realloc(self._cards, (self._length + len(added))*sizeof(CardStruct*))
+            if cards_ptr is NULL:
+                raise MemoryError
+            self._cards = cards_ptr
+
+            for card in added:
+                self._cards[self._length] = _adopt_struct(card, self)
+                self._length += 1
+                card_names.append(card.card_names)
+
+        self._table = None
+        self._signatures = None
+        self._search_index = None
+        if changed_idx or removed:
+            # a changed or removed card may have shared an id or name with another card, which then takes its place
+            self._id_index = {}
+            self._name_index = {}
+            self._build_index(card_names)
+            return
+
+        for i in range(offset, self._length):
+            card_struct = self._cards[i]
+            self._id_index.setdefault(card_struct.card_id, i)
+            self._name_index.setdefault(card_struct.card_name[:card_struct.card_name_len], i)
+            if card_names[i]:
+                for name in card_names[i].values():
+                    self._name_index.setdefault(name.encode('UTF-8'), i)
+
+    @staticmethod
+    def concat(card_lists):
+        """Join several CardLists into one, earlier lists win index clashes as with +. The structs are shared with
+        card_lists, which are kept alive by the result, instead of being copied."""
+        card_lists = tuple(card_lists)
+        cdef CardList card_list
+        cdef int length = sum(len(card_list) for card_list in card_lists)
+        cdef int offset = 0
+
+        cdef CardStruct** cards_ptr = <CardStruct**> malloc(max(length, 1)*sizeof(CardStruct*))
+        if cards_ptr is NULL:
+            raise MemoryError
+        cdef CardList result = CardList.from_ptr(cards_ptr, length, True)
+        result._base = card_lists
+        result._index_source = functools.partial(_concat_index, card_lists)
+        result._names_source = functools.partial(_concat_names, card_lists)
+
+        for card_list in card_lists:
+            memcpy(&cards_ptr[offset], card_list._cards, card_list._length*sizeof(CardStruct*))
+            result._removed.update(i + offset for i in card_list._removed)
+            offset += card_list._length
+
+        return result
+
+    def take(self, indexes):
+        """A CardList of the cards at indexes, in that order (repeats are left out). The structs are shared with this
+        list, which is kept alive by the result, instead of being copied."""
+        positions = {}
+        for i in indexes:
+            if not 0 <= i < self._length:
+                raise IndexError(i)
+            positions.setdefault(i, len(positions))
+
+        cdef int n = 0
+        cdef CardStruct** cards_ptr = <CardStruct**> malloc(max(len(positions), 1)*sizeof(CardStruct*))
+        if cards_ptr is NULL:
+            raise MemoryError
+        for i in positions:
+            cards_ptr[n] = self._cards[<int>i]
+            n += 1
+
+        cdef CardList result = CardList.from_ptr(cards_ptr, n, True)
+        result._base = self
+        result._removed = {positions[i] for i in positions if i in self._removed}
+        result._index_source = functools.partial(_view_index, self, positions)
+        result._names_source = functools.partial(_view_names, self, list(positions))
+
+        return result
+
+    def table(self):
+        """A CardTable of the attributes of every card (see artifact.table), built once and cached. Requires numpy."""
+        if self._table is None:
+            from artifact.table import CardTable
+            self._table = CardTable.from_card_list(self)
+
+        return self._table
+
+    def search_index(self):
+        """A CardSearch over the names and card text of the cards (see artifact.search), built once and cached."""
+        if self._search_index is None:
+            from artifact.search import CardSearch
+            self._search_index = CardSearch(self)
+
+        return self._search_index
+
+    def search(self, query, limit=10, fuzzy=True, text=True):
+        return self.search_index().search(query, limit, fuzzy, text)
+
+    def signatures(self):
+        """Map of hero card_id to (signature card_id, copies), from the first includes reference of every hero. Built
+        once and cached, earlier cards win card_id clashes as in the indexes."""
+        cdef int i, j
+        cdef CardStruct* card_struct
+        cdef CardRefStruct* reference
+        if self._signatures is None:
+            signatures = {}
+            for i in range(self._length):
+                if i in self._removed:
+                    continue
+                card_struct = self._cards[i]
+                if card_struct.card_type[:card_struct.card_type_len] != b'Hero':
+                    continue
+                for j in range(card_struct.num_references):
+                    reference = &card_struct.references[j]
+                    if reference.ref_type[:reference.ref_type_len] == b'includes':
+                        signatures.setdefault(card_struct.card_id, (reference.card_id, reference.count))
+                        break
+            self._signatures = signatures
+
+        return self._signatures
 
     @staticmethod
     cdef CardList from_ptr(CardStruct** cards_ptr, int length, bint owner=False):
@@ -482,46 +830,96 @@ cdef class CardList:
         card_list._cards = cards_ptr
         card_list._length = length
         card_list.ptr_owner = owner
+        card_list._id_index = {}
+        card_list._name_index = {}
 
         return card_list
 
-    cpdef int get_idx_by_id(self, int card_id):
+    cdef _build_index(self, card_names):
         cdef int i = 0
+        cdef CardStruct *card_struct
         for i in range(self._length):
-            if self._cards[i].card_id == card_id:
-                return i
-        return -1
+            if i in self._removed:
+                continue
+            card_struct = self._cards[i]
+            self._id_index.setdefault(card_struct.card_id, i)
+            self._name_index.setdefault(card_struct.card_name[:card_struct.card_name_len], i)
+            if card_names[i]:
+                for name in card_names[i].values():
+                    self._name_index.setdefault(name.encode('UTF-8'), i)
+
+    cdef list _names(self):
+        if self._card_names is None:
+            if self._names_source is not None:
+                names_source, self._names_source = self._names_source, None
+                self._card_names = list(names_source())
+            else:
+                self._card_names = [None] * self._length
+
+        return self._card_names
+
+    cdef Card _view(self, int i):
+        """Card i as a view into this list, with its localized names."""
+        cdef Card card = Card.from_ptr(self._cards[i], False, self)
+        card.card_names = self._names()[i]
+        return card
+
+    cpdef int get_idx_by_id(self, int card_id):
+        if self._index_source is not None:
+            self._ensure_index()
+        return self._id_index.get(card_id, -1)
 
     cpdef int get_idx_by_name(self, char* card_name):
-        cdef int i = 0
-        for i in range(self._length):
-            if strcmp(self._cards[i].card_name, card_name) == 0:
-                return i
-        return -1
+        if self._index_source is not None:
+            self._ensure_index()
+        return self._name_index.get(card_name, -1)
 
     def get_card_by_id(self, card_id):
-        cdef Card card = Card.from_ptr(self._cards[self.get_idx_by_id(card_id)])
-        return card
+        cdef int idx = self.get_idx_by_id(card_id)
+        if idx == -1:
+            return None
+        return self._view(idx)
 
     def get_card_by_name(self, card_name):
         encoded_card_name = encode(card_name)
-        cdef char *cn = encoded_card_name
-        cdef Card card = Card.from_ptr(self._cards[self.get_idx_by_name(cn)])
-        return card
+        cdef int idx = self.get_idx_by_name(encoded_card_name)
+        if idx == -1:
+            return None
+        return self._view(idx)
+
+    def __reduce__(self):
+        self._ensure_index()
+        return _unpickle_card_list, ([self[i] for i in range(self._length)], self._id_index, self._name_index,
+                                     self._removed)
 
     def __getitem__(self, item):
-        if item > self._length:
-            raise IndexError
-        card = Card()
+        if isinstance(item, slice):
+            return self.take(range(*item.indices(self._length)))
+
         cdef int i = item
-        card._data = self._cards[i]
-        card.ptr_owner = False
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError(item)
 
-        return card
+        return self._view(i)
 
     def __len__(self):
         return self._length
 
+    def __iter__(self):
+        cdef int i
+        for i in range(self._length):
+            if i not in self._removed:
+                yield self._view(i)
+
+    def is_removed(self, int i):
+        """Whether the card at position i was removed by update."""
+        return i in self._removed
+
+CardSetDiff = namedtuple('CardSetDiff', ['version', 'added', 'changed', 'removed'])
+
+
 class CardSet:
     def __init__(self, set_name, set_code, set_id, version, cards):
         self.set_name = set_name
@@ -530,39 +928,95 @@ class CardSet:
         self.version = version
         self.cards = cards
 
+    api_url = 'https://playartifact.com/cardset/'
+
+    @staticmethod
+    def fetch_card_set(set_code):
+        return fetcher.fetch(set_code, force=True)
+
     @staticmethod
     def get_card_set(set_code):
-        set_cache_path = cache / f'{set_code}.json'
-        if not set_cache_path.exists():
-            request_url = f'https://playartifact.com/cardset/{set_code}/'
-            r = requests.get(request_url)
+        return fetcher.fetch(set_code)
 
-            if r.status_code != 200:
-                raise Exception(f'{r.status_code}: {request_url}')
+    @staticmethod
+    def load_card_sets(set_codes):
+        fetched = fetcher.fetch_many([set_code for set_code in set_codes if fetcher.is_expired(set_code)])
+        return [CardSet.load_card_set(set_code, fetched.get(set_code)) for set_code in set_codes]
 
-            data = r.json()
-            set_url = data['cdn_root'] + data['url']
+    @staticmethod
+    def load_card_set(set_code, data=None):
+        """Load a set from the cache, fetching it first if it has expired. data is the set JSON if the caller has
+        just fetched it, it is then used as is."""
+        if data is None and fetcher.is_expired(set_code):
+            # revalidates the cached JSON, it is only rewritten (making the snapshot stale) if the set changed
+            data = CardSet.get_card_set(set_code)
+
+        snapshot_path = cache / f'{set_code}.snapshot'
+        set_cache_path = cache / f'{set_code}.json'
+        if snapshot_path.exists() and (not set_cache_path.exists() or
+                                       snapshot_path.stat().st_mtime >= set_cache_path.stat().st_mtime):
+            try:
+                snapshot = CardSetSnapshot(snapshot_path)
+            except ValueError:
+                pass
+            else:
+                return snapshot.card_set(set_code)
 
-            r = requests.get(set_url)
+        if data is None:
+            data = CardSet.get_card_set(set_code)
+        CardSetSnapshot.write(data, snapshot_path)
 
-            if r.status_code != 200:
-                raise Exception(f'{r.status_code}: {set_url}')
+        return CardSet.unpack_dict(data, set_code)
 
-            card_set_json = r.json()
-            with open(set_cache_path, 'w') as set_cache:
-                set_cache.write(r.content.decode('utf-8'))
-        else:
-            with open(set_cache_path, 'r') as set_cache:
-                card_set_json = json.loads(set_cache.read())
+    def refresh(self, data=None):
+        """Bring the set up to date in place, fetching the set JSON again unless data is given.
 
-        return card_set_json
+        Cards are diffed by card_id against the cards of this set. Changed cards are updated in place so Decks holding
+        them see the new values, new cards are appended and removed cards are left out of lookups and iteration but keep
+        their slot, see CardList.update.
+        """
+        set_cache_path = cache / f'{self.set_code}.json'
+        if data is None:
+            data = CardSet.fetch_card_set(self.set_code)
+        else:
+            write_atomic(set_cache_path, json.dumps(data).encode('utf-8'))
+        CardSetSnapshot.write(data, cache / f'{self.set_code}.snapshot')
+
+        card_ids = set()
+        changed = []
+        added = []
+        for d in data['card_set']['card_list']:
+            card_ids.add(d['card_id'])
+            card = Card.unpack_dict(d)
+            current = self.cards.get_card_by_id(d['card_id'])
+            if current is None:
+                added.append(card)
+            elif not current.same_values(card):
+                changed.append(card)
+
+        removed = []
+        for i in range(len(self.cards)):
+            card_id = self.cards[i].card_id
+            if card_id not in card_ids and self.cards.get_idx_by_id(card_id) == i:
+                removed.append(card_id)
+
+        self.cards.update(changed, added, removed)
+        self.set_name = data['card_set']['set_info']['name']['english']
+        self.version = data['card_set']['version']
+
+        return CardSetDiff(self.version, [card.card_id for card in added], [card.card_id for card in changed],
+                           removed)
 
     @staticmethod
-    def load_card_set(set_code):
-        data = CardSet.get_card_set(set_code)
+    def clear_cache(set_code):
+        for path in [cache / f'{set_code}.json', cache / f'{set_code}.meta.json', cache / f'{set_code}.snapshot']:
+            if path.exists():
+                path.unlink()
 
+    @staticmethod
+    def unpack_dict(data, set_code):
         card_set_dict = data['card_set']
-        card_list = CardList.new_card_list([Card.unpack_dict(d) for d in card_set_dict['card_list']])
+        card_list = _adopt_cards([Card.unpack_dict(d) for d in card_set_dict['card_list']])
         set_info = card_set_dict['set_info']
 
         card_set = CardSet(
@@ -575,6 +1029,12 @@ class CardSet:
 
         return card_set
 
+    def table(self):
+        return self.cards.table()
+
+    def search(self, query, limit=10, fuzzy=True, text=True):
+        return self.cards.search(query, limit, fuzzy, text)
+
     def get_card_by_id(self, card_id):
         return self.cards.get_card_by_id(card_id)
 
@@ -584,6 +1044,609 @@ class CardSet:
     def __len__(self):
         return len(self.cards)
 
+
+class CardSetFetcher:
+    """Fetches card sets over a pooled requests Session with retries and a timeout.
+
+    Alongside each cached set JSON a <set_code>.meta.json records the expire_time returned by the cardset endpoint and
+    the ETag / Last-Modified of the set file. The cached set is used until it expires, then it is revalidated with a
+    conditional request. Sets cached without a meta file or an expire_time never expire, they are only fetched again
+    with force. If the API can not be reached or answers with an error or an unexpected document the cached set is
+    used regardless.
+    """
+    def __init__(self, api_url=None, cache_dir=None, timeout=10, retries=3, workers=4):
+        self.api_url = api_url
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.retries = retries
+        self.workers = workers
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    # the network stack is only imported once a set is fetched
+                    import requests
+                    from requests.adapters import HTTPAdapter, Retry
+
+                    retry = Retry(total=self.retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+                    adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers, max_retries=retry)
+                    session = requests.Session()
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+
+        return self._session
+
+    def _paths(self, set_code):
+        cache_dir = cache if self.cache_dir is None else pathlib.Path(self.cache_dir)
+        return cache_dir / f'{set_code}.json', cache_dir / f'{set_code}.meta.json'
+
+    def _get(self, url, headers=None):
+        import requests
+
+        r = self.session.get(url, headers=headers, timeout=self.timeout)
+        if r.status_code not in (200, 304):
+            raise requests.HTTPError(f'{r.status_code}: {url}', response=r)
+
+        return r
+
+    def is_expired(self, set_code):
+        set_cache_path, meta_path = self._paths(set_code)
+        if not set_cache_path.exists():
+            return True
+        if not meta_path.exists():
+            return False
+
+        with open(meta_path, 'r') as meta_file:
+            expire_time = json.loads(meta_file.read()).get('expire_time')
+        return expire_time is not None and expire_time <= time.time()
+
+    def fetch(self, set_code, force=False):
+        """Return the set JSON, from the cache unless it has expired or force is set."""
+        set_cache_path, meta_path = self._paths(set_code)
+        if not force and not self.is_expired(set_code):
+            with open(set_cache_path, 'r') as set_cache:
+                return json.loads(set_cache.read())
+
+        meta = {}
+        if set_cache_path.exists() and meta_path.exists():
+            with open(meta_path, 'r') as meta_file:
+                meta = json.loads(meta_file.read())
+
+        import requests
+        try:
+            request_url = f'{self.api_url or CardSet.api_url}{set_code}/'
+            data = self._get(request_url).json()
+            if not isinstance(data, dict) or 'cdn_root' not in data or 'url' not in data:
+                raise requests.RequestException(f'Unexpected card set document from {request_url}')
+            set_url = data['cdn_root'] + data['url']
+
+            headers = {}
+            if meta.get('url') == set_url:
+                if meta.get('etag'):
+                    headers['If-None-Match'] = meta['etag']
+                if meta.get('last_modified'):
+                    headers['If-Modified-Since'] = meta['last_modified']
+            r = self._get(set_url, headers)
+            card_set_json = r.json() if r.status_code != 304 else None
+        # ValueError is a body that is not JSON
+        except (requests.RequestException, ValueError):
+            if not set_cache_path.exists():
+                raise
+            with open(set_cache_path, 'r') as set_cache:
+                return json.loads(set_cache.read())
+
+        if r.status_code == 304:
+            with open(set_cache_path, 'r') as set_cache:
+                card_set_json = json.loads(set_cache.read())
+        else:
+            write_atomic(set_cache_path, r.content)
+            meta = {'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')}
+
+        # without an expire_time the set is kept until fetched with force
+        meta.update(url=set_url, expire_time=data.get('expire_time'))
+        write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+
+        return card_set_json
+
+    def fetch_many(self, set_codes, force=False):
+        """Fetch several sets concurrently, returns a dict of set code to set JSON."""
+        set_codes = list(set_codes)
+        if not set_codes:
+            return {}
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(min(self.workers, len(set_codes))) as executor:
+            return dict(zip(set_codes, executor.map(lambda set_code: self.fetch(set_code, force), set_codes)))
+
+
+fetcher = CardSetFetcher()
+
+
+cdef char* _empty_string = b''
+
+
+cdef inline int _snapshot_int(int value):
+    return 0 if value == -2147483648 else value
+
+
+cdef inline char* _snapshot_string(const unsigned char* strings, const unsigned int* string_offsets, int idx,
+                                   int* length):
+    if idx < 0:
+        length[0] = 0
+        return _empty_string
+    length[0] = string_offsets[idx + 1] - string_offsets[idx] - 1
+    return <char*> (strings + string_offsets[idx])
+
+
+cdef char* _snapshot_interned(dict interned, const unsigned char* strings, const unsigned int* string_offsets,
+                              int idx, int* length) except NULL:
+    """String idx of the snapshot interned like the strings of unpacked cards, interned maps idx to the bytes."""
+    cdef bytes value = interned.get(idx)
+    cdef char* string
+    if value is None:
+        string = _snapshot_string(strings, string_offsets, idx, length)
+        value = string[:length[0]]
+        value = interned[idx] = _interned_strings.setdefault(value, value)
+    length[0] = len(value)
+    return value
+
+
+cdef char* _snapshot_default_image(const unsigned char* strings, const unsigned int* string_offsets,
+                                   const unsigned int* dict_offsets, const int* dict_entries, int idx, int* length):
+    """The 'default' entry of dict idx, which is all the compiled Card keeps of an image dict."""
+    cdef unsigned int j
+    cdef int key
+    if idx >= 0:
+        for j in range(dict_offsets[idx], dict_offsets[idx + 1]):
+            key = dict_entries[2 * j]
+            if string_offsets[key + 1] - string_offsets[key] == 8 and \
+                    memcmp(strings + string_offsets[key], b'default', 7) == 0:
+                return _snapshot_string(strings, string_offsets, dict_entries[2 * j + 1], length)
+
+    length[0] = 0
+    return _empty_string
+
+
+cdef const void* _buffer_address(view):
+    cdef const unsigned char[::1] data = memoryview(view).cast('B')
+    return &data[0] if data.shape[0] else NULL
+
+
+cdef CardList _snapshot_card_list(snapshot):
+    """A CardList over structs whose strings point into the mapping of snapshot (a CardSetSnapshot) instead of being
+    copied, only the references are allocated. The list holds an export of the mapping, and its indexes are built
+    from the snapshot the first time they are used."""
+    cdef int num_cards = snapshot.num_cards
+    cdef CardStruct** cards_ptr = <CardStruct**> malloc(max(num_cards, 1)*sizeof(CardStruct*))
+    if cards_ptr is NULL:
+        raise MemoryError
+    cdef CardList card_list = CardList.from_ptr(cards_ptr, 0, True)
+    card_list._backing = memoryview(snapshot._mmap)
+    card_list._index_source = snapshot.index
+    card_list._names_source = snapshot.localized_names
+    if num_cards == 0:
+        return card_list
+
+    columns = snapshot.columns
+    cdef const int* card_id = <const int*> _buffer_address(columns['card_id'])
+    cdef const int* base_card_id = <const int*> _buffer_address(columns['base_card_id'])
+    cdef const int* hit_points = <const int*> _buffer_address(columns['hit_points'])
+    cdef const int* attack = <const int*> _buffer_address(columns['attack'])
+    cdef const int* armor = <const int*> _buffer_address(columns['armor'])
+    cdef const int* mana_cost = <const int*> _buffer_address(columns['mana_cost'])
+    cdef const int* gold_cost = <const int*> _buffer_address(columns['gold_cost'])
+    cdef const int* reference_start = <const int*> _buffer_address(columns['reference_start'])
+    cdef const int* reference_count = <const int*> _buffer_address(columns['reference_count'])
+    cdef const int* card_name = <const int*> _buffer_address(columns['card_name'])
+    cdef const int* card_type = <const int*> _buffer_address(columns['card_type'])
+    cdef const int* sub_type = <const int*> _buffer_address(columns['sub_type'])
+    cdef const int* card_text = <const int*> _buffer_address(columns['card_text'])
+    cdef const int* colour = <const int*> _buffer_address(columns['colour'])
+    cdef const int* illustrator = <const int*> _buffer_address(columns['illustrator'])
+    cdef const int* mini_image = <const int*> _buffer_address(columns['mini_image'])
+    cdef const int* large_image = <const int*> _buffer_address(columns['large_image'])
+    cdef const int* ingame_image = <const int*> _buffer_address(columns['ingame_image'])
+    cdef const int* references = <const int*> _buffer_address(snapshot.references)
+    cdef const unsigned int* dict_offsets = <const unsigned int*> _buffer_address(snapshot._dict_offsets)
+    cdef const int* dict_entries = <const int*> _buffer_address(snapshot._dict_entries)
+    cdef const unsigned int* string_offsets = <const unsigned int*> _buffer_address(snapshot._string_offsets)
+    cdef const unsigned char* strings = <const unsigned char*> _buffer_address(snapshot._strings)
+
+    cdef dict interned = {}
+    cdef int i, j, k
+    cdef CardStruct* card_struct
+    for i in range(num_cards):
+        card_struct = <CardStruct*> malloc(cython.sizeof(CardStruct))
+        if card_struct is NULL:
+            raise MemoryError
+        card_struct.borrowed = True
+        card_struct.rendered = NULL
+        card_struct.references = NULL
+        card_struct.num_references = 0
+        cards_ptr[i] = card_struct
+        card_list._length += 1
+
+        card_struct.card_name = _snapshot_string(strings, string_offsets, card_name[i], &card_struct.card_name_len)
+        card_struct.card_text = _snapshot_string(strings, string_offsets, card_text[i], &card_struct.card_text_len)
+        card_struct.illustrator = _snapshot_string(strings, string_offsets, illustrator[i],
+                                                   &card_struct.illustrator_len)
+        card_struct.mini_image = _snapshot_default_image(strings, string_offsets, dict_offsets, dict_entries,
+                                                         mini_image[i], &card_struct.mini_image_len)
+        card_struct.large_image = _snapshot_default_image(strings, string_offsets, dict_offsets, dict_entries,
+                                                          large_image[i], &card_struct.large_image_len)
+        card_struct.ingame_image = _snapshot_default_image(strings, string_offsets, dict_offsets, dict_entries,
+                                                           ingame_image[i], &card_struct.ingame_image_len)
+        card_struct.card_type = _snapshot_interned(interned, strings, string_offsets, card_type[i],
+                                                   &card_struct.card_type_len)
+        card_struct.sub_type = _snapshot_interned(interned, strings, string_offsets, sub_type[i],
+                                                  &card_struct.sub_type_len)
+        card_struct.colour = _snapshot_interned(interned, strings, string_offsets, colour[i], &card_struct.colour_len)
+
+        card_struct.card_id = card_id[i]
+        card_struct.base_card_id = _snapshot_int(base_card_id[i])
+        card_struct.hit_points = _snapshot_int(hit_points[i])
+        card_struct.attack = _snapshot_int(attack[i])
+        card_struct.armor = _snapshot_int(armor[i])
+        card_struct.mana_cost = _snapshot_int(mana_cost[i])
+        card_struct.gold_cost = _snapshot_int(gold_cost[i])
+
+        if reference_count[i] > 0:
+            card_struct.references = <CardRefStruct*> malloc(cython.sizeof(CardRefStruct)*reference_count[i])
+            if card_struct.references is NULL:
+                raise MemoryError
+            card_struct.num_references = reference_count[i]
+            for j in range(reference_count[i]):
+                k = 3 * (reference_start[i] + j)
+                card_struct.references[j].card_id = references[k]
+                card_struct.references[j].ref_type = _snapshot_interned(interned, strings, string_offsets,
+                                                                        references[k + 1],
+                                                                        &card_struct.references[j].ref_type_len)
+                card_struct.references[j].count = _snapshot_int(references[k + 2])
+
+    return card_list
+
+
+cdef tuple _snapshot_index(snapshot):
+    cdef dict id_index = {}
+    cdef dict name_index = {}
+    cdef int num_cards = snapshot.num_cards
+    if num_cards == 0:
+        return id_index, name_index
+
+    columns = snapshot.columns
+    cdef const int* card_id = <const int*> _buffer_address(columns['card_id'])
+    cdef const int* card_name = <const int*> _buffer_address(columns['card_name'])
+    cdef const int* card_names = <const int*> _buffer_address(columns['card_names'])
+    cdef const unsigned int* dict_offsets = <const unsigned int*> _buffer_address(snapshot._dict_offsets)
+    cdef const int* dict_entries = <const int*> _buffer_address(snapshot._dict_entries)
+    cdef const unsigned int* string_offsets = <const unsigned int*> _buffer_address(snapshot._string_offsets)
+    cdef const unsigned char* strings = <const unsigned char*> _buffer_address(snapshot._strings)
+
+    cdef int i, length
+    cdef unsigned int j
+    cdef char* string
+    for i in range(num_cards):
+        id_index.setdefault(card_id[i], i)
+        string = _snapshot_string(strings, string_offsets, card_name[i], &length)
+        name_index.setdefault(string[:length], i)
+        if card_names[i] >= 0:
+            for j in range(dict_offsets[card_names[i]], dict_offsets[card_names[i] + 1]):
+                string = _snapshot_string(strings, string_offsets, dict_entries[2 * j + 1], &length)
+                name_index.setdefault(string[:length], i)
+
+    return id_index, name_index
+
+
+class CardSetSnapshot:
+    """Read only card set snapshot, a compact binary copy of the card set JSON that is loaded with mmap.
+
+    Layout (little endian): the header, then one int32 column per field in int_columns, string_columns and
+    dict_columns with an entry per card, the reference table (card_id, ref_type, count int32 triples), the dict table
+    offsets (uint32, num_dicts + 1) into the dict entries (key, value string index int32 pairs), the string table
+    offsets (uint32, num_strings + 1) and finally the utf-8 string data, every string followed by a NUL. String
+    columns hold indexes into the string table and dict columns (images and localized names) indexes into the dict
+    table, missing values are stored as null_int / -1.
+
+    card_set builds structs whose strings point into the mapping instead of copies, and the indexes of its CardList
+    are built on first use. The mapping can not be closed while that CardList (or a Card from it) is alive.
+    """
+    magic = b'ACSS'
+    format_version = 2
+    header = struct.Struct('<4sIiiiIIIII')
+    null_int = -2 ** 31
+    int_columns = ['card_id', 'base_card_id', 'hit_points', 'attack', 'armor', 'retaliate', 'regen', 'mana_cost',
+                   'gold_cost', 'reference_start', 'reference_count']
+    string_columns = ['card_name', 'card_type', 'sub_type', 'card_text', 'colour', 'illustrator']
+    dict_columns = ['mini_image', 'large_image', 'ingame_image', 'card_names']
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        buffer = memoryview(self._mmap)
+        magic, format_version, self.set_id, self.version, set_name, num_cards, num_references, num_strings, \
+            num_dicts, num_dict_entries = CardSetSnapshot.header.unpack_from(buffer)
+        if magic != CardSetSnapshot.magic or format_version != CardSetSnapshot.format_version:
+            raise ValueError(f'{path} is not a version {CardSetSnapshot.format_version} card set snapshot')
+
+        self.num_cards = num_cards
+        offset = CardSetSnapshot.header.size
+
+        self.columns = {}
+        for name in CardSetSnapshot.int_columns + CardSetSnapshot.string_columns + CardSetSnapshot.dict_columns:
+            self.columns[name] = CardSetSnapshot._int32_view(buffer, offset, num_cards)
+            offset += 4 * num_cards
+
+        self.references = CardSetSnapshot._int32_view(buffer, offset, 3 * num_references)
+        offset += 12 * num_references
+
+        self._dict_offsets = CardSetSnapshot._int32_view(buffer, offset, num_dicts + 1, 'I')
+        offset += 4 * (num_dicts + 1)
+        self._dict_entries = CardSetSnapshot._int32_view(buffer, offset, 2 * num_dict_entries)
+        offset += 8 * num_dict_entries
+
+        self._string_offsets = CardSetSnapshot._int32_view(buffer, offset, num_strings + 1, 'I')
+        offset += 4 * (num_strings + 1)
+        self._strings = buffer[offset:]
+
+        self.set_name = self.string(set_name)
+
+    @staticmethod
+    def _int32_view(buffer, offset, length, typecode='i'):
+        view = buffer[offset:offset + 4 * length]
+        if sys.byteorder == 'little':
+            return view.cast(typecode)
+        swapped = array(typecode, view)
+        swapped.byteswap()
+        return swapped
+
+    def string_bytes(self, idx):
+        if idx < 0:
+            return b''
+        # without the NUL
+        return bytes(self._strings[self._string_offsets[idx]:self._string_offsets[idx + 1] - 1])
+
+    def string(self, idx):
+        return str(self.string_bytes(idx), 'utf-8') if idx >= 0 else None
+
+    def dict(self, idx):
+        if idx < 0:
+            return None
+        entries = self._dict_entries
+        return {self.string(entries[2 * j]): self.string(entries[2 * j + 1])
+                for j in range(self._dict_offsets[idx], self._dict_offsets[idx + 1])}
+
+    def value(self, name, i):
+        value = self.columns[name][i]
+        return None if value == CardSetSnapshot.null_int else value
+
+    def card_references(self, i):
+        if self.columns['reference_count'][i] < 0:
+            return None
+
+        references = []
+        start = self.columns['reference_start'][i]
+        for j in range(start, start + self.columns['reference_count'][i]):
+            reference = {'card_id': self.references[3 * j], 'ref_type': self.string(self.references[3 * j + 1])}
+            if self.references[3 * j + 2] != CardSetSnapshot.null_int:
+                reference['count'] = self.references[3 * j + 2]
+            references.append(reference)
+
+        return references
+
+    def card(self, int i):
+        """Card i as a Card owning a copy of its values, independent of the snapshot."""
+        default_image = lambda name: encode((self.dict(self.columns[name][i]) or {}).get('default', ''))
+        int_value = lambda name: self.value(name, i) or 0
+
+        cdef Card card = Card.new_card(
+            card_name = self.string_bytes(self.columns['card_name'][i]),
+            card_id = self.columns['card_id'][i],
+            card_type = self.string_bytes(self.columns['card_type'][i]),
+            references = self.card_references(i) or [],
+            mini_image = default_image('mini_image'),
+            large_image = default_image('large_image'),
+            ingame_image = default_image('ingame_image'),
+            hit_points = int_value('hit_points'),
+            attack = int_value('attack'),
+            armor = int_value('armor'),
+            retaliate = int_value('retaliate'),
+            regen = int_value('regen'),
+            mana_cost = int_value('mana_cost'),
+            gold_cost = int_value('gold_cost'),
+            sub_type = self.string_bytes(self.columns['sub_type'][i]),
+            card_text = self.string_bytes(self.columns['card_text'][i]),
+            colour = self.string_bytes(self.columns['colour'][i]),
+            illustrator = self.string_bytes(self.columns['illustrator'][i]),
+            base_card_id = int_value('base_card_id')
+        )
+        card.card_names = self.dict(self.columns['card_names'][i])
+
+        return card
+
+    def card_set(self, set_code):
+        return CardSet(self.set_name, set_code, self.set_id, self.version, _snapshot_card_list(self))
+
+    def localized_names(self):
+        """The Card.card_names of every card."""
+        return [self.dict(idx) for idx in self.columns['card_names']]
+
+    def index(self):
+        """(id_index, name_index) of the snapshot's cards as CardList builds them."""
+        return _snapshot_index(self)
+
+    def close(self):
+        for view in list(self.columns.values()) + [self.references, self._dict_offsets, self._dict_entries,
+                                                   self._string_offsets, self._strings]:
+            if isinstance(view, memoryview):
+                view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            raise BufferError('The snapshot can not be closed while cards loaded from it are in use') from None
+
+    @staticmethod
+    def write(data, path):
+        """Write the snapshot of a card set JSON document (as returned by CardSet.get_card_set) to path."""
+        card_set_dict = data['card_set']
+        card_list = card_set_dict['card_list']
+
+        strings = {}
+        dict_offsets = array('I', [0])
+        dict_entries = array('i')
+
+        def string_idx(value):
+            if value is None:
+                return -1
+            return strings.setdefault(value, len(strings))
+
+        def dict_idx(value):
+            if value is None:
+                return -1
+            for key, item in value.items():
+                dict_entries.extend([string_idx(key), string_idx(item)])
+            dict_offsets.append(len(dict_entries) // 2)
+            return len(dict_offsets) - 2
+
+        def int_value(value):
+            return CardSetSnapshot.null_int if value is None else value
+
+        columns = {name: array('i') for name in
+                   CardSetSnapshot.int_columns + CardSetSnapshot.string_columns + CardSetSnapshot.dict_columns}
+        references = array('i')
+        for d in card_list:
+            colour = None
+            for c in ['black', 'blue', 'green', 'red']:
+                if ('is_' + c) in d:
+                    colour = c
+                    break
+
+            for name in ['card_id', 'base_card_id', 'hit_points', 'attack', 'armor', 'retaliate', 'regen',
+                         'mana_cost', 'gold_cost']:
+                columns[name].append(int_value(d.get(name)))
+
+            columns['reference_start'].append(len(references) // 3)
+            columns['reference_count'].append(-1 if d.get('references') is None else len(d['references']))
+            for reference in d.get('references') or []:
+                references.extend([reference['card_id'], string_idx(reference['ref_type']),
+                                   int_value(reference.get('count'))])
+
+            columns['card_name'].append(string_idx(d['card_name']['english']))
+            columns['card_type'].append(string_idx(d['card_type']))
+            columns['sub_type'].append(string_idx(d.get('sub_type')))
+            columns['card_text'].append(string_idx(d['card_text'].get('english') if 'card_text' in d else None))
+            columns['colour'].append(string_idx(colour or ''))
+            columns['illustrator'].append(string_idx(d.get('illustrator')))
+            for name in ['mini_image', 'large_image', 'ingame_image']:
+                columns[name].append(dict_idx(d.get(name)))
+            columns['card_names'].append(dict_idx(d['card_name']))
+
+        set_info = card_set_dict['set_info']
+        set_name = string_idx(set_info['name']['english'])
+
+        encoded_strings = [value.encode('utf-8') + b'\0' for value in strings]
+        string_offsets = array('I', [0])
+        for value in encoded_strings:
+            string_offsets.append(string_offsets[-1] + len(value))
+
+        header = CardSetSnapshot.header.pack(CardSetSnapshot.magic, CardSetSnapshot.format_version,
+                                             set_info['set_id'], card_set_dict['version'], set_name, len(card_list),
+                                             len(references) // 3, len(strings), len(dict_offsets) - 1,
+                                             len(dict_entries) // 2)
+
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            for column in [columns[name] for name in CardSetSnapshot.int_columns + CardSetSnapshot.string_columns +
+                           CardSetSnapshot.dict_columns] + [references, dict_offsets, dict_entries, string_offsets]:
+                if sys.byteorder != 'little':
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                f.write(column.tobytes())
+            f.write(b''.join(encoded_strings))
+        os.replace(tmp_path, path)
+
+
+class CardSetRegistry:
+    """Loads each card set once per process and hands the same CardSet to every caller.
+
+    The returned CardSets and CardLists are shared, treat them as read only. all_cards keeps one indexed CardList per
+    combination of set codes so a pool over every set is built once.
+    """
+    def __init__(self, set_codes=('00', '01'), load_card_set=None):
+        self.set_codes = tuple(set_codes)
+        # None looks up CardSet.load_card_set on every load, so it can still be wrapped (see artifact.stats)
+        self.load_card_set = load_card_set
+        self._card_sets = {}
+        self._pools = {}
+        self._lock = threading.RLock()
+
+    def get(self, set_code):
+        card_set = self._card_sets.get(set_code)
+        if card_set is None:
+            with self._lock:
+                card_set = self._card_sets.get(set_code)
+                if card_set is None:
+                    load_card_set = self.load_card_set or CardSet.load_card_set
+                    card_set = self._card_sets[set_code] = load_card_set(set_code)
+
+        return card_set
+
+    def all_cards(self, set_codes=None):
+        set_codes = self.set_codes if set_codes is None else tuple(set_codes)
+        pool = self._pools.get(set_codes)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(set_codes)
+                if pool is None:
+                    pool = CardList.concat([self.get(set_code).cards for set_code in set_codes])
+                    self._pools[set_codes] = pool
+
+        return pool
+
+    def invalidate(self, set_code=None, version=None, clear_cache=False):
+        """Forget a loaded set, or every set, so the next get loads it again.
+
+        With version only sets whose loaded version differs are dropped, with clear_cache their cache files are
+        removed too so they are fetched again. Returns the dropped set codes.
+        """
+        with self._lock:
+            set_codes = list(self._card_sets) if set_code is None else [set_code]
+            dropped = [code for code in set_codes
+                       if code in self._card_sets and (version is None or self._card_sets[code].version != version)]
+
+            for code in dropped:
+                del self._card_sets[code]
+                if clear_cache:
+                    CardSet.clear_cache(code)
+
+            self._pools = {codes: pool for codes, pool in self._pools.items() if not set(codes) & set(dropped)}
+
+        return dropped
+
+    def refresh(self, set_code, data=None):
+        """Refresh a loaded set in place (see CardSet.refresh) and return its CardSetDiff."""
+        with self._lock:
+            diff = self.get(set_code).refresh(data)
+            # the pools' indexes may be stale even when only names changed, the cards themselves are shared
+            if diff.added or diff.changed or diff.removed:
+                self._pools = {codes: pool for codes, pool in self._pools.items() if set_code not in codes}
+
+        return diff
+
+    def __contains__(self, set_code):
+        return set_code in self._card_sets
+
+
+registry = CardSetRegistry()
+
+
 class Deck:
     def __init__(self, heroes, main_deck, items, name=''):
         self.heroes = heroes
@@ -595,26 +1658,22 @@ class Deck:
         if not (len(self.heroes) == 5 and len(self.main_deck) >= 40 and len(self.items) >= 9):
             return False
 
+        counts = Counter(card.card_id for card in self.main_deck)
         for hero in self.heroes:
             for reference in hero.references:
-                found = 0
-                count = reference['count']
-                for card in self.main_deck:
-                    if card.card_id == reference['card_id']:
-                        found += 1
-                if found != count:
+                if counts[reference['card_id']] != reference['count']:
                     return False
 
         return True
 
     def to_code_deck_dict(self):
         deck = {'heroes': [], 'cards': [], 'name': self.name}
-        hero_cards = []
+        hero_cards = set()
         for i, hero in enumerate(self.heroes):
             deck['heroes'].append({'card_id': hero.card_id, 'turn': i - 1 if i > 2 else 1})
             for ref in hero.references:
                 if ref['ref_type'] == 'includes':
-                    hero_cards.append(ref['card_id'])
+                    hero_cards.add(ref['card_id'])
         cards = {}
 
         for card in self.main_deck + self.items:
@@ -657,4 +1716,155 @@ class Deck:
             else:
                 main_deck += [card] * card_dict['count']
 
-        return Deck(heroes, main_deck, items, d.get('name', ''))
\ No newline at end of file
+        return Deck(heroes, main_deck, items, d.get('name', ''))
+
+
+DeckProblem = namedtuple('DeckProblem', ['reason', 'card_id', 'expected', 'actual'])
+
+
+class CountedDeck:
+    """A deck as hero slots and card counts instead of a Card per copy.
+
+    heroes is a list of (card_id, turn) and cards a dict of card_id to copies of every card in the deck, signature
+    cards and items included, so encoding and validating only touch each distinct card once.
+    """
+
+    def __init__(self, heroes, cards, name=''):
+        self.heroes = heroes
+        self.cards = cards
+        self.name = name
+
+    @staticmethod
+    def from_deck(deck):
+        return CountedDeck([(hero.card_id, i - 1 if i > 2 else 1) for i, hero in enumerate(deck.heroes)],
+                           dict(Counter(card.card_id for card in deck.main_deck + deck.items)), deck.name)
+
+    @staticmethod
+    def from_code_deck_dict(d, card_pool):
+        """The deck of a decoded deck code, adding the signature cards of its heroes from card_pool.signatures()."""
+        signatures = card_pool.signatures()
+        cards = {card['card_id']: card['count'] for card in d['cards']}
+        for hero in d['heroes']:
+            if hero['card_id'] in signatures:
+                card_id, count = signatures[hero['card_id']]
+                cards[card_id] = cards.get(card_id, 0) + count
+
+        return CountedDeck([(hero['card_id'], hero['turn']) for hero in d['heroes']], cards, d.get('name', ''))
+
+    def to_code_deck_dict(self, card_pool):
+        """The dict DeckEncoder.encode takes, leaving out the signature cards of the heroes as deck codes do."""
+        signatures = card_pool.signatures()
+        signature_ids = {signatures[card_id][0] for card_id, _ in self.heroes if card_id in signatures}
+
+        return {'heroes': [{'card_id': card_id, 'turn': turn} for card_id, turn in self.heroes],
+                'cards': [{'card_id': card_id, 'count': count} for card_id, count in self.cards.items()
+                          if card_id not in signature_ids],
+                'name': self.name}
+
+    def to_deck(self, card_pool):
+        heroes = [card_pool.get_card_by_id(card_id) for card_id, _ in sorted(self.heroes, key=lambda hero: hero[1])]
+        main_deck = []
+        items = []
+        for card_id, count in self.cards.items():
+            card = card_pool.get_card_by_id(card_id)
+            if card is None:
+                raise Exception(f'Card {card_id} is not in the card pool')
+            if card.card_type == 'Item':
+                items += [card] * count
+            else:
+                main_deck += [card] * count
+
+        return Deck(heroes, main_deck, items, self.name)
+
+
+class DeckValidator:
+    """Checks CountedDecks against the deck building rules, with the signature cards and items of card_pool.
+
+    validate returns a list of DeckProblems, empty for a valid deck. Their reasons are
+        hero_count        expected heroes, actual heroes
+        hero_turns        expected and actual sorted hero turns
+        unknown_card      a card (or hero) that is not in the card pool
+        not_a_hero        a hero slot holding a card that is not a hero
+        signature_copies  a hero's signature card, expected and actual copies
+        too_many_copies   a card with more than max_copies copies
+        main_deck_size    expected minimum and actual number of main deck cards
+        item_count        expected minimum and actual number of items
+    """
+    hero_turns = (1, 1, 1, 2, 3)
+    min_main_deck = 40
+    min_items = 9
+    max_copies = 3
+
+    def __init__(self, card_pool):
+        self.card_pool = card_pool
+        self.signatures = card_pool.signatures()
+        self.hero_ids = set()
+        self.item_ids = set()
+        for card in card_pool:
+            if card.card_type == 'Hero':
+                self.hero_ids.add(card.card_id)
+            elif card.card_type == 'Item':
+                self.item_ids.add(card.card_id)
+
+    def validate(self, deck):
+        return self._check(deck.heroes, deck.cards)
+
+    def is_valid(self, deck):
+        return not self._check(deck.heroes, deck.cards)
+
+    def validate_many(self, batch):
+        """Validate every deck of a DeckBatch (see DeckDecoder.decode_many), None for the codes that failed to decode."""
+        results = []
+        for i in range(len(batch)):
+            if batch.errors[i] is not None:
+                results.append(None)
+                continue
+
+            hero_slice = slice(batch.hero_offsets[i], batch.hero_offsets[i + 1])
+            card_slice = slice(batch.card_offsets[i], batch.card_offsets[i + 1])
+            heroes = list(zip(batch.hero_ids[hero_slice], batch.hero_turns[hero_slice]))
+            cards = dict(zip(batch.card_ids[card_slice], batch.card_counts[card_slice]))
+            for card_id, _ in heroes:
+                if card_id in self.signatures:
+                    signature_id, count = self.signatures[card_id]
+                    cards[signature_id] = cards.get(signature_id, 0) + count
+            results.append(self._check(heroes, cards))
+
+        return results
+
+    def _check(self, heroes, cards):
+        problems = []
+        if len(heroes) != len(self.hero_turns):
+            problems.append(DeckProblem('hero_count', None, len(self.hero_turns), len(heroes)))
+        else:
+            turns = tuple(sorted(turn for _, turn in heroes))
+            if turns != self.hero_turns:
+                problems.append(DeckProblem('hero_turns', None, self.hero_turns, turns))
+
+        for card_id, _ in heroes:
+            if card_id not in self.hero_ids:
+                reason = 'unknown_card' if self.card_pool.get_idx_by_id(card_id) == -1 else 'not_a_hero'
+                problems.append(DeckProblem(reason, card_id, None, None))
+            elif card_id in self.signatures:
+                signature_id, count = self.signatures[card_id]
+                if cards.get(signature_id, 0) != count:
+                    problems.append(DeckProblem('signature_copies', signature_id, count, cards.get(signature_id, 0)))
+
+        main_deck = items = 0
+        for card_id, count in cards.items():
+            if card_id in self.item_ids:
+                items += count
+            elif self.card_pool.get_idx_by_id(card_id) == -1:
+                problems.append(DeckProblem('unknown_card', card_id, None, None))
+                continue
+            else:
+                main_deck += count
+            if count > self.max_copies:
+                problems.append(DeckProblem('too_many_copies', card_id, self.max_copies, count))
+
+        if main_deck < self.min_main_deck:
+            problems.append(DeckProblem('main_deck_size', None, self.min_main_deck, main_deck))
+        if items < self.min_items:
+            problems.append(DeckProblem('item_count', None, self.min_items, items))
+
+        return problems
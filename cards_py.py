@@ -1,11 +1,34 @@
-import requests
 import re
 import textwrap
 import pathlib
 import json
+import functools
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import Counter, namedtuple
 
-cache = pathlib.Path('.cache')
-cache.mkdir(exist_ok=True)
+# where card sets are cached, ARTIFACT_CACHE_DIR or .cache in the working directory, created on the first write
+cache = pathlib.Path(os.environ.get('ARTIFACT_CACHE_DIR', '.cache'))
+
+
+def set_cache_dir(path):
+    """Cache card sets in path from now on."""
+    global cache
+    cache = pathlib.Path(path)
+
+
+def write_atomic(path, content):
+    """Write bytes to path through a temporary file and a rename, so readers never see a partial file."""
+    pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
 
 
 def format_columns(col_width, columns):
@@ -19,16 +42,49 @@ def format_columns(col_width, columns):
     return s
 
 
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _lazy_field(name):
+    """Property for one of Card.lazy_fields, loading all of them the first time one is read or set."""
+    slot = '_' + name
+
+    def get(self):
+        if self._load_lazy_fields is not None:
+            self._load()
+        return getattr(self, slot)
+
+    def set(self, value):
+        if self._load_lazy_fields is not None:
+            self._load()
+        setattr(self, slot, value)
+
+    return property(get, set)
+
+
 class Card:
+    """A card, stored in slots with card_type, colour and sub_type interned.
+
+    Cards are treated as immutable once built (CardList.update replaces every field at once with copy_from), so the
+    text render returns is kept per width.
+
+    The rarely used lazy_fields can be left to a load_lazy_fields callable which returns a dict of them, it is called
+    the first time one of them is used (cards loaded from a CardSetSnapshot read them from the snapshot).
+    """
+    lazy_fields = ['card_text', 'mini_image', 'large_image', 'ingame_image', 'illustrator']
+    __slots__ = ['display_width', 'name', 'card_id', 'card_type', 'hit_points', 'attack', 'armor', 'retaliate', 'regen',
+                 'mana_cost', 'gold_cost', 'sub_type', 'colour', 'references', 'ability', 'base_card_id', 'card_names',
+                 '_load_lazy_fields', '_rendered'] + ['_' + name for name in lazy_fields]
+
     def __init__(self, card_name, card_id, card_type, hit_points=None, attack=None, armor=None, retaliate=None,
                  regen=None, mana_cost=None, gold_cost=None, sub_type=None, card_text=None, colour=None,
                  references=None,
                  display_width=60, ability=None, mini_image=None, large_image=None, ingame_image=None, illustrator=None,
-                 base_card_id=None):
-        self.display_width = 60
+                 base_card_id=None, card_names=None, load_lazy_fields=None):
         self.name = card_name
         self.card_id = card_id
-        self.card_type = card_type
+        self.card_type = _intern(card_type)
         self.hit_points = hit_points
         self.attack = attack
         self.armor = armor
@@ -36,17 +92,51 @@ class Card:
         self.regen = regen
         self.mana_cost = mana_cost
         self.gold_cost = gold_cost
-        self.sub_type = sub_type
-        self.card_text = card_text
-        self.colour = colour
+        self.sub_type = _intern(sub_type)
+        self.colour = _intern(colour)
         self.references = references
         self.display_width = display_width
         self.ability = ability
-        self.mini_image = mini_image
-        self.large_image = large_image
-        self.ingame_image = ingame_image
-        self.illustrator = illustrator
         self.base_card_id = base_card_id
+        self.card_names = card_names
+
+        self._card_text = card_text
+        self._mini_image = mini_image
+        self._large_image = large_image
+        self._ingame_image = ingame_image
+        self._illustrator = _intern(illustrator)
+        self._load_lazy_fields = load_lazy_fields
+        # width -> rendered text, see render
+        self._rendered = {}
+
+    card_text = _lazy_field('card_text')
+    mini_image = _lazy_field('mini_image')
+    large_image = _lazy_field('large_image')
+    ingame_image = _lazy_field('ingame_image')
+    illustrator = _lazy_field('illustrator')
+
+    def _load(self):
+        load_lazy_fields, self._load_lazy_fields = self._load_lazy_fields, None
+        for name, value in load_lazy_fields().items():
+            setattr(self, name, value)
+
+    def copy_from(self, card):
+        """Overwrite every field with the values of card, used to update cards in place."""
+        for slot in Card.__slots__:
+            setattr(self, slot, getattr(card, slot))
+        self._rendered = {}
+
+    def same_values(self, card):
+        """Whether card has the same values as this card."""
+        state, other_state = self.__getstate__()[1], card.__getstate__()[1]
+        del state['_rendered'], other_state['_rendered']
+        return state == other_state
+
+    def __getstate__(self):
+        # loaders usually hold a snapshot, which can't be pickled
+        if self._load_lazy_fields is not None:
+            self._load()
+        return None, {slot: getattr(self, slot) for slot in Card.__slots__}
 
     @staticmethod
     def unpack_dict(d):
@@ -75,53 +165,238 @@ class Card:
             'large_image': d.get('large_image'),
             'ingame_image': d.get('ingame_image'),
             'illustrator': d.get('illustrator'),
-            'base_card_id': d.get('base_card_id')
+            'base_card_id': d.get('base_card_id'),
+            'card_names': d['card_name']
         })
 
-    def __str__(self):
-        col_width = int(self.display_width / 2)
-        lines = [f'{self.colour.upper():-^{self.display_width}}']
+    def render(self, width=None):
+        """The card as a box of text width (display_width by default) characters wide, memoized per width."""
+        width = width or self.display_width
+        text = self._rendered.get(width)
+        if text is None:
+            text = self._rendered[width] = self._render(width)
 
-        lines.append(format_columns(col_width, [('Name', self.card_name), ('Type', self.card_type)]))
+        return text
+
+    def _render(self, width):
+        colour = (self.colour or '').upper()
+        lines = [f'{colour:-^{width}}']
+
+        lines.append(format_columns(int(width / 2), [('Name', self.name), ('Type', self.card_type)]))
         if self.mana_cost or self.gold_cost:
             columns = [('Mana', self.mana_cost)] if self.mana_cost else [('Gold', self.gold_cost)]
             if self.sub_type:
                 columns += [('Sub Type', self.sub_type)]
-            lines.append(format_columns(int(self.display_width / len(columns)), columns))
+            lines.append(format_columns(int(width / len(columns)), columns))
 
-        if self.text:
-            for line in textwrap.wrap(re.sub(r'<[^<]+?>', '', self.text), self.display_width - 2):
-                lines.append(f'{line: ^{self.display_width}}')
+        if self.card_text:
+            for line in textwrap.wrap(re.sub(r'<[^<]+?>', '', self.card_text), width - 2):
+                lines.append(f'{line: ^{width}}')
 
         if self.attack is not None and self.hit_points:
             columns = [('Attack', self.attack)]
             if self.armor: columns += [('Armor', self.armor)]
             columns += [('HP', self.hit_points)]
 
-            lines.append(format_columns(int(self.display_width / len(columns)), columns))
+            lines.append(format_columns(int(width / len(columns)), columns))
 
-        lines.append(f'{self.colour.upper():-^{self.display_width}}')
+        lines.append(f'{colour:-^{width}}')
         return '\n'.join(lines)
 
+    def __str__(self):
+        return self.render()
+
 
 class CardList:
-    def __init__(self, cards):
-        self.cards = cards
+    """Indexed list of cards.
+
+    Cards removed by update keep their slot, so positions held elsewhere stay valid. They are left out of the indexes
+    and of iteration, but len and indexing still count them (see is_removed).
+    """
+
+    def __init__(self, cards, id_index=None, name_index=None, removed=()):
+        # stored as a tuple as the indexes below refer to positions in it
+        self.cards = tuple(cards)
+        # positions of the cards update removed
+        self._removed = set(removed)
+
+        if id_index is None or name_index is None:
+            id_index, name_index = CardList._build_index(self.cards, self._removed)
+
+        self._id_index = id_index
+        self._name_index = name_index
+        self._table = None
+        self._signatures = None
+        self._search_index = None
+
+    @staticmethod
+    def _build_index(cards, removed=()):
+        id_index = {}
+        name_index = {}
+        for i, card in enumerate(cards):
+            if i in removed:
+                continue
+            id_index.setdefault(card.card_id, i)
+            name_index.setdefault(card.name, i)
+            if card.card_names:
+                for name in card.card_names.values():
+                    name_index.setdefault(name, i)
+
+        return id_index, name_index
+
+    def get_idx_by_id(self, card_id):
+        return self._id_index.get(card_id, -1)
+
+    def get_idx_by_name(self, card_name):
+        return self._name_index.get(card_name, -1)
 
     def get_card_by_id(self, card_id):
-        for card in self.cards:
-            if card.card_id == card_id:
-                return card
+        idx = self._id_index.get(card_id)
+        return self.cards[idx] if idx is not None else None
+
+    def get_card_by_name(self, card_name):
+        idx = self._name_index.get(card_name)
+        return self.cards[idx] if idx is not None else None
 
     def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.take(range(*item.indices(len(self.cards))))
         return self.cards.__getitem__(item)
 
     def __len__(self):
         return len(self.cards)
 
+    def __iter__(self):
+        for i, card in enumerate(self.cards):
+            if i not in self._removed:
+                yield card
+
+    def is_removed(self, i):
+        """Whether the card at position i was removed by update."""
+        return i in self._removed
+
     def __add__(self, other):
-        cards = self.cards + other.cards
-        return CardList(cards)
+        offset = len(self.cards)
+
+        id_index = {card_id: i + offset for card_id, i in other._id_index.items()}
+        id_index.update(self._id_index)
+        name_index = {name: i + offset for name, i in other._name_index.items()}
+        name_index.update(self._name_index)
+
+        return CardList(self.cards + other.cards, id_index, name_index,
+                        self._removed | {i + offset for i in other._removed})
+
+    def update(self, changed=(), added=(), removed=()):
+        """Apply a card set update in place.
+
+        Each changed Card is copied into the Card in the list with the same card_id, so Cards held elsewhere (such as
+        in hydrated decks) see the new values. Added Cards are appended. The cards with a removed card_id keep their
+        slot, and Cards and positions held elsewhere stay valid, but they are dropped from the indexes and iteration.
+        """
+        changed_idx = {self._id_index[card.card_id]: card for card in changed}
+        for i, card in changed_idx.items():
+            self.cards[i].copy_from(card)
+
+        if removed:
+            removed = set(removed)
+            self._removed.update(i for i, card in enumerate(self.cards) if card.card_id in removed)
+
+        self._table = None
+        self._signatures = None
+        self._search_index = None
+        offset = len(self.cards)
+        self.cards += tuple(added)
+        if changed_idx or removed:
+            # a changed or removed card may have shared an id or name with another card, which then takes its place
+            self._id_index, self._name_index = CardList._build_index(self.cards, self._removed)
+            return
+
+        for i in range(offset, len(self.cards)):
+            card = self.cards[i]
+            self._id_index.setdefault(card.card_id, i)
+            self._name_index.setdefault(card.name, i)
+            if card.card_names:
+                for name in card.card_names.values():
+                    self._name_index.setdefault(name, i)
+
+    def take(self, indexes):
+        """A CardList of the cards at indexes, in that order (repeats are left out). Cards are shared, not copied."""
+        positions = {}
+        for i in indexes:
+            positions.setdefault(i, len(positions))
+        cards = [self.cards[i] for i in positions]
+
+        id_index = {card_id: positions[i] for card_id, i in self._id_index.items() if i in positions}
+        name_index = {name: positions[i] for name, i in self._name_index.items() if i in positions}
+        return CardList(cards, id_index, name_index, [positions[i] for i in positions if i in self._removed])
+
+    def table(self):
+        """A CardTable of the attributes of every card (see artifact.table), built once and cached. Requires numpy."""
+        if self._table is None:
+            from artifact.table import CardTable
+            self._table = CardTable.from_card_list(self)
+
+        return self._table
+
+    def search_index(self):
+        """A CardSearch over the names and card text of the cards (see artifact.search), built once and cached."""
+        if self._search_index is None:
+            from artifact.search import CardSearch
+            self._search_index = CardSearch(self)
+
+        return self._search_index
+
+    def search(self, query, limit=10, fuzzy=True, text=True):
+        return self.search_index().search(query, limit, fuzzy, text)
+
+    def signatures(self):
+        """Map of hero card_id to (signature card_id, copies), from the first includes reference of every hero. Built
+        once and cached, earlier cards win card_id clashes as in the indexes."""
+        if self._signatures is None:
+            signatures = {}
+            for card in self:
+                if card.card_type != 'Hero' or not card.references:
+                    continue
+                for reference in card.references:
+                    if reference['ref_type'] == 'includes':
+                        signatures.setdefault(card.card_id, (reference['card_id'], reference.get('count', 0)))
+                        break
+            self._signatures = signatures
+
+        return self._signatures
+
+    def __getstate__(self):
+        state = dict(vars(self))
+        state['_table'] = None
+        state['_signatures'] = None
+        state['_search_index'] = None
+        return state
+
+    def __setstate__(self, state):
+        # lists pickled before cards could be removed
+        state.setdefault('_removed', set())
+        vars(self).update(state)
+
+    @staticmethod
+    def concat(card_lists):
+        """Join several CardLists into one, earlier lists win index clashes as with +. Cards are shared, not copied."""
+        cards = []
+        id_index = {}
+        name_index = {}
+        removed = []
+        for card_list in card_lists:
+            offset = len(cards)
+            for card_id, i in card_list._id_index.items():
+                id_index.setdefault(card_id, i + offset)
+            for name, i in card_list._name_index.items():
+                name_index.setdefault(name, i + offset)
+            removed += [i + offset for i in card_list._removed]
+            cards.extend(card_list.cards)
+
+        return CardList(cards, id_index, name_index, removed)
+
+
+CardSetDiff = namedtuple('CardSetDiff', ['version', 'added', 'changed', 'removed'])
 
 
 class CardSet:
@@ -132,38 +407,93 @@ class CardSet:
         self.version = version
         self.cards = cards
 
+    api_url = 'https://playartifact.com/cardset/'
+
+    @staticmethod
+    def fetch_card_set(set_code):
+        return fetcher.fetch(set_code, force=True)
+
     @staticmethod
     def get_card_set(set_code):
-        set_cache_path = cache / f'{set_code}.json'
-        if not set_cache_path.exists():
-            request_url = f'https://playartifact.com/cardset/{set_code}/'
-            r = requests.get(request_url)
+        return fetcher.fetch(set_code)
 
-            if r.status_code != 200:
-                raise Exception(f'{r.status_code}: {request_url}')
+    @staticmethod
+    def load_card_sets(set_codes):
+        fetched = fetcher.fetch_many([set_code for set_code in set_codes if fetcher.is_expired(set_code)])
+        return [CardSet.load_card_set(set_code, fetched.get(set_code)) for set_code in set_codes]
 
-            data = r.json()
-            set_url = data['cdn_root'] + data['url']
+    @staticmethod
+    def load_card_set(set_code, data=None):
+        """Load a set from the cache, fetching it first if it has expired. data is the set JSON if the caller has
+        just fetched it, it is then used as is."""
+        if data is None and fetcher.is_expired(set_code):
+            # revalidates the cached JSON, it is only rewritten (making the snapshot stale) if the set changed
+            data = CardSet.get_card_set(set_code)
+
+        snapshot_path = cache / f'{set_code}.snapshot'
+        set_cache_path = cache / f'{set_code}.json'
+        if snapshot_path.exists() and (not set_cache_path.exists() or
+                                       snapshot_path.stat().st_mtime >= set_cache_path.stat().st_mtime):
+            try:
+                snapshot = CardSetSnapshot(snapshot_path)
+            except ValueError:
+                pass
+            else:
+                return snapshot.card_set(set_code)
 
-            r = requests.get(set_url)
+        if data is None:
+            data = CardSet.get_card_set(set_code)
+        CardSetSnapshot.write(data, snapshot_path)
 
-            if r.status_code != 200:
-                raise Exception(f'{r.status_code}: {set_url}')
+        return CardSet.unpack_dict(data, set_code)
 
-            card_set_json = r.json()
-            with open(set_cache_path, 'w') as set_cache:
-                set_cache.write(r.content.decode('utf-8'))
+    def refresh(self, data=None):
+        """Bring the set up to date in place, fetching the set JSON again unless data is given.
 
+        Cards are diffed by card_id against the cards of this set. Changed cards are updated in place so Decks holding
+        them see the new values, new cards are appended and removed cards are left out of lookups and iteration but keep
+        their slot, see CardList.update.
+        """
+        set_cache_path = cache / f'{self.set_code}.json'
+        if data is None:
+            data = CardSet.fetch_card_set(self.set_code)
         else:
-            with open(set_cache_path, 'r') as set_cache:
-                card_set_json = json.loads(set_cache.read())
+            write_atomic(set_cache_path, json.dumps(data).encode('utf-8'))
+        CardSetSnapshot.write(data, cache / f'{self.set_code}.snapshot')
 
-        return card_set_json
+        card_ids = set()
+        changed = []
+        added = []
+        for d in data['card_set']['card_list']:
+            card_ids.add(d['card_id'])
+            card = Card.unpack_dict(d)
+            current = self.cards.get_card_by_id(d['card_id'])
+            if current is None:
+                added.append(card)
+            elif not current.same_values(card):
+                changed.append(card)
+
+        removed = []
+        for i in range(len(self.cards)):
+            card_id = self.cards[i].card_id
+            if card_id not in card_ids and self.cards.get_idx_by_id(card_id) == i:
+                removed.append(card_id)
+
+        self.cards.update(changed, added, removed)
+        self.set_name = data['card_set']['set_info']['name']['english']
+        self.version = data['card_set']['version']
+
+        return CardSetDiff(self.version, [card.card_id for card in added], [card.card_id for card in changed],
+                           removed)
 
     @staticmethod
-    def load_card_set(set_code):
-        data = CardSet.get_card_set(set_code)
+    def clear_cache(set_code):
+        for path in [cache / f'{set_code}.json', cache / f'{set_code}.meta.json', cache / f'{set_code}.snapshot']:
+            if path.exists():
+                path.unlink()
 
+    @staticmethod
+    def unpack_dict(data, set_code):
         card_set_dict = data['card_set']
         card_list = CardList([Card.unpack_dict(d) for d in card_set_dict['card_list']])
         set_info = card_set_dict['set_info']
@@ -178,13 +508,454 @@ class CardSet:
 
         return card_set
 
+    def table(self):
+        return self.cards.table()
+
+    def search(self, query, limit=10, fuzzy=True, text=True):
+        return self.cards.search(query, limit, fuzzy, text)
+
     def get_card_by_id(self, card_id):
         return self.cards.get_card_by_id(card_id)
 
+    def get_card_by_name(self, name):
+        return self.cards.get_card_by_name(name)
+
     def __len__(self):
         return len(self.cards)
 
 
+class CardSetFetcher:
+    """Fetches card sets over a pooled requests Session with retries and a timeout.
+
+    Alongside each cached set JSON a <set_code>.meta.json records the expire_time returned by the cardset endpoint and
+    the ETag / Last-Modified of the set file. The cached set is used until it expires, then it is revalidated with a
+    conditional request. Sets cached without a meta file or an expire_time never expire, they are only fetched again
+    with force. If the API can not be reached or answers with an error or an unexpected document the cached set is
+    used regardless.
+    """
+    def __init__(self, api_url=None, cache_dir=None, timeout=10, retries=3, workers=4):
+        self.api_url = api_url
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.retries = retries
+        self.workers = workers
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    # the network stack is only imported once a set is fetched
+                    import requests
+                    from requests.adapters import HTTPAdapter, Retry
+
+                    retry = Retry(total=self.retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+                    adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers, max_retries=retry)
+                    session = requests.Session()
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+
+        return self._session
+
+    def _paths(self, set_code):
+        cache_dir = cache if self.cache_dir is None else pathlib.Path(self.cache_dir)
+        return cache_dir / f'{set_code}.json', cache_dir / f'{set_code}.meta.json'
+
+    def _get(self, url, headers=None):
+        import requests
+
+        r = self.session.get(url, headers=headers, timeout=self.timeout)
+        if r.status_code not in (200, 304):
+            raise requests.HTTPError(f'{r.status_code}: {url}', response=r)
+
+        return r
+
+    def is_expired(self, set_code):
+        set_cache_path, meta_path = self._paths(set_code)
+        if not set_cache_path.exists():
+            return True
+        if not meta_path.exists():
+            return False
+
+        with open(meta_path, 'r') as meta_file:
+            expire_time = json.loads(meta_file.read()).get('expire_time')
+        return expire_time is not None and expire_time <= time.time()
+
+    def fetch(self, set_code, force=False):
+        """Return the set JSON, from the cache unless it has expired or force is set."""
+        set_cache_path, meta_path = self._paths(set_code)
+        if not force and not self.is_expired(set_code):
+            with open(set_cache_path, 'r') as set_cache:
+                return json.loads(set_cache.read())
+
+        meta = {}
+        if set_cache_path.exists() and meta_path.exists():
+            with open(meta_path, 'r') as meta_file:
+                meta = json.loads(meta_file.read())
+
+        import requests
+        try:
+            request_url = f'{self.api_url or CardSet.api_url}{set_code}/'
+            data = self._get(request_url).json()
+            if not isinstance(data, dict) or 'cdn_root' not in data or 'url' not in data:
+                raise requests.RequestException(f'Unexpected card set document from {request_url}')
+            set_url = data['cdn_root'] + data['url']
+
+            headers = {}
+            if meta.get('url') == set_url:
+                if meta.get('etag'):
+                    headers['If-None-Match'] = meta['etag']
+                if meta.get('last_modified'):
+                    headers['If-Modified-Since'] = meta['last_modified']
+            r = self._get(set_url, headers)
+            card_set_json = r.json() if r.status_code != 304 else None
+        # ValueError is a body that is not JSON
+        except (requests.RequestException, ValueError):
+            if not set_cache_path.exists():
+                raise
+            with open(set_cache_path, 'r') as set_cache:
+                return json.loads(set_cache.read())
+
+        if r.status_code == 304:
+            with open(set_cache_path, 'r') as set_cache:
+                card_set_json = json.loads(set_cache.read())
+        else:
+            write_atomic(set_cache_path, r.content)
+            meta = {'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')}
+
+        # without an expire_time the set is kept until fetched with force
+        meta.update(url=set_url, expire_time=data.get('expire_time'))
+        write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+
+        return card_set_json
+
+    def fetch_many(self, set_codes, force=False):
+        """Fetch several sets concurrently, returns a dict of set code to set JSON."""
+        set_codes = list(set_codes)
+        if not set_codes:
+            return {}
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(min(self.workers, len(set_codes))) as executor:
+            return dict(zip(set_codes, executor.map(lambda set_code: self.fetch(set_code, force), set_codes)))
+
+
+fetcher = CardSetFetcher()
+
+
+class CardSetSnapshot:
+    """Read only card set snapshot, a compact binary copy of the card set JSON that is loaded with mmap.
+
+    Layout (little endian): the header, then one int32 column per field in int_columns, string_columns and
+    dict_columns with an entry per card, the reference table (card_id, ref_type, count int32 triples), the dict table
+    offsets (uint32, num_dicts + 1) into the dict entries (key, value string index int32 pairs), the string table
+    offsets (uint32, num_strings + 1) and finally the utf-8 string data, every string followed by a NUL. String
+    columns hold indexes into the string table and dict columns (images and localized names) indexes into the dict
+    table, missing values are stored as null_int / -1. Nothing is parsed on load, the columns are read in place and
+    the string table is decoded in one go the first time a string is needed.
+    """
+    magic = b'ACSS'
+    format_version = 2
+    header = struct.Struct('<4sIiiiIIIII')
+    null_int = -2 ** 31
+    int_columns = ['card_id', 'base_card_id', 'hit_points', 'attack', 'armor', 'retaliate', 'regen', 'mana_cost',
+                   'gold_cost', 'reference_start', 'reference_count']
+    string_columns = ['card_name', 'card_type', 'sub_type', 'card_text', 'colour', 'illustrator']
+    dict_columns = ['mini_image', 'large_image', 'ingame_image', 'card_names']
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        buffer = memoryview(self._mmap)
+        magic, format_version, self.set_id, self.version, set_name, num_cards, num_references, num_strings, \
+            num_dicts, num_dict_entries = CardSetSnapshot.header.unpack_from(buffer)
+        if magic != CardSetSnapshot.magic or format_version != CardSetSnapshot.format_version:
+            raise ValueError(f'{path} is not a version {CardSetSnapshot.format_version} card set snapshot')
+
+        self.num_cards = num_cards
+        offset = CardSetSnapshot.header.size
+
+        self.columns = {}
+        for name in CardSetSnapshot.int_columns + CardSetSnapshot.string_columns + CardSetSnapshot.dict_columns:
+            self.columns[name] = CardSetSnapshot._int32_view(buffer, offset, num_cards)
+            offset += 4 * num_cards
+
+        self.references = CardSetSnapshot._int32_view(buffer, offset, 3 * num_references)
+        offset += 12 * num_references
+
+        self._dict_offsets = CardSetSnapshot._int32_view(buffer, offset, num_dicts + 1, 'I')
+        offset += 4 * (num_dicts + 1)
+        self._dict_entries = CardSetSnapshot._int32_view(buffer, offset, 2 * num_dict_entries)
+        offset += 8 * num_dict_entries
+
+        self._string_offsets = CardSetSnapshot._int32_view(buffer, offset, num_strings + 1, 'I')
+        offset += 4 * (num_strings + 1)
+        self._strings = buffer[offset:]
+        self._decoded_strings = None
+
+        self.set_name = self.string(set_name)
+
+    @staticmethod
+    def _int32_view(buffer, offset, length, typecode='i'):
+        view = buffer[offset:offset + 4 * length]
+        if sys.byteorder == 'little':
+            return view.cast(typecode)
+        swapped = array(typecode, view)
+        swapped.byteswap()
+        return swapped
+
+    def strings(self):
+        """Every string in the string table (and an empty one for the last NUL), decoded at once and kept, which is much
+        faster than one at a time."""
+        if self._decoded_strings is None:
+            self._decoded_strings = str(self._strings, 'utf-8').split('\0')
+        return self._decoded_strings
+
+    def string(self, idx):
+        return self.strings()[idx] if idx >= 0 else None
+
+    def dict(self, idx):
+        if idx < 0:
+            return None
+        strings = self.strings()
+        entries = self._dict_entries[2 * self._dict_offsets[idx]:2 * self._dict_offsets[idx + 1]]
+        return {strings[entries[j]]: strings[entries[j + 1]] for j in range(0, len(entries), 2)}
+
+    def value(self, name, i):
+        value = self.columns[name][i]
+        return None if value == CardSetSnapshot.null_int else value
+
+    def card_references(self, i):
+        if self.columns['reference_count'][i] < 0:
+            return None
+
+        references = []
+        start = self.columns['reference_start'][i]
+        for j in range(start, start + self.columns['reference_count'][i]):
+            reference = {'card_id': self.references[3 * j],
+                         'ref_type': self.string(self.references[3 * j + 1])}
+            if self.references[3 * j + 2] != CardSetSnapshot.null_int:
+                reference['count'] = self.references[3 * j + 2]
+            references.append(reference)
+
+        return references
+
+    def lazy_fields(self, i):
+        """The Card.lazy_fields of card i as a dict."""
+        columns = self.columns
+        return {'card_text': self.string(columns['card_text'][i]), 'mini_image': self.dict(columns['mini_image'][i]),
+                'large_image': self.dict(columns['large_image'][i]),
+                'ingame_image': self.dict(columns['ingame_image'][i]),
+                'illustrator': self.string(columns['illustrator'][i])}
+
+    def card(self, i, lazy=False):
+        """Card i, with lazy its Card.lazy_fields are only read from the snapshot when first used."""
+        return self._card(i, [self.columns[name][i] for name in CardSetSnapshot._card_columns], lazy)
+
+    _card_columns = ['card_name', 'card_id', 'card_type', 'hit_points', 'attack', 'armor', 'retaliate', 'regen',
+                     'mana_cost', 'gold_cost', 'sub_type', 'colour', 'reference_count', 'base_card_id', 'card_names']
+
+    def _card(self, i, row, lazy):
+        null_int = CardSetSnapshot.null_int
+        card_name, card_id, card_type, hit_points, attack, armor, retaliate, regen, mana_cost, gold_cost, sub_type, \
+            colour, reference_count, base_card_id, card_names = row
+        strings = self.strings()
+
+        return Card(
+            card_name=strings[card_name],
+            card_id=card_id,
+            card_type=strings[card_type],
+            hit_points=None if hit_points == null_int else hit_points,
+            attack=None if attack == null_int else attack,
+            armor=None if armor == null_int else armor,
+            retaliate=None if retaliate == null_int else retaliate,
+            regen=None if regen == null_int else regen,
+            mana_cost=None if mana_cost == null_int else mana_cost,
+            gold_cost=None if gold_cost == null_int else gold_cost,
+            sub_type=strings[sub_type] if sub_type >= 0 else None,
+            colour=strings[colour],
+            references=self.card_references(i) if reference_count >= 0 else None,
+            base_card_id=None if base_card_id == null_int else base_card_id,
+            card_names=self.dict(card_names),
+            load_lazy_fields=functools.partial(self.lazy_fields, i) if lazy else None,
+            **({} if lazy else self.lazy_fields(i))
+        )
+
+    def card_set(self, set_code, lazy=True):
+        """The snapshot as a CardSet. Lazy cards keep the snapshot open, it must not be closed while they are used."""
+        # whole columns are read at once, indexing the memoryviews per card costs more than building the cards
+        rows = zip(*[self.columns[name].tolist() for name in CardSetSnapshot._card_columns])
+        card_list = CardList([self._card(i, row, lazy) for i, row in enumerate(rows)])
+        return CardSet(self.set_name, set_code, self.set_id, self.version, card_list)
+
+    def close(self):
+        for view in list(self.columns.values()) + [self.references, self._dict_offsets, self._dict_entries,
+                                                   self._string_offsets, self._strings]:
+            if isinstance(view, memoryview):
+                view.release()
+        self._mmap.close()
+
+    @staticmethod
+    def write(data, path):
+        """Write the snapshot of a card set JSON document (as returned by CardSet.get_card_set) to path."""
+        card_set_dict = data['card_set']
+        card_list = card_set_dict['card_list']
+
+        strings = {}
+        dict_offsets = array('I', [0])
+        dict_entries = array('i')
+
+        def string_idx(value):
+            if value is None:
+                return -1
+            return strings.setdefault(value, len(strings))
+
+        def dict_idx(value):
+            if value is None:
+                return -1
+            for key, item in value.items():
+                dict_entries.extend([string_idx(key), string_idx(item)])
+            dict_offsets.append(len(dict_entries) // 2)
+            return len(dict_offsets) - 2
+
+        def int_value(value):
+            return CardSetSnapshot.null_int if value is None else value
+
+        columns = {name: array('i') for name in
+                   CardSetSnapshot.int_columns + CardSetSnapshot.string_columns + CardSetSnapshot.dict_columns}
+        references = array('i')
+        for d in card_list:
+            colour = None
+            for c in ['black', 'blue', 'green', 'red']:
+                if ('is_' + c) in d:
+                    colour = c
+                    break
+
+            for name in ['card_id', 'base_card_id', 'hit_points', 'attack', 'armor', 'retaliate', 'regen',
+                         'mana_cost', 'gold_cost']:
+                columns[name].append(int_value(d.get(name)))
+
+            columns['reference_start'].append(len(references) // 3)
+            columns['reference_count'].append(-1 if d.get('references') is None else len(d['references']))
+            for reference in d.get('references') or []:
+                references.extend([reference['card_id'], string_idx(reference['ref_type']),
+                                   int_value(reference.get('count'))])
+
+            columns['card_name'].append(string_idx(d['card_name']['english']))
+            columns['card_type'].append(string_idx(d['card_type']))
+            columns['sub_type'].append(string_idx(d.get('sub_type')))
+            columns['card_text'].append(string_idx(d['card_text'].get('english') if 'card_text' in d else None))
+            columns['colour'].append(string_idx(colour or ''))
+            columns['illustrator'].append(string_idx(d.get('illustrator')))
+            for name in ['mini_image', 'large_image', 'ingame_image']:
+                columns[name].append(dict_idx(d.get(name)))
+            columns['card_names'].append(dict_idx(d['card_name']))
+
+        set_info = card_set_dict['set_info']
+        set_name = string_idx(set_info['name']['english'])
+
+        encoded_strings = [value.encode('utf-8') + b'\0' for value in strings]
+        string_offsets = array('I', [0])
+        for value in encoded_strings:
+            string_offsets.append(string_offsets[-1] + len(value))
+
+        header = CardSetSnapshot.header.pack(CardSetSnapshot.magic, CardSetSnapshot.format_version,
+                                             set_info['set_id'], card_set_dict['version'], set_name, len(card_list),
+                                             len(references) // 3, len(strings), len(dict_offsets) - 1,
+                                             len(dict_entries) // 2)
+
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            for column in [columns[name] for name in CardSetSnapshot.int_columns + CardSetSnapshot.string_columns +
+                           CardSetSnapshot.dict_columns] + [references, dict_offsets, dict_entries, string_offsets]:
+                if sys.byteorder != 'little':
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                f.write(column.tobytes())
+            f.write(b''.join(encoded_strings))
+        os.replace(tmp_path, path)
+
+
+class CardSetRegistry:
+    """Loads each card set once per process and hands the same CardSet to every caller.
+
+    The returned CardSets and CardLists are shared, treat them as read only. all_cards keeps one indexed CardList per
+    combination of set codes so a pool over every set is built once.
+    """
+    def __init__(self, set_codes=('00', '01'), load_card_set=None):
+        self.set_codes = tuple(set_codes)
+        # None looks up CardSet.load_card_set on every load, so it can still be wrapped (see artifact.stats)
+        self.load_card_set = load_card_set
+        self._card_sets = {}
+        self._pools = {}
+        self._lock = threading.RLock()
+
+    def get(self, set_code):
+        card_set = self._card_sets.get(set_code)
+        if card_set is None:
+            with self._lock:
+                card_set = self._card_sets.get(set_code)
+                if card_set is None:
+                    load_card_set = self.load_card_set or CardSet.load_card_set
+                    card_set = self._card_sets[set_code] = load_card_set(set_code)
+
+        return card_set
+
+    def all_cards(self, set_codes=None):
+        set_codes = self.set_codes if set_codes is None else tuple(set_codes)
+        pool = self._pools.get(set_codes)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(set_codes)
+                if pool is None:
+                    pool = CardList.concat([self.get(set_code).cards for set_code in set_codes])
+                    self._pools[set_codes] = pool
+
+        return pool
+
+    def invalidate(self, set_code=None, version=None, clear_cache=False):
+        """Forget a loaded set, or every set, so the next get loads it again.
+
+        With version only sets whose loaded version differs are dropped, with clear_cache their cache files are
+        removed too so they are fetched again. Returns the dropped set codes.
+        """
+        with self._lock:
+            set_codes = list(self._card_sets) if set_code is None else [set_code]
+            dropped = [code for code in set_codes
+                       if code in self._card_sets and (version is None or self._card_sets[code].version != version)]
+
+            for code in dropped:
+                del self._card_sets[code]
+                if clear_cache:
+                    CardSet.clear_cache(code)
+
+            self._pools = {codes: pool for codes, pool in self._pools.items() if not set(codes) & set(dropped)}
+
+        return dropped
+
+    def refresh(self, set_code, data=None):
+        """Refresh a loaded set in place (see CardSet.refresh) and return its CardSetDiff."""
+        with self._lock:
+            diff = self.get(set_code).refresh(data)
+            # the pools' indexes may be stale even when only names changed, the cards themselves are shared
+            if diff.added or diff.changed or diff.removed:
+                self._pools = {codes: pool for codes, pool in self._pools.items() if set_code not in codes}
+
+        return diff
+
+    def __contains__(self, set_code):
+        return set_code in self._card_sets
+
+
+registry = CardSetRegistry()
+
+
 class Deck:
     def __init__(self, heroes, main_deck, items, name=''):
         self.heroes = heroes
@@ -197,12 +968,12 @@ class Deck:
 
     def to_code_deck_dict(self):
         deck = {'heroes': [], 'cards': [], 'name': self.name}
-        hero_cards = []
+        hero_cards = set()
         for i, hero in enumerate(self.heroes):
             deck['heroes'].append({'card_id': hero.card_id, 'turn': i - 1 if i > 2 else 1})
             for ref in hero.references:
                 if ref['ref_type'] == 'includes':
-                    hero_cards.append(ref['card_id'])
+                    hero_cards.add(ref['card_id'])
         cards = {}
 
         for card in self.main_deck + self.items:
@@ -246,3 +1017,154 @@ class Deck:
                 main_deck += [card] * card_dict['count']
 
         return Deck(heroes, main_deck, items, d.get('name', ''))
+
+
+DeckProblem = namedtuple('DeckProblem', ['reason', 'card_id', 'expected', 'actual'])
+
+
+class CountedDeck:
+    """A deck as hero slots and card counts instead of a Card per copy.
+
+    heroes is a list of (card_id, turn) and cards a dict of card_id to copies of every card in the deck, signature
+    cards and items included, so encoding and validating only touch each distinct card once.
+    """
+
+    def __init__(self, heroes, cards, name=''):
+        self.heroes = heroes
+        self.cards = cards
+        self.name = name
+
+    @staticmethod
+    def from_deck(deck):
+        return CountedDeck([(hero.card_id, i - 1 if i > 2 else 1) for i, hero in enumerate(deck.heroes)],
+                           dict(Counter(card.card_id for card in deck.main_deck + deck.items)), deck.name)
+
+    @staticmethod
+    def from_code_deck_dict(d, card_pool):
+        """The deck of a decoded deck code, adding the signature cards of its heroes from card_pool.signatures()."""
+        signatures = card_pool.signatures()
+        cards = {card['card_id']: card['count'] for card in d['cards']}
+        for hero in d['heroes']:
+            if hero['card_id'] in signatures:
+                card_id, count = signatures[hero['card_id']]
+                cards[card_id] = cards.get(card_id, 0) + count
+
+        return CountedDeck([(hero['card_id'], hero['turn']) for hero in d['heroes']], cards, d.get('name', ''))
+
+    def to_code_deck_dict(self, card_pool):
+        """The dict DeckEncoder.encode takes, leaving out the signature cards of the heroes as deck codes do."""
+        signatures = card_pool.signatures()
+        signature_ids = {signatures[card_id][0] for card_id, _ in self.heroes if card_id in signatures}
+
+        return {'heroes': [{'card_id': card_id, 'turn': turn} for card_id, turn in self.heroes],
+                'cards': [{'card_id': card_id, 'count': count} for card_id, count in self.cards.items()
+                          if card_id not in signature_ids],
+                'name': self.name}
+
+    def to_deck(self, card_pool):
+        heroes = [card_pool.get_card_by_id(card_id) for card_id, _ in sorted(self.heroes, key=lambda hero: hero[1])]
+        main_deck = []
+        items = []
+        for card_id, count in self.cards.items():
+            card = card_pool.get_card_by_id(card_id)
+            if card is None:
+                raise Exception(f'Card {card_id} is not in the card pool')
+            if card.card_type == 'Item':
+                items += [card] * count
+            else:
+                main_deck += [card] * count
+
+        return Deck(heroes, main_deck, items, self.name)
+
+
+class DeckValidator:
+    """Checks CountedDecks against the deck building rules, with the signature cards and items of card_pool.
+
+    validate returns a list of DeckProblems, empty for a valid deck. Their reasons are
+        hero_count        expected heroes, actual heroes
+        hero_turns        expected and actual sorted hero turns
+        unknown_card      a card (or hero) that is not in the card pool
+        not_a_hero        a hero slot holding a card that is not a hero
+        signature_copies  a hero's signature card, expected and actual copies
+        too_many_copies   a card with more than max_copies copies
+        main_deck_size    expected minimum and actual number of main deck cards
+        item_count        expected minimum and actual number of items
+    """
+    hero_turns = (1, 1, 1, 2, 3)
+    min_main_deck = 40
+    min_items = 9
+    max_copies = 3
+
+    def __init__(self, card_pool):
+        self.card_pool = card_pool
+        self.signatures = card_pool.signatures()
+        self.hero_ids = set()
+        self.item_ids = set()
+        for card in card_pool:
+            if card.card_type == 'Hero':
+                self.hero_ids.add(card.card_id)
+            elif card.card_type == 'Item':
+                self.item_ids.add(card.card_id)
+
+    def validate(self, deck):
+        return self._check(deck.heroes, deck.cards)
+
+    def is_valid(self, deck):
+        return not self._check(deck.heroes, deck.cards)
+
+    def validate_many(self, batch):
+        """Validate every deck of a DeckBatch (see DeckDecoder.decode_many), None for the codes that failed to decode."""
+        results = []
+        for i in range(len(batch)):
+            if batch.errors[i] is not None:
+                results.append(None)
+                continue
+
+            hero_slice = slice(batch.hero_offsets[i], batch.hero_offsets[i + 1])
+            card_slice = slice(batch.card_offsets[i], batch.card_offsets[i + 1])
+            heroes = list(zip(batch.hero_ids[hero_slice], batch.hero_turns[hero_slice]))
+            cards = dict(zip(batch.card_ids[card_slice], batch.card_counts[card_slice]))
+            for card_id, _ in heroes:
+                if card_id in self.signatures:
+                    signature_id, count = self.signatures[card_id]
+                    cards[signature_id] = cards.get(signature_id, 0) + count
+            results.append(self._check(heroes, cards))
+
+        return results
+
+    def _check(self, heroes, cards):
+        problems = []
+        if len(heroes) != len(self.hero_turns):
+            problems.append(DeckProblem('hero_count', None, len(self.hero_turns), len(heroes)))
+        else:
+            turns = tuple(sorted(turn for _, turn in heroes))
+            if turns != self.hero_turns:
+                problems.append(DeckProblem('hero_turns', None, self.hero_turns, turns))
+
+        for card_id, _ in heroes:
+            if card_id not in self.hero_ids:
+                reason = 'unknown_card' if self.card_pool.get_idx_by_id(card_id) == -1 else 'not_a_hero'
+                problems.append(DeckProblem(reason, card_id, None, None))
+            elif card_id in self.signatures:
+                signature_id, count = self.signatures[card_id]
+                if cards.get(signature_id, 0) != count:
+                    problems.append(DeckProblem('signature_copies', signature_id, count, cards.get(signature_id, 0)))
+
+        main_deck = items = 0
+        for card_id, count in cards.items():
+            if card_id in self.item_ids:
+                items += count
+            elif self.card_pool.get_idx_by_id(card_id) == -1:
+                problems.append(DeckProblem('unknown_card', card_id, None, None))
+                continue
+            else:
+                main_deck += count
+            if count > self.max_copies:
+                problems.append(DeckProblem('too_many_copies', card_id, self.max_copies, count))
+
+        if main_deck < self.min_main_deck:
+            problems.append(DeckProblem('main_deck_size', None, self.min_main_deck, main_deck))
+        if items < self.min_items:
+            problems.append(DeckProblem('item_count', None, self.min_items, items))
+
+        return problems
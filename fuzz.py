@@ -0,0 +1,261 @@
+"""Differential fuzzing of the pure Python, plain Cython and optimized Cython implementations.
+
+Random valid deck dicts and codes (from DeckGenerator over synthetic card sets and from wider random decks), invalid
+dicts and corrupted codes are run through encode, decode, the batch paths, fingerprints and hydrating in every
+implementation that can be imported. Results have to be equal and failures have to raise the same exception class,
+the first implementation listed is the reference. The time each implementation spends on each operation is recorded
+in the same run.
+
+    python fuzz.py                                  # 2000 rounds, exit 1 on any divergence
+    python fuzz.py --rounds 100000 --seed 7 -o fuzz.json
+
+A failing case is printed with its operation and input, `--seed` and `--rounds` reproduce the run. Implementations are
+imported as in benchmark.py, --pyximport compiles the ones that are not built.
+"""
+import argparse
+import base64
+import functools
+import json
+import operator
+import random
+import sys
+import time
+
+import benchmark
+
+_to_deck_code = str.maketrans('/=', '-_')
+_from_deck_code = str.maketrans('-_', '/=')
+
+
+def outcome(function, *args):
+    """('ok', result) or ('raise', exception class name), so results of different modules can be compared."""
+    try:
+        return 'ok', function(*args)
+    except Exception as e:
+        return 'raise', type(e).__name__
+
+
+class CaseGenerator:
+    """Seeded source of deck dicts and deck codes, valid and not."""
+
+    def __init__(self, card_pool, seed=0):
+        from artifact.generate import DeckGenerator
+
+        self.random = random.Random(seed)
+        self.decks = DeckGenerator(card_pool, seed=seed)
+
+    def name(self):
+        rng = self.random
+        alphabet = ['a', 'Z', ' ', '/', '=', '-', '_', 'é', 'ß', '漢', '🂡']
+        # longer than 63 bytes is cut by the encoder, possibly in the middle of a character
+        return ''.join(rng.choice(alphabet) for _ in range(rng.choice([0, 1, 5, 20, 40, 70])))
+
+    def random_deck(self):
+        """A deck the encoder accepts that DeckGenerator would not make: any card ids, big counts, odd names."""
+        rng = self.random
+        turns = [1, 1, 1, 2, 3]
+        rng.shuffle(turns)
+        id_range = rng.choice([1 << 6, 1 << 12, 1 << 20, 1 << 31])
+        hero_ids = rng.sample(range(1, id_range), 5)
+        card_ids = rng.sample(range(1, id_range), rng.randint(0, 40))
+        return {'heroes': [{'card_id': card_id, 'turn': turn} for card_id, turn in zip(hero_ids, turns)],
+                'cards': [{'card_id': card_id, 'count': rng.choice([1, 2, 3, 3, 4, 127, 128, 300])}
+                          for card_id in card_ids],
+                'name': self.name()}
+
+    def valid_deck(self):
+        if self.random.random() < 0.5:
+            return self.decks.code_deck_dict(self.name())
+        return self.random_deck()
+
+    def invalid_deck(self):
+        rng = self.random
+        deck = self.valid_deck()
+        mutation = rng.randrange(5)
+        if mutation == 0:
+            del deck[rng.choice(['heroes', 'cards'])]
+        elif mutation == 1:
+            deck['heroes'] = deck['heroes'][:rng.choice([0, 4])] if rng.random() < 0.5 else \
+                deck['heroes'] + [dict(deck['heroes'][0], card_id=deck['heroes'][0]['card_id'] + 1)]
+        elif mutation == 2:
+            deck['heroes'][rng.randrange(5)]['turn'] = rng.choice([0, 2, 3, 4, -1])
+        elif mutation == 3:
+            del deck['heroes'][rng.randrange(5)][rng.choice(['card_id', 'turn'])]
+        elif deck['cards']:
+            del deck['cards'][rng.randrange(len(deck['cards']))]['count']
+        return deck
+
+    def corrupt(self, deck_code):
+        """deck_code with its text or its decoded bytes damaged, the checksum is sometimes fixed up to get past it."""
+        rng = self.random
+        if rng.random() < 0.4:
+            code = list(deck_code)
+            mutation = rng.randrange(5)
+            i = rng.randrange(len(code))
+            alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_+/=!'
+            if mutation == 0:
+                del code[rng.randrange(len(code)):]
+            elif mutation == 1:
+                code[i] = rng.choice(alphabet)
+            elif mutation == 2:
+                code.insert(i, rng.choice(alphabet))
+            elif mutation == 3:
+                del code[i]
+            else:
+                code[i] = code[i].swapcase()
+            return ''.join(code)
+
+        data = bytearray(base64.b64decode(deck_code[3:].translate(_from_deck_code)))
+        mutation = rng.randrange(5)
+        if mutation == 0:
+            del data[rng.randrange(len(data) + 1):]
+        elif mutation == 1:
+            data[rng.randrange(len(data))] = rng.randrange(256)
+        elif mutation == 2:
+            data[0] = rng.randrange(16) << 4 | data[0] & 0x0F
+        elif mutation == 3:
+            data += bytes(rng.randrange(256) for _ in range(rng.randint(1, 8)))
+        else:
+            data = bytearray(rng.randrange(256) for _ in range(rng.randint(0, 40)))
+        if len(data) > 2 and rng.random() < 0.6:
+            name_length = min(data[2], len(data) - 3)
+            data[1] = sum(data[3:len(data) - name_length]) & 0xFF
+        return 'ADC' + base64.b64encode(bytes(data)).decode('ascii').translate(_to_deck_code)
+
+    def deck_codes(self, encode, count):
+        """count deck codes, about half of them valid."""
+        codes = []
+        for _ in range(count):
+            deck_code = encode(self.valid_deck())
+            codes.append(deck_code if self.random.random() < 0.5 else self.corrupt(deck_code))
+        return codes
+
+
+def hydrated(cardlib, card_pool, deck):
+    """A decoded deck hydrated against card_pool as card ids, comparable across card modules."""
+    deck = cardlib.Deck.from_code_deck_dict(deck, card_pool)
+    return ([card.card_id for card in deck.heroes], [card.card_id for card in deck.main_deck],
+            [card.card_id for card in deck.items], deck.name)
+
+
+def batch_outcome(batch):
+    if batch[0] != 'ok':
+        return batch
+    batch = batch[1]
+    return 'ok', (list(batch), [error and error.split(':', 1)[0] for error in batch.errors],
+                  list(batch.hero_offsets), list(batch.card_offsets))
+
+
+class Harness:
+    def __init__(self, implementations, card_set_data, seed):
+        """implementations is a list of (name, cards module, adc module), the first is the reference."""
+        self.implementations = implementations
+        self.pools = {name: functools.reduce(operator.add, [cardlib.CardSet.unpack_dict(data, f'{i:02}').cards
+                                                             for i, data in enumerate(card_set_data)])
+                      for name, cardlib, _ in implementations}
+        reference_pool = self.pools[implementations[0][0]]
+        self.cases = CaseGenerator(reference_pool, seed)
+        self.reference_adc = implementations[0][2]
+        self.divergences = []
+        self.counts = {}
+        self.times = {name: {} for name, _, _ in implementations}
+
+    def compare(self, operation, value, run):
+        """Run run(name, cardlib, adclib) for every implementation and record any result unlike the reference's."""
+        results = []
+        for name, cardlib, adclib in self.implementations:
+            start = time.perf_counter()
+            result = run(name, cardlib, adclib)
+            self.times[name][operation] = self.times[name].get(operation, 0) + time.perf_counter() - start
+            results.append((name, result))
+        self.counts[operation] = self.counts.get(operation, 0) + 1
+
+        reference_name, reference = results[0]
+        for name, result in results[1:]:
+            if result != reference:
+                self.divergences.append({'operation': operation, 'input': value,
+                                         'results': {reference_name: repr(reference), name: repr(result)}})
+
+    def round(self, batch_size=16):
+        cases = self.cases
+        valid = [cases.valid_deck() for _ in range(batch_size)]
+        invalid = [cases.invalid_deck() for _ in range(batch_size // 4)]
+        codes = cases.deck_codes(self.reference_adc.DeckEncoder.encode, batch_size)
+
+        for deck in valid + invalid:
+            self.compare('encode', deck, lambda name, cardlib, adclib: outcome(adclib.DeckEncoder.encode, deck))
+        for deck_code in codes:
+            self.compare('decode', deck_code, lambda name, cardlib, adclib: outcome(adclib.DeckDecoder.decode,
+                                                                                   deck_code))
+            self.compare('fingerprint', deck_code,
+                         lambda name, cardlib, adclib: outcome(adclib.DeckDecoder.fingerprint, deck_code))
+
+        self.compare('decode_many', codes, lambda name, cardlib, adclib: batch_outcome(
+            outcome(adclib.DeckDecoder.decode_many, codes)))
+        self.compare('fingerprint_many', codes,
+                     lambda name, cardlib, adclib: outcome(adclib.DeckDecoder.fingerprint_many, codes))
+        for decks in [valid, invalid[:1] + valid]:
+            self.compare('encode_many', decks, lambda name, cardlib, adclib: outcome(
+                lambda: adclib.DeckEncoder.encode_many(adclib.DeckBatch.from_decks(decks))))
+
+        generated = [cases.decks.code_deck_dict() for _ in range(batch_size // 4)]
+        for deck in generated:
+            self.compare('hydrate', deck, lambda name, cardlib, adclib: outcome(hydrated, cardlib, self.pools[name],
+                                                                                deck))
+            self.compare('validate', deck, lambda name, cardlib, adclib: outcome(
+                lambda: cardlib.DeckValidator(self.pools[name]).validate(
+                    cardlib.CountedDeck.from_code_deck_dict(deck, self.pools[name]))))
+
+    def report(self):
+        """Operations run, divergences and per implementation operations per second."""
+        return {'operations': self.counts, 'divergences': len(self.divergences), 'examples': self.divergences[:10],
+                'throughput': {name: {operation: self.counts[operation] / seconds if seconds else None
+                                      for operation, seconds in times.items()}
+                               for name, times in self.times.items()}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-i', '--implementations', nargs='+', choices=list(benchmark.implementations),
+                        default=list(benchmark.implementations))
+    parser.add_argument('--rounds', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write the report as JSON to this file')
+    parser.add_argument('--pyximport', action='store_true', help='compile missing extensions with pyximport')
+    args = parser.parse_args(argv)
+
+    implementations = []
+    for name in args.implementations:
+        modules = benchmark.import_implementation(name, args.pyximport)
+        if modules is None:
+            print(f'skipping {name}, it is not built (see --pyximport)', file=sys.stderr)
+            continue
+        implementations.append((name, *modules))
+    if len(implementations) < 2:
+        print('nothing to compare, at least two implementations are needed', file=sys.stderr)
+        return 2
+
+    card_set_data = [benchmark.synthetic_card_set(0, 1000, seed=args.seed),
+                     benchmark.synthetic_card_set(1, 5000, seed=args.seed + 1)]
+    harness = Harness(implementations, card_set_data, args.seed)
+    for _ in range(args.rounds):
+        harness.round()
+
+    report = harness.report()
+    print(f'{sum(report["operations"].values()):,} operations, {report["divergences"]} divergences')
+    for example in report['examples']:
+        print(json.dumps(example, ensure_ascii=False, default=repr), file=sys.stderr)
+    print(f'{"implementation":<12} ' + ' '.join(f'{operation:>16}' for operation in report['operations']))
+    for name, throughput in report['throughput'].items():
+        print(f'{name:<12} ' + ' '.join(f'{throughput.get(operation) or 0:>14,.0f}/s'
+                                        for operation in report['operations']))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, default=repr)
+
+    return 1 if report['divergences'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
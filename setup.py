@@ -28,7 +28,7 @@ if use_cython:
 else:
     ext_modules += [
         Extension("artifact.adc", ["adc.c"]),
-        Extension("artifact.card", ["card.c"])
+        Extension("artifact.cards", ["cards.c"])
     ]
 
 setup(
@@ -40,5 +40,8 @@ setup(
     url='https://github.com/bernardpazio/artifact',
     author='Bernard Pazio',
     author_email='bernardpazio@gmail.com',
-    install_requires=['requests']
+    packages=['artifact'],
+    py_modules=['adc_py', 'cards_py'],
+    install_requires=['requests'],
+    extras_require={'corpus': ['numpy']}
 )
\ No newline at end of file
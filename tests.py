@@ -1,5 +1,119 @@
+import contextlib
+import http.server
+import importlib.util
+import io
+import json
+import os
+import pathlib
+import pickle
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from adc import DeckEncoder, DeckDecoder
+from adc import DeckBatch, DeckEncoder, DeckDecoder, InvalidDeckException
+import cards
+import cards_py
+
+has_numpy = importlib.util.find_spec('numpy') is not None
+
+
+def card_dict(card_id, card_name, card_type, colour=None, references=None, **kwargs):
+    d = {
+        'card_id': card_id,
+        'base_card_id': card_id,
+        'card_type': card_type,
+        'card_name': {'english': card_name, 'german': card_name + ' (de)'},
+        'card_text': {'english': f'<span>{card_name}</span> text'},
+        'mini_image': {'default': f'https://example.com/{card_id}_mini.png'},
+        'large_image': {'default': f'https://example.com/{card_id}_large.png'},
+        'ingame_image': {'default': f'https://example.com/{card_id}_ingame.png'},
+        'illustrator': 'Artist',
+        'references': references or [],
+    }
+    if colour:
+        d['is_' + colour] = True
+    d.update(kwargs)
+    return d
+
+
+def hero_dict(card_id, card_name, colour, signature_id):
+    return card_dict(card_id, card_name, 'Hero', colour, attack=4, armor=0, hit_points=10,
+                     references=[{'card_id': signature_id, 'ref_type': 'includes', 'count': 3}])
+
+
+card_set_data = {'card_set': {
+    'version': 1,
+    'set_info': {'set_id': 0, 'pack_item_def': 0, 'name': {'english': 'Test Set'}},
+    'card_list': [
+        hero_dict(4005, 'Debbi the Cunning', 'red', 4006),
+        card_dict(4006, 'Cunning Plan', 'Spell', 'red', mana_cost=3),
+        hero_dict(10014, 'Axe', 'red', 10015),
+        card_dict(10015, 'Berserker\'s Call', 'Spell', 'red', mana_cost=3),
+        hero_dict(10017, 'Rix', 'green', 10018),
+        card_dict(10018, 'Rix Signature', 'Spell', 'green', mana_cost=2),
+        hero_dict(10026, 'Drow Ranger', 'green', 10027),
+        card_dict(10027, 'Gust', 'Spell', 'green', mana_cost=5),
+        hero_dict(10047, 'Lich', 'black', 10048),
+        card_dict(10048, 'Chain Frost', 'Spell', 'black', mana_cost=6),
+        card_dict(3000, 'Traveler\'s Cloak', 'Item', gold_cost=3, sub_type='Accessory'),
+        card_dict(3001, 'Blink Dagger', 'Item', gold_cost=5, sub_type='Accessory'),
+    ] + [
+        card_dict(card_id, f'Creep {card_id}', 'Creep', 'green', mana_cost=3, attack=2, hit_points=4)
+        for card_id in [10091, 10102, 10128, 10165, 10168, 10169, 10185, 10234, 10322, 10354]
+    ] + [
+        card_dict(card_id, f'Item {card_id}', 'Item', gold_cost=12, sub_type='Weapon')
+        for card_id in [10223, 10260, 10263]
+    ]
+}}
+
+other_card_set_data = {'card_set': {
+    'version': 1,
+    'set_info': {'set_id': 1, 'name': {'english': 'Other'}},
+    'card_list': [card_dict(20000, 'Other Creep', 'Creep', 'blue'), card_dict(10014, 'Axe Again', 'Hero')]
+}}
+
+
+@contextlib.contextmanager
+def serve(routes, log=None):
+    """Serve routes, a dict of path to JSON document, from a local HTTP server and yield its root URL.
+
+    Responses carry an ETag and honour If-None-Match, each request is appended to log as (path, status).
+    """
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in routes:
+                if log is not None:
+                    log.append((self.path, 404))
+                self.send_error(404)
+                return
+
+            body = json.dumps(routes[self.path]).encode('utf-8')
+            etag = f'"{hash(body) & 0xFFFFFFFF:x}"'
+            status = 304 if self.headers.get('If-None-Match') == etag else 200
+            if log is not None:
+                log.append((self.path, status))
+
+            self.send_response(status)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body) if status == 200 else 0))
+            self.end_headers()
+            if status == 200:
+                self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}'
+    finally:
+        server.shutdown()
+        server.server_close()
 
 
 class ADC(unittest.TestCase):
@@ -21,3 +135,732 @@ class ADC(unittest.TestCase):
     def test_decoder(self):
         decoded_deck = DeckDecoder.decode(self.code)
         assert decoded_deck == self.deck
+
+    def test_fingerprint(self):
+        import adc_py
+        heroes = [dict(hero, turn=turn) for hero, turn in zip(self.deck['heroes'], [1, 1, 2, 3, 1])]
+        same = [self.code, DeckEncoder.encode(dict(self.deck, name='')),
+                DeckEncoder.encode(dict(self.deck, heroes=heroes))]
+        different = DeckEncoder.encode(dict(self.deck, cards=self.deck['cards'][1:]))
+
+        fingerprint = DeckDecoder.fingerprint(self.code)
+        assert len(fingerprint) == 16
+        assert DeckDecoder.fingerprint_many(same + [different, 'ADCbroken']) == [fingerprint] * 3 + [
+            DeckDecoder.fingerprint(different), None]
+        assert DeckDecoder.fingerprint(different) != fingerprint
+        assert adc_py.DeckDecoder.fingerprint(self.code) == fingerprint
+
+
+class Cards:
+    cards = None
+
+    def setUp(self):
+        self.card_set = self.cards.CardSet.unpack_dict(card_set_data, '00')
+
+    def test_get_card_by_id(self):
+        card = self.card_set.get_card_by_id(10014)
+        assert card.card_id == 10014
+        assert self.card_set.get_card_by_id(1) is None
+
+    def test_get_card_by_name(self):
+        assert self.card_set.get_card_by_name('Axe').card_id == 10014
+        assert self.card_set.get_card_by_name('Axe (de)').card_id == 10014
+        assert self.card_set.get_card_by_name('Missing') is None
+
+    def test_add_keeps_index(self):
+        other = self.cards.CardSet.unpack_dict(other_card_set_data, '01')
+        merged = self.card_set.cards + other.cards
+
+        assert len(merged) == len(self.card_set) + len(other)
+        assert merged.get_card_by_id(20000).card_id == 20000
+        assert merged.get_card_by_name('Other Creep (de)').card_id == 20000
+        assert merged.get_idx_by_id(10014) == self.card_set.cards.get_idx_by_id(10014)
+
+    def test_views(self):
+        other = self.cards.CardSet.unpack_dict(other_card_set_data, '01')
+        tail = (self.card_set.cards + other.cards)[-2:]
+        del other
+        assert [card.card_id for card in tail] == [20000, 10014]
+        assert tail.get_card_by_name('Other Creep (de)').card_id == 20000
+        assert tail[0].card_names['german'] == 'Other Creep (de)'
+        assert pickle.loads(pickle.dumps(tail))[0].card_names == tail[0].card_names
+
+        every_other = self.card_set.cards[::2]
+        assert len(every_other) == 13 and every_other.get_idx_by_id(10014) == 1
+        assert every_other.get_idx_by_id(4006) == -1
+
+        # cards keep the list they came from alive
+        card = self.cards.CardSet.unpack_dict(card_set_data, '00').cards[-1]
+        assert card.card_id == 10263
+        with self.assertRaises(IndexError):
+            self.card_set.cards[len(self.card_set)]
+
+    def test_from_code_deck_dict(self):
+        deck = self.cards.Deck.from_code_deck_dict(ADC.deck, self.card_set.cards)
+        assert [hero.card_id for hero in deck.heroes] == [4005, 10014, 10017, 10026, 10047]
+        assert len(deck.items) == 6
+        assert len(deck.main_deck) == 15 + 30
+
+    def test_counted_deck(self):
+        cards = self.card_set.cards
+        assert cards.signatures()[10014] == (10015, 3)
+
+        deck = self.cards.CountedDeck.from_code_deck_dict(ADC.deck, cards)
+        assert deck.cards[10015] == 3 and deck.cards[3000] == 2
+        assert DeckEncoder.encode(deck.to_code_deck_dict(cards)) == ADC.code
+        full_deck = self.cards.Deck.from_code_deck_dict(ADC.deck, cards)
+        assert self.cards.CountedDeck.from_deck(full_deck).cards == deck.cards
+
+        validator = self.cards.DeckValidator(cards)
+        assert validator.validate(deck) == [self.cards.DeckProblem('item_count', None, 9, 6)]
+        deck.cards[10015] = 2
+        deck.cards[3000] = 9
+        deck.heroes[0] = (4006, 1)
+        assert {problem.reason for problem in validator.validate(deck)} == {'hero_turns', 'not_a_hero',
+                                                                           'signature_copies', 'too_many_copies'}
+
+        batch = DeckDecoder.decode_many([ADC.code, 'ADCbroken'])
+        assert validator.validate_many(batch) == [validator.validate(
+            self.cards.CountedDeck.from_code_deck_dict(ADC.deck, cards)), None]
+
+    def test_registry(self):
+        loads = []
+
+        def load_card_set(set_code):
+            loads.append(set_code)
+            return self.cards.CardSet.unpack_dict(card_set_data if set_code == '00' else other_card_set_data, set_code)
+
+        registry = self.cards.CardSetRegistry(('00', '01'), load_card_set)
+        assert registry.get('00') is registry.get('00')
+
+        pool = registry.all_cards()
+        assert pool is registry.all_cards()
+        assert len(pool) == len(self.card_set) + 2
+        assert pool.get_card_by_name('Other Creep').card_id == 20000
+        assert pool.get_idx_by_id(10014) == self.card_set.cards.get_idx_by_id(10014)
+        assert loads == ['00', '01']
+
+        assert registry.invalidate('00', version=1) == []
+        assert registry.invalidate('00', version=2) == ['00']
+        assert '00' not in registry and registry.all_cards() is not pool
+        assert loads == ['00', '01', '00']
+
+    def test_search(self):
+        search = self.card_set.search
+        assert search('axe')[0].card.card_id == 10014
+        assert search('drow')[0].card.card_id == 10026 and search('chain fro')[0].card.card_id == 10048
+        assert search('Berserkers Call')[0].card.card_id == 10015
+        assert search('dagger blink')[0].card.card_id == 3001
+        # fuzzy names
+        assert search('lihc')[0].card.card_id == 10047 and search('travellers')[0].card.card_id == 3000
+        assert search('lihc', fuzzy=False) == []
+        assert [result.card.card_id for result in search('creep', limit=3)] == [10091, 10102, 10128]
+        assert search('text', text=False) == [] and len(search('text', limit=100)) == 25
+        assert self.card_set.cards.search_index() is self.card_set.cards.search_index()
+
+    def test_render(self):
+        card = self.card_set.get_card_by_id(10014)
+        text = str(card)
+        assert 'Name: Axe' in text and 'Axe text' in text and 'HP: 10' in text
+        assert str(self.card_set.get_card_by_id(10014)) is text
+        assert card.render(30) == card.render(30) and max(map(len, card.render(30).split('\n'))) == 30
+        assert 'Gold: 5' in str(self.card_set.get_card_by_id(3001))
+
+    @unittest.skipUnless(has_numpy, 'requires numpy')
+    def test_table(self):
+        cards = self.card_set.cards
+        table = cards.table()
+        assert table is self.card_set.table() and len(table) == len(cards)
+
+        green_creeps = table.select((table.card_type == 'Creep') & (table.colour == 'green') & (table.mana_cost <= 3))
+        assert [green_creeps[i].card_id for i in range(len(green_creeps))] == [10091, 10102, 10128, 10165, 10168,
+                                                                                10169, 10185, 10234, 10322, 10354]
+        assert green_creeps.get_idx_by_id(10102) == 1 and green_creeps.get_card_by_id(4005) is None
+
+        heroes_and_items = table.filter(card_type=['Hero', 'Item'], colour=['red', ''])
+        assert len(heroes_and_items) == 7 and heroes_and_items.get_idx_by_id(10014) == 1
+        assert len(table.filter(sub_type='Weapon')) == 3 and len(table.filter(card_type='Ability')) == 0
+        assert list(table.gold_cost[table.sub_type == 'Weapon']) == [12, 12, 12]
+
+    def test_refresh(self):
+        from artifact import parallel
+
+        updated = json.loads(json.dumps(card_set_data))
+        updated['card_set']['version'] = 2
+        card_list = updated['card_set']['card_list']
+        card_list[2]['hit_points'] = 12
+        card_list[2]['card_name']['english'] = 'Axe Prime'
+        del card_list[1]
+        card_list.append(card_dict(20001, 'New Creep', 'Creep', 'blue'))
+
+        routes = {'/sets/00.json': updated}
+        cache, api_url = self.cards.cache, self.cards.CardSet.api_url
+        with tempfile.TemporaryDirectory() as tmp, serve(routes) as url:
+            routes['/cardset/00/'] = {'cdn_root': url, 'url': '/sets/00.json'}
+            self.cards.cache = pathlib.Path(tmp)
+            self.cards.CardSet.api_url = url + '/cardset/'
+            try:
+                # another process already cached the update, the set is still diffed against its own cards
+                (self.cards.cache / '00.json').write_text(json.dumps(updated))
+                axe = self.card_set.get_card_by_id(10014)
+                removed = self.card_set.get_card_by_id(4006)
+                assert 'HP: 10' in str(axe)
+                decks = parallel.decode_and_hydrate([ADC.code], self.card_set.cards, workers=1)
+                hydrated = [card.card_id for card in decks[0].heroes + decks[0].main_deck + decks[0].items]
+                assert 4006 in hydrated
+
+                assert self.card_set.refresh() == (2, [20001], [10014], [4006])
+                assert self.card_set.version == 2
+                cards = self.card_set.cards
+                # the removed card keeps its slot, so positions held elsewhere still point at the same cards
+                assert len(cards) == len(card_set_data['card_set']['card_list']) + 1 and cards.is_removed(1)
+                assert [card.card_id for card in cards] == [d['card_id'] for d in card_list]
+                assert cards[1].card_id == 4006 and cards.get_idx_by_id(20001) == len(cards) - 1
+                assert [card.card_id for card in decks[0].heroes + decks[0].main_deck + decks[0].items] == hydrated
+                assert [card.hit_points for card in decks[0].heroes if card.card_id == 10014] == [12]
+                assert 4006 not in [result.card.card_id for result in self.card_set.search('cunning plan')]
+                if has_numpy:
+                    assert 4006 not in [card.card_id for card in self.card_set.table().filter(card_type='Spell')]
+                assert axe.hit_points == 12 and removed.card_id == 4006
+                assert 'HP: 12' in str(axe) and 'HP: 12' in str(self.card_set.get_card_by_id(10014))
+                assert str(removed) == str(removed) and max(len(axe.render(width)) for width in range(20, 40))
+                assert self.card_set.get_card_by_name('Axe Prime').card_id == 10014
+                assert self.card_set.get_card_by_name('Axe') is None
+                assert self.card_set.get_card_by_id(4006) is None
+                assert self.card_set.get_card_by_name('New Creep').card_id == 20001
+
+                assert self.card_set.refresh() == (2, [], [], [])
+                assert self.cards.CardSet.load_card_set('00').get_card_by_id(10014).hit_points == 12
+            finally:
+                self.cards.cache, self.cards.CardSet.api_url = cache, api_url
+
+    def test_update_names(self):
+        first = card_dict(30000, 'First', 'Creep', 'blue')
+        second = card_dict(30001, 'Second', 'Creep', 'blue')
+        first['card_name']['german'] = second['card_name']['german'] = 'Geteilt'
+        card_list = self.cards.CardSet.unpack_dict({'card_set': dict(card_set_data['card_set'],
+                                                                     card_list=[first, second])}, '00').cards
+        assert card_list.get_card_by_name('Geteilt').card_id == 30000
+
+        # the changed card no longer has the shared name, the other card still does
+        renamed = dict(first, card_name={'english': 'First', 'german': 'Erste'})
+        card_list.update(changed=[self.cards.Card.unpack_dict(renamed)])
+        assert card_list.get_card_by_name('Geteilt').card_id == 30001
+        assert card_list.get_card_by_name('Erste').card_id == 30000
+
+        card_list.update(removed=[30001])
+        assert card_list.get_card_by_name('Geteilt') is None and card_list.get_card_by_name('Second') is None
+        assert [card.card_id for card in card_list] == [30000] and card_list.get_card_by_name('First').card_id == 30000
+
+    def test_fetcher(self):
+        import requests
+
+        log = []
+        routes = {'/sets/00.json': card_set_data, '/sets/01.json': other_card_set_data}
+        with tempfile.TemporaryDirectory() as tmp, serve(routes, log) as url:
+            for set_code in ['00', '01']:
+                routes[f'/cardset/{set_code}/'] = {'cdn_root': url, 'url': f'/sets/{set_code}.json',
+                                                   'expire_time': int(time.time()) + 3600}
+            fetcher = self.cards.CardSetFetcher(api_url=url + '/cardset/', cache_dir=tmp)
+
+            assert fetcher.fetch_many(['00', '01']) == {'00': card_set_data, '01': other_card_set_data}
+            assert sorted(log) == [('/cardset/00/', 200), ('/cardset/01/', 200), ('/sets/00.json', 200),
+                                   ('/sets/01.json', 200)]
+            assert sorted(os.listdir(tmp)) == ['00.json', '00.meta.json', '01.json', '01.meta.json']
+
+            del log[:]
+            assert fetcher.fetch('00') == card_set_data
+            assert log == []
+
+            routes['/cardset/00/']['expire_time'] = 0
+            assert fetcher.fetch('00', force=True) == card_set_data
+            assert log == [('/cardset/00/', 200), ('/sets/00.json', 304)]
+            assert fetcher.is_expired('00') and not fetcher.is_expired('01')
+
+            # errors and unexpected documents fall back to the cached set
+            del routes['/cardset/00/']
+            assert fetcher.fetch('00', force=True) == card_set_data
+            routes['/cardset/00/'] = {'error': 'unavailable'}
+            assert fetcher.fetch('00', force=True) == card_set_data
+            with self.assertRaises(requests.HTTPError):
+                fetcher.fetch('02')
+
+            # without an expire_time the set is kept until fetched with force
+            del routes['/cardset/01/']['expire_time']
+            fetcher.fetch('01', force=True)
+            assert not fetcher.is_expired('01')
+
+    def test_load_card_sets(self):
+        log = []
+        routes = {'/sets/00.json': card_set_data, '/sets/01.json': other_card_set_data}
+        cache, api_url = self.cards.cache, self.cards.CardSet.api_url
+        with tempfile.TemporaryDirectory() as tmp, serve(routes, log) as url:
+            for set_code in ['00', '01']:
+                routes[f'/cardset/{set_code}/'] = {'cdn_root': url, 'url': f'/sets/{set_code}.json', 'expire_time': 0}
+            self.cards.cache = pathlib.Path(tmp)
+            self.cards.CardSet.api_url = url + '/cardset/'
+            try:
+                card_sets = self.cards.CardSet.load_card_sets(['00', '01'])
+                assert [len(card_set) for card_set in card_sets] == [len(self.card_set), 2]
+                # the expired sets are revalidated once, by load_card_sets, not again by load_card_set
+                assert sorted(log) == [('/cardset/00/', 200), ('/cardset/01/', 200), ('/sets/00.json', 200),
+                                       ('/sets/01.json', 200)]
+            finally:
+                self.cards.cache, self.cards.CardSet.api_url = cache, api_url
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, '00.snapshot')
+            self.cards.CardSetSnapshot.write(card_set_data, path)
+            snapshot = self.cards.CardSetSnapshot(path)
+            card_set = snapshot.card_set('00')
+
+            assert (card_set.set_name, card_set.set_id, card_set.version) == ('Test Set', 0, 1)
+            assert len(card_set) == len(self.card_set)
+            unpickled = pickle.loads(pickle.dumps(card_set.cards))
+            for i in range(len(card_set)):
+                card, expected = card_set.cards[i], self.card_set.cards[i]
+                for key in snapshot_keys:
+                    assert getattr(card, key) == getattr(expected, key)
+                # cards_py snapshot cards load these on first use
+                for key in ['card_text', 'mini_image', 'large_image', 'ingame_image', 'illustrator', 'card_names']:
+                    assert getattr(unpickled[i], key) == getattr(expected, key)
+                assert expected.card_names is not None
+
+            # compiled cards point into the mapping, which can't be closed while any of them is alive
+            del card_set, card
+            snapshot.close()
+
+
+snapshot_keys = ['card_id', 'card_type', 'hit_points', 'armor', 'attack', 'mana_cost', 'gold_cost',
+                 'sub_type', 'card_text', 'colour', 'references', 'mini_image', 'large_image', 'ingame_image',
+                 'illustrator', 'base_card_id', 'card_names']
+
+
+class CardsPy(Cards, unittest.TestCase):
+    cards = cards_py
+
+
+class CardsCython(Cards, unittest.TestCase):
+    cards = cards
+
+
+class DecodeMany(unittest.TestCase):
+    def test_decode_many(self):
+        batch = DeckDecoder.decode_many([ADC.code, 'XYZ', ADC.code[:-30], ADC.code])
+
+        assert len(batch) == 4
+        assert batch[0] == ADC.deck and batch[3] == ADC.deck
+        assert batch[1] is None and batch[2] is None
+        assert batch.errors[1].startswith('DeckDecodingException')
+        assert list(batch.hero_offsets) == [0, 5, 5, 5, 10]
+        assert list(batch.card_offsets) == [0, 15, 15, 15, 30]
+        assert list(batch.card_ids[:3]) == [3000, 3001, 10091]
+
+    def test_decode_many_matches_pure_python(self):
+        import adc_py
+        codes = [ADC.code, ADC.code[:-4], 'ADC', 'ADCJWkTZX05uwGDCRV4XQGy3QGLmqUBg4GQJgGLGgO7AaAB']
+        expected = adc_py.DeckDecoder.decode_many(codes)
+        batch = DeckDecoder.decode_many(codes)
+        assert list(batch) == list(expected)
+        assert batch.errors == expected.errors
+
+
+class EncodeMany(unittest.TestCase):
+    def test_encode_many(self):
+        shuffled = dict(ADC.deck, heroes=ADC.deck['heroes'][::-1], cards=ADC.deck['cards'][::-1])
+        decks = [ADC.deck, shuffled, dict(ADC.deck, name=''), dict(ADC.deck, name='x' * 100)]
+        batch = DeckBatch.from_decks(decks)
+
+        assert DeckEncoder.encode_many(batch) == [DeckEncoder.encode(deck) for deck in decks]
+        assert DeckEncoder.encode_many(DeckDecoder.decode_many([ADC.code])) == [ADC.code]
+
+    def test_encode_many_invalid(self):
+        batch = DeckBatch.from_decks([ADC.deck, dict(ADC.deck, heroes=ADC.deck['heroes'][:4])])
+        with self.assertRaises(InvalidDeckException):
+            DeckEncoder.encode_many(batch)
+
+    def test_counts_below_one(self):
+        import adc as adc_compiled
+        import adc_py
+
+        for count in [0, -1]:
+            deck = dict(ADC.deck, cards=[dict(ADC.deck['cards'][0], count=count)] + ADC.deck['cards'][1:])
+            for module in adc_py, adc_compiled:
+                with self.assertRaises(module.InvalidDeckException):
+                    module.DeckEncoder.encode(deck)
+                with self.assertRaises(module.InvalidDeckException):
+                    module.DeckEncoder.encode_many(module.DeckBatch.from_decks([deck]))
+
+
+class DecodeCommand(unittest.TestCase):
+    def test_decode_jsonl(self):
+        from artifact import cli
+
+        with tempfile.TemporaryDirectory() as directory:
+            codes_path = os.path.join(directory, 'codes.txt')
+            output_path = os.path.join(directory, 'decks.jsonl')
+            with open(codes_path, 'w') as f:
+                f.write(f'{ADC.code}\nADCbroken\n\n{ADC.code}\n')
+
+            cli.main(['decode', codes_path, '-o', output_path, '--chunk-size', '2', '--quiet'])
+
+            with open(output_path) as f:
+                records = [json.loads(line) for line in f]
+
+        assert [record['line'] for record in records] == [1, 2, 4]
+        assert 'error' in records[1]
+        for record in records[0], records[2]:
+            assert {key: record[key] for key in ['heroes', 'cards', 'name']} == ADC.deck
+
+    def test_chunk_size_must_be_positive(self):
+        from artifact import cli
+
+        for command in ['decode', 'dedupe']:
+            for chunk_size in ['0', '-5', 'ten']:
+                with contextlib.redirect_stderr(io.StringIO()) as stderr, self.assertRaises(SystemExit) as exit:
+                    cli.main([command, os.devnull, '--chunk-size', chunk_size, '--quiet'])
+                assert exit.exception.code == 2
+                assert f"argument --chunk-size: '{chunk_size}' is not a positive integer" in stderr.getvalue()
+
+
+class DedupeCommand(unittest.TestCase):
+    def test_dedupe(self):
+        from artifact import cli
+
+        renamed = DeckEncoder.encode(dict(ADC.deck, name='Renamed'))
+        other = DeckEncoder.encode(dict(ADC.deck, cards=ADC.deck['cards'][1:]))
+        with tempfile.TemporaryDirectory() as directory:
+            codes_path = os.path.join(directory, 'codes.txt')
+            output_path = os.path.join(directory, 'decks.jsonl')
+            with open(codes_path, 'w') as f:
+                f.write(f'{other}\n{ADC.code}\nADCbroken\n{renamed}\n{ADC.code}\n')
+
+            cli.main(['dedupe', codes_path, '-o', output_path, '--chunk-size', '2', '--quiet'])
+
+            with open(output_path) as f:
+                records = [json.loads(line) for line in f]
+
+        assert [(record['count'], record['line'], record['code']) for record in records] == [(3, 2, ADC.code),
+                                                                                             (1, 1, other)]
+        assert records[0]['fingerprint'] == DeckDecoder.fingerprint(renamed).hex()
+
+
+class Parallel(unittest.TestCase):
+    def test_decode_and_hydrate(self):
+        import adc_py
+        from artifact import parallel
+
+        card_pool = cards_py.CardSet.unpack_dict(card_set_data, '00').cards
+        decks = parallel.decode_and_hydrate([ADC.code, 'ADCbroken', ADC.code] * 10, card_pool, workers=2,
+                                            chunk_size=4)
+        expected = cards_py.Deck.from_code_deck_dict(ADC.deck, card_pool)
+
+        assert len(decks) == 30
+        assert decks[1] is None and decks.errors[1] is not None
+        for deck in decks[0], decks[29]:
+            assert deck.heroes == expected.heroes
+            assert deck.main_deck == expected.main_deck
+            assert deck.items == expected.items
+            assert deck.name == expected.name
+
+        decks = parallel.decode_and_hydrate([ADC.code] * 3, card_pool, workers=2, decoder=adc_py.DeckDecoder)
+        assert [deck.main_deck for deck in decks] == [expected.main_deck] * 3
+
+    def test_threaded_decode_many(self):
+        import adc_py
+        from artifact import parallel
+
+        codes = [ADC.code, 'ADCbroken', ADC.code] * 10
+        batch = parallel.threaded_decode_many(codes, workers=3, chunk_size=4)
+        expected = DeckDecoder.decode_many(codes)
+
+        assert list(batch) == list(expected)
+        assert batch.errors == expected.errors
+        assert list(batch.card_offsets) == list(expected.card_offsets)
+
+        batch = parallel.threaded_decode_many(codes, workers=3, chunk_size=4, decoder=adc_py.DeckDecoder)
+        assert isinstance(batch, adc_py.DeckBatch) and list(batch) == list(expected)
+
+
+class Cache(unittest.TestCase):
+    def test_decode(self):
+        from artifact.cache import DeckCache
+
+        cache = DeckCache(maxsize=2)
+        renamed = DeckEncoder.encode(dict(ADC.deck, name='Renamed'))
+        other = DeckEncoder.encode(dict(ADC.deck, cards=ADC.deck['cards'][1:]))
+
+        deck = cache.decode(ADC.code)
+        assert deck == ADC.deck
+        deck['heroes'].clear()
+        assert cache.decode(ADC.code) == ADC.deck
+        assert cache.decode(renamed) == dict(ADC.deck, name='Renamed')
+        assert cache.stats() == {'size': 1, 'maxsize': 2, 'hits': 2, 'misses': 1, 'evictions': 0}
+
+        with self.assertRaises(Exception):
+            cache.decode(ADC.code[:-30])
+        cache.decode(other)
+        cache.decode(DeckEncoder.encode(dict(ADC.deck, cards=ADC.deck['cards'][2:])))
+        assert cache.stats() == {'size': 2, 'maxsize': 2, 'hits': 2, 'misses': 4, 'evictions': 1}
+        assert cache.decode(ADC.code) == ADC.deck
+        assert cache.misses == 5
+
+    def test_hydrate(self):
+        from artifact.cache import DeckCache
+
+        card_pool = cards_py.CardSet.unpack_dict(card_set_data, '00').cards
+        cache = DeckCache(card_pool=card_pool)
+        expected = cards_py.Deck.from_code_deck_dict(ADC.deck, card_pool)
+
+        deck = cache.hydrate(ADC.code)
+        renamed = cache.hydrate(DeckEncoder.encode(dict(ADC.deck, name='Renamed')))
+        assert deck.heroes == expected.heroes and deck.main_deck == expected.main_deck
+        assert deck.items == expected.items and deck.name == expected.name
+        assert renamed.main_deck == deck.main_deck and renamed.main_deck is not deck.main_deck
+        assert renamed.name == 'Renamed'
+        deck.main_deck.clear()
+        assert cache.hydrate(ADC.code).main_deck == expected.main_deck
+        assert cache.hits == 2 and cache.misses == 1
+
+        with self.assertRaises(ValueError):
+            DeckCache().hydrate(ADC.code)
+
+
+class Stats(unittest.TestCase):
+    def test_stats(self):
+        import adc_py
+        import artifact
+        from artifact import stats
+        from artifact.cache import DeckCache
+
+        decode = adc_py.DeckDecoder.decode
+        stats.reset()
+        stats.enable(adc=adc_py, cards=cards_py)
+        try:
+            card_pool = cards_py.CardSet.unpack_dict(card_set_data, '00').cards
+            cards_py.Deck.from_code_deck_dict(adc_py.DeckDecoder.decode(ADC.code), card_pool)
+            for code in ['XYZ', ADC.code[:-30]]:
+                with self.assertRaises(Exception):
+                    adc_py.DeckDecoder.decode(code)
+            adc_py.DeckDecoder.decode_many([ADC.code, 'XYZ'])
+            cache = DeckCache()
+            stats.watch('decks', cache)
+            cache.decode(ADC.code)
+        finally:
+            stats.disable()
+        adc_py.DeckDecoder.decode(ADC.code)
+
+        assert adc_py.DeckDecoder.decode is decode and not stats.is_enabled()
+        snapshot = stats.snapshot()
+        decoded = snapshot['stages']['decode']
+        # the DeckCache miss decodes with artifact.adc, which is adc_py unless the extensions are built
+        calls = 4 if artifact.adc is adc_py else 3
+        assert decoded['calls'] == calls and decoded['failure_reasons'] == {'prefix': 1, 'base64': 1}
+        assert sum(count for _, count in decoded['histogram']) == calls and decoded['p50'] <= decoded['max']
+        # decode_many reads the codes the same way
+        assert snapshot['stages']['decode.bytes']['calls'] == calls + 2
+        assert snapshot['stages']['decode_many']['failure_reasons'] == {'prefix': 1}
+        assert snapshot['stages']['deck.hydrate']['calls'] == 1
+        assert snapshot['stages']['card_list.lookup']['calls'] == 25
+        assert snapshot['stages']['card_set.unpack']['calls'] == 1
+        assert snapshot['caches']['decks']['misses'] == 1
+
+    def test_registry_loads(self):
+        from artifact import stats
+
+        # made before stats are enabled, as cards_py.registry is at import
+        registry = cards_py.CardSetRegistry(('00',))
+        cache = cards_py.cache
+        stats.reset()
+        with tempfile.TemporaryDirectory() as tmp:
+            cards_py.cache = pathlib.Path(tmp)
+            (cards_py.cache / '00.json').write_text(json.dumps(card_set_data))
+            stats.enable(cards=cards_py)
+            try:
+                assert len(registry.get('00')) == len(card_set_data['card_set']['card_list'])
+            finally:
+                stats.disable()
+                cards_py.cache = cache
+
+        assert stats.snapshot()['stages']['card_set.load']['calls'] == 1
+
+
+class Imports(unittest.TestCase):
+    def test_import_is_lazy(self):
+        code = ('import sys, pathlib, artifact\n'
+                'from artifact import adc\n'
+                'import cards_py\n'
+                'print(sorted({"requests", "cards_py", "artifact.cards"} & set(sys.modules)), '
+                'pathlib.Path(".cache").exists(), cards_py.cache)')
+        root = os.path.dirname(os.path.abspath(__file__))
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, PYTHONPATH=root, ARTIFACT_CACHE_DIR=os.path.join(tmp, 'sets'))
+            output = subprocess.run([sys.executable, '-c', code], cwd=tmp, env=env, check=True, capture_output=True,
+                                    text=True).stdout
+        assert output.split() == ["['cards_py']", 'False', os.path.join(tmp, 'sets')]
+
+
+class GeneratedSources(unittest.TestCase):
+    def test_c_sources_match_pyx(self):
+        """adc.c and cards.c are what setup.py builds without Cython, they have to be regenerated with every change
+        to adc.pyx or cards.pyx: cython -3 --module-name artifact.cards cards.pyx -o cards.c"""
+        import re
+        try:
+            import Cython
+        except ImportError:
+            self.skipTest('requires Cython')
+
+        root = os.path.dirname(os.path.abspath(__file__))
+        for name in ['adc', 'cards']:
+            with open(os.path.join(root, f'{name}.c')) as f:
+                committed = f.read()
+            version = re.match(r'/\* Generated by Cython (\S+) \*/', committed).group(1)
+            if version != Cython.__version__:
+                self.skipTest(f'{name}.c was generated by Cython {version}, {Cython.__version__} is installed')
+
+            with tempfile.TemporaryDirectory() as tmp:
+                generated = os.path.join(tmp, f'{name}.c')
+                subprocess.run([sys.executable, '-m', 'cython', '-3', '--module-name', f'artifact.{name}',
+                                f'{name}.pyx', '-o', generated], cwd=root, check=True, capture_output=True)
+                with open(generated) as f:
+                    assert f.read() == committed, f'{name}.c is out of date with {name}.pyx'
+
+
+@unittest.skipUnless(has_numpy, 'requires numpy')
+class Corpus(unittest.TestCase):
+    def test_statistics(self):
+        from artifact.corpus import DeckCorpus
+
+        other = dict(ADC.deck, heroes=[dict(hero, card_id=hero['card_id'] + 100) for hero in ADC.deck['heroes']],
+                     cards=ADC.deck['cards'][:2])
+        codes = [ADC.code, 'ADCbroken', ADC.code, DeckEncoder.encode(other)]
+        corpus = DeckCorpus.from_codes(codes, chunk_size=3)
+
+        assert len(corpus) == 3
+        assert corpus[0] == dict(ADC.deck, name='') and corpus[2]['heroes'] == other['heroes']
+
+        frequency = corpus.card_frequency()
+        assert list(frequency.card_ids[:2]) == [3000, 3001]
+        assert list(frequency.decks[:2]) == [3, 3] and list(frequency.copies[:2]) == [6, 3]
+        assert dict(zip(frequency.card_ids.tolist(), frequency.decks.tolist()))[10091] == 2
+
+        pairs, counts = corpus.hero_pair_counts()
+        assert len(pairs) == 20 and counts.sum() == 30
+        assert [4005, 10014] in pairs[counts == 2].tolist()
+
+        card_pool = cards_py.CardSet.unpack_dict(card_set_data, '00').cards
+        assert corpus.colour_distribution(card_pool) == {('black', 'green', 'red'): 2, (): 1}
+
+        with tempfile.TemporaryDirectory() as directory:
+            corpus.save(directory)
+            loaded = DeckCorpus.load(directory)
+            assert loaded[2] == corpus[2]
+            assert loaded.card_frequency().copies.tolist() == frequency.copies.tolist()
+            del loaded
+
+
+@unittest.skipUnless(has_numpy, 'requires numpy')
+class Index(unittest.TestCase):
+    def test_search(self):
+        from artifact.index import DeckIndex
+
+        cheap = dict(ADC.deck, cards=[card for card in ADC.deck['cards'] if card['card_id'] not in (10223, 10260, 10263)])
+        other = dict(ADC.deck, heroes=[dict(hero, card_id=hero['card_id'] + 100) for hero in ADC.deck['heroes']],
+                     cards=ADC.deck['cards'][:2])
+        index = DeckIndex()
+        assert index.add_codes([ADC.code, 'ADCbroken', DeckEncoder.encode(cheap)], chunk_size=2) == range(3)
+        assert index.add(other) == 3 and len(index) == 4
+
+        card_pool = cards_py.CardSet.unpack_dict(card_set_data, '00').cards
+        expensive = index.where(card_pool, lambda card: card.card_type == 'Item' and card.gold_cost > 10)
+        assert list(index.search(index.card(10014) & index.card(3000, min_count=2) & ~expensive)) == [2]
+        assert list(index.search(index.card(3001) | index.card(4105))) == [0, 2, 3]
+        assert list(index.search(index.card(10091, max_count=2))) == []
+        assert list(index.search(~index.any_of([4005, 4105]))) == []
+        assert index.count(index.all()) == 3
+
+        with tempfile.TemporaryDirectory() as directory:
+            index.save(directory)
+            loaded = DeckIndex.load(directory)
+            assert list(loaded.search(~expensive)) == [2, 3]
+            assert loaded.add(ADC.deck) == 4
+            assert list(loaded.search(expensive)) == [0, 4]
+            del loaded
+
+
+class Generate(unittest.TestCase):
+    def test_valid_and_seeded(self):
+        from artifact.generate import DeckGenerator
+
+        card_pool = cards_py.CardSet.unpack_dict(card_set_data, '00').cards
+        generator = DeckGenerator(card_pool, seed=3, main_deck_size=(40, 45), item_count=(9, 15))
+        deck_codes = generator.deck_codes(200)
+        assert deck_codes == DeckGenerator(card_pool, seed=3, main_deck_size=(40, 45),
+                                           item_count=(9, 15)).deck_codes(200)
+
+        validator = cards_py.DeckValidator(card_pool)
+        assert validator.validate_many(DeckDecoder.decode_many(deck_codes)) == [[]] * 200
+        assert generator.deck().is_valid() and validator.is_valid(generator.counted_deck())
+
+        for card_module in cards_py, cards:
+            pool = card_module.CardSet.unpack_dict(card_set_data, '00').cards
+            sizes = dict(main_deck_size=(40, 45), item_count=(9, 15))
+            code_deck_dicts = DeckGenerator(pool, seed=5, **sizes).code_deck_dicts(20)
+            generator = DeckGenerator(pool, seed=5, **sizes)
+            for deck in code_deck_dicts:
+                assert [hero['turn'] for hero in deck['heroes']] == [1, 1, 1, 2, 3]
+                # the same deck as a Deck gives the same code back
+                assert DeckEncoder.encode(generator.deck().to_code_deck_dict()) == DeckEncoder.encode(deck)
+
+        with self.assertRaises(ValueError):
+            DeckGenerator(card_pool)
+
+
+class Builder(unittest.TestCase):
+    def test_codes_and_legality(self):
+        import random
+        import artifact
+        from artifact.builder import DeckBuilder
+        from artifact.generate import DeckGenerator
+
+        builder = DeckBuilder.from_deck_code(ADC.code)
+        assert builder.code() == ADC.code and builder.to_code_deck_dict() == ADC.deck
+        builder.name = ''
+        assert builder.code() == DeckEncoder.encode(dict(ADC.deck, name=''))
+        builder.remove_hero(4005)
+        with self.assertRaises(artifact.adc.InvalidDeckException):
+            builder.code()
+
+        card_pool = cards_py.CardSet.unpack_dict(card_set_data, '00').cards
+        validator = cards_py.DeckValidator(card_pool)
+        generator = DeckGenerator(card_pool, seed=5, main_deck_size=(40, 45), item_count=(9, 15))
+        card_ids = [card_pool[i].card_id for i in range(len(card_pool))] + [1]
+        rng = random.Random(5)
+        for _ in range(20):
+            builder = DeckBuilder.from_code_deck_dict(generator.code_deck_dict('Built'), card_pool)
+            assert builder.is_legal()
+            for _ in range(20):
+                if rng.random() < 0.5 and len(builder.cards):
+                    card_id = rng.choice(builder.cards.card_ids)
+                    builder.swap(card_id, rng.choice(card_ids), rng.randint(1, builder.count(card_id)))
+                else:
+                    builder.add(rng.choice(card_ids), rng.randint(1, 2))
+                assert builder.code() == DeckEncoder.encode(builder.to_code_deck_dict())
+                assert builder.is_legal() == validator.is_valid(builder.counted_deck()) == (not builder.problems())
+
+
+class Fuzz(unittest.TestCase):
+    def test_implementations_agree(self):
+        import adc as adc_compiled
+        import adc_py
+        import benchmark
+        import fuzz
+
+        harness = fuzz.Harness([('python', cards_py, adc_py), ('compiled', cards, adc_compiled)],
+                               [benchmark.synthetic_card_set(0, 1000)], seed=3)
+        for _ in range(20):
+            harness.round()
+        report = harness.report()
+        assert report['operations']['decode'] == 320
+        assert not report['divergences'], report['examples']